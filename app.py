@@ -13,10 +13,18 @@ from flask import Flask, jsonify, request
 from flask_limiter import Limiter
 from flask_login import LoginManager
 
-from cache import _r
-from configs import AppConf, ALLOW_HOST_DOMAINS, API_WHITE_LIST, RedisConf
+from cache import _r, connection_pool
+from cache.connection_pool import MonitoredConnectionPool
+from configs import AppConf, ALLOW_HOST_DOMAINS, API_WHITE_LIST, RedisConf, \
+    HOST_ID
 from logic.flask_extension import ApiMonitor, ReferrerChecker, \
     MongoSessionInterface, LoginManagerLoader
+from logic.api_limiter import ApiLimiter
+from logic.metrics_exporter import MetricsExporter
+from logic.rate_limit import LeasedFixedWindowRateLimiter
+from logic.session_store import get_session_store
+from logic.user_cache import UserCache
+from utils import mongo_client
 from utils.logger import logger
 
 
@@ -37,36 +45,81 @@ app.config['SESSION_COOKIE_DOMAIN'] = AppConf.SESSION_COOKIE_DOMAIN
 app.config['REMEMBER_COOKIE_DOMAIN'] = AppConf.SESSION_COOKIE_DOMAIN
 
 # Init Flask Limiter
+# limits按url创建的连接池没有上限，换成有上限的连接池(见`PooledRedisStorage`)
+limiter_pool = MonitoredConnectionPool.from_url(
+    RedisConf.URL,
+    max_connections=RedisConf.LIMITER_MAX_CONNECTIONS,
+    timeout=RedisConf.POOL_TIMEOUT,
+    health_check_interval=RedisConf.HEALTH_CHECK_INTERVAL,
+    socket_timeout=RedisConf.SOCKET_TIMEOUT,
+    socket_connect_timeout=RedisConf.SOCKET_CONNECT_TIMEOUT
+)
+LeasedFixedWindowRateLimiter.lease_size = AppConf.LIMITER_LEASE_SIZE
+LeasedFixedWindowRateLimiter.workers = AppConf.LIMITER_WORKERS
 limiter = Limiter(
     app,
     key_func=get_remote_address,
-    storage_uri=RedisConf.URL
+    storage_uri='redis+pool://',
+    storage_options={'connection_pool': limiter_pool},
+    strategy=AppConf.LIMITER_STRATEGY
 )
 login_limiter = limiter.shared_limit(
     AppConf.LOGIN_API_LIMITER_STR, scope='login'
 )
 
 
+# Init metrics(各模块在下面登记自己的指标)
+metrics_exporter = MetricsExporter(
+    allow_ips=AppConf.METRICS_ALLOW_IPS, token=AppConf.METRICS_TOKEN)
+metrics_exporter.register('redis_pool', lambda: connection_pool.render({
+    'cache': _r.connection_pool,
+    'limiter': limiter_pool
+}))
+metrics_exporter.register('mongo', mongo_client.render)
+
 # register blueprint
 if AppConf.OPEN_PRODUCT_API:
     from api import api
-    api_monitor = ApiMonitor(redis=_r, logger=logger)
+    api_monitor = ApiMonitor(
+        redis=_r, logger=logger, host_id=HOST_ID,
+        write_behind=AppConf.API_MONITOR_WRITE_BEHIND,
+        buffer_size=AppConf.API_MONITOR_BUFFER_SIZE
+    )
     api_monitor.init_app(api)
     referrer_checker = ReferrerChecker(
         ALLOW_HOST_DOMAINS,
         API_WHITE_LIST
     )
     referrer_checker.init_app(api)
+    api_limiter = ApiLimiter(
+        _r, default_limits=AppConf.API_DEFAULT_LIMITS,
+        ip_func=get_remote_address
+    )
+    api_limiter.init_app(api)
     app.register_blueprint(api, url_prefix='/api')
+    if api_monitor.metrics:
+        metrics_exporter.register('api', api_monitor.metrics.render)
 
 # Init login manager
+LoginManagerLoader.user_cache = UserCache(
+    maxsize=AppConf.USER_CACHE_SIZE, ttl=AppConf.USER_CACHE_TTL)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.token_loader(LoginManagerLoader.load_user)
 login_manager.user_loader(LoginManagerLoader.load_user)
 login_manager.request_loader(LoginManagerLoader.request_callback)
 login_manager.unauthorized_handler(LoginManagerLoader.unauthorized)
-app.session_interface = MongoSessionInterface()
+app.session_interface = MongoSessionInterface(
+    refresh_window=AppConf.SESSION_REFRESH_WINDOW,
+    lookup=AppConf.SESSION_LOOKUP,
+    cookie_format=AppConf.SESSION_COOKIE_FORMAT,
+    store=get_session_store(AppConf.SESSION_STORE, _r,
+                            cache_size=AppConf.SESSION_CACHE_SIZE,
+                            cache_ttl=AppConf.SESSION_CACHE_TTL,
+                            write_behind=AppConf.SESSION_WRITE_BEHIND)
+)
+metrics_exporter.register('user_cache', LoginManagerLoader.user_cache.render)
+metrics_exporter.init_app(app)
 
 
 @app.errorhandler(400)
@@ -124,6 +177,9 @@ def handle_429(e):
         'msg': 'Too Many Requests',
         'err': 30
     }
+    # ApiLimiter使用abort(429, err)区分错误码
+    if isinstance(e.description, int):
+        rsp['err'] = e.description
     logger.error('Too many requests at ip: %s' % get_remote_address())
     return jsonify(**rsp), 429
 
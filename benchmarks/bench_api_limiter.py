@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    bench_api_limiter.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    每秒可以完成的限流检查次数(需要redis)，每次检查3个策略(ip, user, endpoint):
+    * moving-window - Flask-Limiter的moving-window策略，每个策略一次调用
+    * sliding-window - `SlidingWindowLimiter`，一次lua调用检查全部策略
+
+    运行: python -m benchmarks.bench_api_limiter
+
+"""
+import time
+
+from limits import parse
+from limits.storage import RedisStorage
+from limits.strategies import MovingWindowRateLimiter
+
+from cache import _r
+from configs import RedisConf
+from logic.api_limiter import SlidingWindowLimiter
+
+NUMBER = 5000
+LIMITS = [('ip', '1000000/minute'),
+          ('user', '1000000/hour'),
+          ('endpoint', '10000000/minute')]
+
+
+def bench_moving_window():
+    limiter = MovingWindowRateLimiter(RedisStorage(RedisConf.URL))
+    items = [(parse(limit), 'bench|%s' % per) for per, limit in LIMITS]
+    start = time.time()
+    for _ in range(NUMBER):
+        for item, identity in items:
+            limiter.hit(item, identity)
+    return time.time() - start
+
+
+def bench_sliding_window():
+    limiter = SlidingWindowLimiter(_r, key_prefix='bench_limit:')
+    rules = []
+    for per, limit in LIMITS:
+        item = parse(limit)
+        rules.append(('bench|%s' % per, item.amount, item.get_expiry()))
+    start = time.time()
+    for _ in range(NUMBER):
+        limiter.hit(rules)
+    return time.time() - start
+
+
+def main():
+    print('%-16s %12s' % ('strategy', 'checks/s'))
+    for name, bench in (('moving-window', bench_moving_window),
+                        ('sliding-window', bench_sliding_window)):
+        elapsed = bench()
+        print('%-16s %12.1f' % (name, NUMBER / elapsed))
+
+
+if __name__ == '__main__':
+    main()
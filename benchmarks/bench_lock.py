@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    bench_lock.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    并发竞争下各种锁的吞吐量(需要redis，使用`cache._r`):
+    * lock - `BaseLock`，同时只有一个持有者
+    * semaphore - `BaseSemaphore(limit=8)`
+    * rwlock-read - `BaseRWLock`的读锁，90%读 + 10%写
+
+    每个worker循环: 加锁 -> 临界区(sleep) -> 释放
+
+    运行: python -m benchmarks.bench_lock
+
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import random
+import time
+
+import gevent
+
+from cache import BaseLock, BaseSemaphore, BaseRWLock
+
+WORKERS = 32
+DURATION = 5
+# 临界区耗时(秒)
+HOLD = 0.002
+
+
+class BenchLock(BaseLock):
+    def key(self):
+        return 'bench:lock'
+
+
+class BenchSemaphore(BaseSemaphore):
+    limit = 8
+
+    def key(self):
+        return 'bench:semaphore'
+
+
+class BenchRWLock(BaseRWLock):
+    def key(self):
+        return 'bench:rwlock'
+
+
+def lock_worker(deadline, counter):
+    while time.time() < deadline:
+        lock = BenchLock()
+        if lock.acquire(10, 5):
+            gevent.sleep(HOLD)
+            lock.release()
+            counter[0] += 1
+
+
+def semaphore_worker(deadline, counter):
+    while time.time() < deadline:
+        semaphore = BenchSemaphore()
+        if semaphore.acquire(10, 5, sleep=0.01):
+            gevent.sleep(HOLD)
+            semaphore.release()
+            counter[0] += 1
+
+
+def rwlock_worker(deadline, counter):
+    while time.time() < deadline:
+        lock = BenchRWLock()
+        if random.random() < 0.1:
+            if lock.acquire_write(10, 5, sleep=0.01):
+                gevent.sleep(HOLD)
+                lock.release_write()
+                counter[0] += 1
+        elif lock.acquire_read(10, 5, sleep=0.01):
+            gevent.sleep(HOLD)
+            lock.release_read()
+            counter[0] += 1
+
+
+def run(worker):
+    counter = [0]
+    deadline = time.time() + DURATION
+    gevent.joinall([
+        gevent.spawn(worker, deadline, counter) for _ in range(WORKERS)
+    ])
+    return counter[0]
+
+
+def main():
+    print('%-14s %10s %10s' % ('primitive', 'ops', 'ops/s'))
+    for name, worker in (('lock', lock_worker),
+                         ('semaphore', semaphore_worker),
+                         ('rwlock-read', rwlock_worker)):
+        ops = run(worker)
+        print('%-14s %10d %10.1f' % (name, ops, ops / float(DURATION)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    bench_log_serializer.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    对比`FileFormatter`截取log的两种方式的耗时:
+    * dumps - 完整`json.dumps`后再截取(旧实现)
+    * bounded - `utils.log_serializer.bounded_json`
+
+    运行: python -m benchmarks.bench_log_serializer
+
+"""
+import json
+import timeit
+
+from utils.log_serializer import bounded_json
+
+PREFIX = '[2021-01-01 00:00:00,000]|INFO|/srv/app/api/user.py|line:42|get_user|'
+
+
+def dumps_truncate(prefix, obj):
+    s = prefix + json.dumps(obj, ensure_ascii=False)
+    if len(s) > 1000:
+        s = s[:500] + '......' + s[-500:]
+    return s
+
+
+def payloads():
+    small = {'msg': '请求400', 'request': {'method': 'GET', 'url': '/api/user'}}
+    documents = {
+        'msg': 'documents',
+        'data': [
+            {'_id': '%024x' % i, 'phone': '1380000%04d' % (i % 10000),
+             'name': 'user %d' % i, 'gender': i % 3}
+            for i in range(20000)
+        ]
+    }
+    blob = {'msg': 'upload', 'body': 'x' * (4 * 1024 * 1024)}
+    return [
+        ('small dict', small),
+        ('~1.5MB documents', documents),
+        ('4MB string', blob),
+    ]
+
+
+def main():
+    print('%-20s %10s %14s %14s' % ('payload', 'json size', 'dumps (us)',
+                                    'bounded (us)'))
+    for name, obj in payloads():
+        assert dumps_truncate(PREFIX, obj) == bounded_json(PREFIX, obj)
+        size = len(json.dumps(obj, ensure_ascii=False))
+        number = 20000 if size < 1000 else 20
+        results = []
+        for func in (dumps_truncate, bounded_json):
+            cost = min(timeit.repeat(
+                lambda: func(PREFIX, obj), number=number, repeat=3))
+            results.append(cost / number * 1e6)
+        print('%-20s %10d %14.1f %14.1f' % (name, size, results[0],
+                                            results[1]))
+
+
+if __name__ == '__main__':
+    main()
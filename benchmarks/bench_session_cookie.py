@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    bench_session_cookie.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    对比session cookie格式的长度和编解码耗时:
+    * json - `URLSafeTimedSerializer`(默认格式)
+    * msgpack - `CompactSessionSerializer`(不压缩)
+    * msgpack+zlib - `CompactSessionSerializer`(压缩)
+
+    以及没有cookie的POST请求(1MB表单body)按默认顺序cookies>headers>form>args
+    查找session值的耗时:
+    * session_body_lookup - 声明过的接口，解析body
+    * plain - 其他接口，跳过form，不读取body
+
+    运行: python -m benchmarks.bench_session_cookie
+
+"""
+import os
+import timeit
+from urllib.parse import urlencode
+
+from flask import Flask
+from itsdangerous import URLSafeTimedSerializer
+
+from logic.flask_extension import MongoSessionInterface, session_body_lookup
+from logic.session_serializer import CompactSessionSerializer, SESSION_SALT
+
+SECRET_KEY = 'benchmark-secret-key'
+
+
+def sessions():
+    small = {
+        'sid': '5f1a2b3c4d5e6f7a8b9c0d1e',
+        'status': 20,
+        'channel': 'app',
+        'user_id': '5f1a2b3c4d5e6f7a8b9c0d1f',
+        '_fresh': True,
+    }
+    large = dict(small)
+    large.update({
+        'permissions': ['perm_%d' % i for i in range(40)],
+        'indi_user_id': '5f1a2b3c4d5e6f7a8b9c0d20',
+        'login_time': 1609459200,
+    })
+    return [('small', small), ('large', large)]
+
+
+def bench_formats():
+    serializers = [
+        ('json', URLSafeTimedSerializer(SECRET_KEY, SESSION_SALT)),
+        ('msgpack', CompactSessionSerializer(
+            SECRET_KEY, SESSION_SALT, compress=False)),
+        ('msgpack+zlib', CompactSessionSerializer(SECRET_KEY, SESSION_SALT)),
+    ]
+    number = 20000
+    print('%-8s %-14s %8s %12s %12s' % ('session', 'format', 'bytes',
+                                        'dumps (us)', 'loads (us)'))
+    for session_name, data in sessions():
+        for name, s in serializers:
+            val = s.dumps(data)
+            assert s.loads(val) == data
+            dumps = min(timeit.repeat(
+                lambda: s.dumps(data), number=number, repeat=3))
+            loads = min(timeit.repeat(
+                lambda: s.loads(val), number=number, repeat=3))
+            print('%-8s %-14s %8d %12.1f %12.1f' % (
+                session_name, name, len(val),
+                dumps / number * 1e6, loads / number * 1e6))
+
+
+def bench_lookup():
+    root_path = os.path.dirname(os.path.abspath(__file__))
+    app = Flask(__name__, root_path=root_path, instance_path=root_path)
+
+    @app.route('/login', methods=['POST'])
+    @session_body_lookup
+    def login():
+        return ''
+
+    @app.route('/upload', methods=['POST'])
+    def upload():
+        return ''
+
+    body = urlencode({'field_%d' % i: 'x' * 100 for i in range(10000)})
+    interface = MongoSessionInterface(
+        lookup=('cookies', 'headers', 'form', 'args'))
+    number = 20
+    print('%-28s %12s' % ('endpoint', 'request (us)'))
+    for name, path in [('session_body_lookup', '/login'),
+                       ('plain', '/upload')]:
+
+        def lookup_once():
+            # 每次新建请求，body只会被解析一次
+            with app.test_request_context(
+                    path, method='POST', data=body,
+                    content_type='application/x-www-form-urlencoded'):
+                interface.get_session_val(app.session_cookie_name)
+
+        elapsed = min(timeit.repeat(lookup_once, number=number, repeat=3))
+        print('%-28s %12.1f' % (name, elapsed / number * 1e6))
+
+
+def main():
+    bench_formats()
+    print('')
+    bench_lookup()
+
+
+if __name__ == '__main__':
+    main()
@@ -7,10 +7,21 @@
     Defines different kinds of cache instances in this module.
 
 """
+import hashlib
+import json
+import math
+import random
+import time
+from functools import wraps
+
 import redis
-from redis.exceptions import LockError
+from redis.exceptions import LockError, ResponseError
 
-from configs import RedisConf, AppConf
+from configs import RedisConf
+from .connection_pool import MonitoredConnectionPool
+from .lock_queue import LockQueue, record_wait
+from .serializer import get_serializer
+from utils.lru_cache import TTLLRUCache, MISSING
 
 try:
     from redis.lock import LuaLock as Lock
@@ -18,16 +29,92 @@ except ImportError:
     from redis.lock import Lock
 
 
-_r = redis.StrictRedis(
+_r = redis.StrictRedis(connection_pool=MonitoredConnectionPool(
+    max_connections=RedisConf.MAX_CONNECTIONS,
+    timeout=RedisConf.POOL_TIMEOUT,
+    health_check_interval=RedisConf.HEALTH_CHECK_INTERVAL,
+    socket_timeout=RedisConf.SOCKET_TIMEOUT,
+    socket_connect_timeout=RedisConf.SOCKET_CONNECT_TIMEOUT,
+    host=RedisConf.HOST,
+    port=RedisConf.PORT,
+    password=RedisConf.PASSWORD,
+    db=RedisConf.DB
+))
+# 锁等待者BLPOP使用的连接池(不等待空闲连接，用完后等待者改为轮询)，
+# 大量等待者不会占满`_r`的连接池
+_lock_wait_r = redis.StrictRedis(connection_pool=MonitoredConnectionPool(
+    max_connections=RedisConf.LOCK_WAIT_MAX_CONNECTIONS,
+    timeout=0,
+    health_check_interval=RedisConf.HEALTH_CHECK_INTERVAL,
+    socket_timeout=RedisConf.SOCKET_TIMEOUT,
+    socket_connect_timeout=RedisConf.SOCKET_CONNECT_TIMEOUT,
     host=RedisConf.HOST,
     port=RedisConf.PORT,
     password=RedisConf.PASSWORD,
     db=RedisConf.DB
-)
+))
+
+# 标签下的缓存key(zset，分数为过期时间)
+TAG_PREFIX = 'cache_tag:'
+# 标签的版本号
+GENERATION_PREFIX = 'cache_gen:'
+# 版本号的过期时间(秒)，需要大于所有缓存的ttl
+GENERATION_TTL = 7 * 24 * 3600
+# 失效时每批删除的key数量
+INVALIDATE_CHUNK = 500
+# 等待其他请求重建时轮询缓存的间隔(秒)，从最小值开始每次翻倍
+REBUILD_POLL_MIN = 0.01
+REBUILD_POLL_MAX = 0.1
+
+# KEYS[1]: 标签zset
+# ARGV: 缓存key, 过期时间, now, ttl
+TAG_ADD_SCRIPT = """
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[3])
+if redis.call('TTL', KEYS[1]) < tonumber(ARGV[4]) then
+    redis.call('EXPIRE', KEYS[1], ARGV[4])
+end
+"""
+_tag_add_script = _r.register_script(TAG_ADD_SCRIPT)
+# 本进程所有的进程内LRU(标签失效时删除)
+_local_caches = []
 
 
 class Cache(object):
-    """缓存基类"""
+    """缓存基类
+
+    子类实现`key()`和`load()`后可以作为读穿透缓存使用:
+    `get()`依次查找进程内LRU(`local_size`大于0时)、redis，都没有时调用
+    `load()`加载并写入缓存。`load()`的结果先经过一次序列化再返回，无论从
+    哪一层读取，得到的数据类型都相同(json下ObjectId、datetime为字符串)；
+    进程内LRU保存序列化后的数据，每次读取得到新的对象。
+
+    防止缓存击穿:
+    * 提前刷新 - 缓存快过期时按概率(与上次加载耗时和`early_refresh_beta`
+      相关)提前重建，拿到重建锁的请求重建，其他请求继续使用旧值
+    * 缓存不存在时只有拿到重建锁的请求调用`load()`，其他请求轮询缓存key，
+      等待期间不占用连接池中的连接
+
+    标签: `tags()`返回的标签下的缓存可以通过`invalidate_tag(tag)`批量删除，
+    不需要KEYS/SCAN。`tag_mode`:
+    * set - 写入缓存时把key记录到标签的zset中(分数为过期时间，写入时清理
+      已过期的key)，失效时分批删除这些key
+    * generation - 缓存key中带上各标签的版本号，失效时只需要INCR版本号，
+      旧缓存不再被读到，由过期时间自然清理；每次读取多一次MGET版本号
+    """
+    # 缓存时间(秒)
+    ttl = 300
+    # 序列化方式: json / msgpack
+    serializer = 'json'
+    # 进程内LRU的数量和缓存时间(秒)，为0则不使用
+    local_size = 0
+    local_ttl = 5
+    # 提前刷新系数，越大越早刷新，为0则不提前刷新
+    early_refresh_beta = 1.0
+    # 重建锁的过期时间和等待时间(秒)
+    rebuild_timeout = 5
+    # 标签失效方式: set / generation
+    tag_mode = 'set'
 
     def __init__(self):
         self.cache = _r
@@ -36,15 +123,249 @@ class Cache(object):
         """获取缓存key"""
         raise (NotImplementedError())
 
+    def load(self):
+        """从数据源加载数据(读穿透缓存使用)"""
+        raise (NotImplementedError())
+
+    def tags(self):
+        """缓存所属的标签(例如`user:<id>`)"""
+        return ()
+
+    def cache_key(self):
+        """实际使用的缓存key，generation模式下带上各标签的版本号"""
+        return self._cache_keys([self])[0]
+
+    @classmethod
+    def _cache_keys(cls, caches):
+        """批量获取实际的缓存key，generation模式下只MGET一次版本号"""
+        keys = [cache.key() for cache in caches]
+        if cls.tag_mode != 'generation':
+            return keys
+        tags = sorted({tag for cache in caches for tag in cache.tags()})
+        if not tags:
+            return keys
+        generations = dict(zip(tags, caches[0].cache.mget(
+            [GENERATION_PREFIX + tag for tag in tags])))
+        result = []
+        for key, cache in zip(keys, caches):
+            versions = []
+            for tag in cache.tags():
+                version = generations[tag]
+                if isinstance(version, bytes):
+                    version = version.decode('utf-8')
+                versions.append(version or '0')
+            result.append('%s|%s' % (key, ','.join(versions))
+                          if versions else key)
+        return result
+
+    @classmethod
+    def load_many(cls, caches):
+        """批量加载数据(`get_many`使用)，可以覆盖为一次查询
+        :param caches: 实例列表
+        :return values: 与caches顺序一致的数据
+        """
+        return [cache.load() for cache in caches]
+
+    @classmethod
+    def _local_cache(cls):
+        """当前类的进程内LRU"""
+        if not cls.local_size:
+            return None
+        local = cls.__dict__.get('_local')
+        if local is None:
+            local = TTLLRUCache(maxsize=cls.local_size, ttl=cls.local_ttl)
+            cls._local = local
+            _local_caches.append(local)
+        return local
+
+    def _encode(self, value, delta):
+        """保存数据、加载耗时和过期时间"""
+        return get_serializer(self.serializer).dumps(
+            [value, delta, time.time() + self.ttl])
+
+    def _decode(self, raw):
+        """
+        :return (value, delta, expire_at):
+        """
+        return get_serializer(self.serializer).loads(raw)
+
+    def _local_get(self, local, key):
+        """从进程内LRU读取(保存的是序列化后的数据)"""
+        raw = local.get(key)
+        if raw is MISSING:
+            return MISSING
+        return self._decode(raw)[0]
+
+    def _should_refresh(self, delta, expire_at):
+        """XFetch: 越接近过期、加载越慢，越可能提前刷新"""
+        if not self.early_refresh_beta or not delta:
+            return False
+        return time.time() - delta * self.early_refresh_beta * \
+            math.log(1 - random.random()) >= expire_at
+
+    def get(self):
+        """读穿透获取数据"""
+        key = self.cache_key()
+        local = self._local_cache()
+        if local is not None:
+            value = self._local_get(local, key)
+            if value is not MISSING:
+                return value
+
+        raw = self.cache.get(key)
+        if raw is not None:
+            value, delta, expire_at = self._decode(raw)
+            if not self._should_refresh(delta, expire_at):
+                if local is not None:
+                    local.set(key, raw)
+                return value
+            # 其他请求正在重建时直接使用旧值
+            lock = _RebuildLock(key)
+            if not lock.acquire(self.rebuild_timeout, 0):
+                return value
+            try:
+                return self._rebuild(key)
+            finally:
+                lock.release()
+
+        lock = _RebuildLock(key)
+        if not lock.acquire(self.rebuild_timeout, 0):
+            return self._wait_rebuild(key, local)
+        try:
+            # 其他请求可能刚刚重建完成
+            raw = self.cache.get(key)
+            if raw is not None:
+                if local is not None:
+                    local.set(key, raw)
+                return self._decode(raw)[0]
+            return self._rebuild(key)
+        finally:
+            lock.release()
+
+    def _wait_rebuild(self, key, local):
+        """其他请求正在重建: 轮询缓存key，每次只占用连接执行一次GET"""
+        deadline = time.time() + self.rebuild_timeout
+        interval = REBUILD_POLL_MIN
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, REBUILD_POLL_MAX)
+            raw = self.cache.get(key)
+            if raw is not None:
+                if local is not None:
+                    local.set(key, raw)
+                return self._decode(raw)[0]
+        # 等待超时也直接加载，不让请求失败
+        return self._rebuild(key)
+
+    def _rebuild(self, key):
+        start = time.time()
+        value = self.load()
+        return self._store(key, value, time.time() - start)
+
+    def set(self, value, delta=0):
+        """
+        写入缓存
+        :param value: 数据
+        :param delta: 加载耗时(秒)，用于提前刷新
+        """
+        self._store(self.cache_key(), value, delta)
+
+    def _store(self, key, value, delta, pipe=None):
+        """写入redis(set模式下同时登记标签)和进程内LRU
+        :param pipe: 批量写入时使用的pipeline，为None时立即执行
+        :return value: 序列化再反序列化后的数据，与从缓存读到的一致
+        """
+        execute = pipe is None
+        if execute:
+            pipe = self.cache.pipeline(transaction=False)
+        raw = self._encode(value, delta)
+        pipe.setex(key, self.ttl, raw)
+        if self.tag_mode == 'set':
+            now = time.time()
+            for tag in self.tags():
+                _tag_add_script(keys=[TAG_PREFIX + tag],
+                                args=[key, now + self.ttl, now, self.ttl],
+                                client=pipe)
+        if execute:
+            pipe.execute()
+        local = self._local_cache()
+        if local is not None:
+            local.set(key, raw)
+        return self._decode(raw)[0]
+
+    def delete(self):
+        """删除缓存(本进程的LRU和redis)"""
+        key = self.cache_key()
+        self.cache.delete(key)
+        local = self._local_cache()
+        if local is not None:
+            local.delete(key)
+
+    @classmethod
+    def get_many(cls, caches):
+        """批量读穿透: 进程内LRU -> 一次MGET -> `load_many`加载缺失的数据，
+        再通过pipeline写入。批量读取不做提前刷新和重建锁。
+        :param caches: 同一个类的实例列表
+        :return values: 与caches顺序一致的数据
+        """
+        if not caches:
+            return []
+        keys = cls._cache_keys(caches)
+        values = [None] * len(caches)
+        local = cls._local_cache()
+
+        pending = []
+        for i, key in enumerate(keys):
+            value = MISSING if local is None \
+                else caches[i]._local_get(local, key)
+            if value is MISSING:
+                pending.append(i)
+            else:
+                values[i] = value
+        if not pending:
+            return values
+
+        redis = caches[0].cache
+        missing = []
+        for i, raw in zip(pending, redis.mget([keys[i] for i in pending])):
+            if raw is None:
+                missing.append(i)
+                continue
+            values[i] = caches[i]._decode(raw)[0]
+            if local is not None:
+                local.set(keys[i], raw)
+        if not missing:
+            return values
+
+        start = time.time()
+        loaded = cls.load_many([caches[i] for i in missing])
+        delta = (time.time() - start) / len(missing)
+        pipe = redis.pipeline(transaction=False)
+        for i, value in zip(missing, loaded):
+            values[i] = caches[i]._store(keys[i], value, delta, pipe)
+        pipe.execute()
+        return values
+
 
 class BaseLock(Cache):
-    """ 锁"""
+    """ 锁
+
+    `notify`为True(默认`RedisConf.LOCK_NOTIFY`)时使用`LockQueue`:
+    等待者FIFO排队，锁释放时立即唤醒队首；redis不支持lua脚本等操作时
+    退回redis-py Lock的轮询方式。
+    """
+    notify = RedisConf.LOCK_NOTIFY
+    _queue = None
 
     def __init__(self):
         super(BaseLock, self).__init__()
         self.cache = _r
         self.ok = False
         self.lock = None
+        self.token = None
 
     def acquire(self, expire, time_out=None):
         """
@@ -61,22 +382,48 @@ class BaseLock(Cache):
             time_out = expire
 
         # 防止重复获取锁
-        if self.lock is not None and self.ok:
+        if (self.lock is not None or self.token is not None) and self.ok:
             return self.ok
 
+        if self.notify:
+            try:
+                return self._notify_acquire(key, expire, time_out)
+            except ResponseError:
+                # 不支持脚本或BLPOP(例如经过代理)，以后都使用轮询
+                BaseLock.notify = False
+                self.token = None
+
         self.lock = self.cache.lock(
             key, timeout=expire, sleep=0.1, blocking_timeout=time_out,
             lock_class=Lock, thread_local=True
         )
+        start = time.time()
         try:
             self.ok = self.lock.acquire()
         except LockError:
             self.ok = False
+        record_wait(key, time.time() - start, self.ok)
+
+        return self.ok
 
+    def _notify_acquire(self, key, expire, time_out):
+        if BaseLock._queue is None:
+            BaseLock._queue = LockQueue(self.cache, _lock_wait_r)
+        self.token = LockQueue.new_token()
+        self.ok = BaseLock._queue.acquire(key, self.token, expire, time_out)
+        if not self.ok:
+            self.token = None
         return self.ok
 
     def release(self):
         """释放锁"""
+        if self.token is not None:
+            token, self.token = self.token, None
+            if not self.ok:
+                return False
+            self.ok = False
+            return BaseLock._queue.release(self.key(), token)
+
         if self.lock is None or not self.ok:
             self.lock = None
             return False
@@ -87,4 +434,315 @@ class BaseLock(Cache):
         except LockError:
             self.lock = None
             return False
-        return True
\ No newline at end of file
+        return True
+
+
+class _RebuildLock(BaseLock):
+    """读穿透缓存的重建锁"""
+
+    def __init__(self, cache_key):
+        super(_RebuildLock, self).__init__()
+        self.cache_key = cache_key
+
+    def key(self):
+        return '%s:rebuild' % self.cache_key
+
+
+def _args_key(args, kwargs):
+    """函数参数转换成缓存key，过长时使用md5"""
+    text = json.dumps([args, sorted(kwargs.items())], default=str,
+                      separators=(',', ':'))
+    if len(text) > 100:
+        text = hashlib.md5(text.encode('utf-8')).hexdigest()
+    return text
+
+
+def cached(ttl=300, serializer='json', local_size=0, local_ttl=5,
+           key_prefix=None):
+    """
+    函数结果的读穿透缓存，按参数区分缓存::
+
+        @cached(ttl=60, local_size=1000)
+        def get_user(user_id):
+            return User.s_col.find_one({User.Field._id: user_id})
+
+        get_user.invalidate(user_id)  # 删除缓存
+
+    :param ttl: 缓存时间(秒)
+    :param serializer: 序列化方式: json / msgpack
+    :param local_size: 进程内LRU的数量，为0则不使用
+    :param local_ttl: 进程内LRU的缓存时间(秒)
+    :param key_prefix: 缓存key前缀，默认为`cached:<模块>.<函数名>`
+    """
+    def decorator(f):
+        prefix = key_prefix or 'cached:%s.%s' % (f.__module__, f.__name__)
+
+        class FunctionCache(Cache):
+            def __init__(self, args, kwargs):
+                super(FunctionCache, self).__init__()
+                self.args = args
+                self.kwargs = kwargs
+
+            def key(self):
+                return '%s:%s' % (prefix, _args_key(self.args, self.kwargs))
+
+            def load(self):
+                return f(*self.args, **self.kwargs)
+
+        FunctionCache.ttl = ttl
+        FunctionCache.serializer = serializer
+        FunctionCache.local_size = local_size
+        FunctionCache.local_ttl = local_ttl
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            return FunctionCache(args, kwargs).get()
+
+        wrapper.invalidate = \
+            lambda *args, **kwargs: FunctionCache(args, kwargs).delete()
+        wrapper.cache_class = FunctionCache
+        return wrapper
+
+    return decorator
+
+
+def invalidate_tag(tag):
+    """
+    删除标签下的所有缓存:
+    * 版本号加1(generation模式的缓存立即失效)
+    * 分批删除标签zset中登记的key(set模式)
+    本进程的LRU同时删除，其他进程的LRU在`local_ttl`后过期
+    :param tag: 标签
+    """
+    pipe = _r.pipeline(transaction=False)
+    pipe.incr(GENERATION_PREFIX + tag)
+    pipe.expire(GENERATION_PREFIX + tag, GENERATION_TTL)
+    pipe.execute()
+
+    tag_key = TAG_PREFIX + tag
+    while True:
+        keys = _r.zrange(tag_key, 0, INVALIDATE_CHUNK - 1)
+        if not keys:
+            break
+        pipe = _r.pipeline(transaction=False)
+        pipe.delete(*keys)
+        pipe.zrem(tag_key, *keys)
+        pipe.execute()
+        for key in keys:
+            if isinstance(key, bytes):
+                key = key.decode('utf-8')
+            for local in _local_caches:
+                local.delete(key)
+
+
+# KEYS[1]: 持有者zset(token -> 租约到期时间ms)
+# ARGV: token, now(ms), 租约(ms), limit
+SEMAPHORE_ACQUIRE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) == false
+        and redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[4]) then
+    return 0
+end
+local expire_at = tonumber(ARGV[2]) + tonumber(ARGV[3])
+redis.call('ZADD', KEYS[1], expire_at, ARGV[1])
+if redis.call('PTTL', KEYS[1]) < tonumber(ARGV[3]) then
+    redis.call('PEXPIRE', KEYS[1], ARGV[3])
+end
+return 1
+"""
+
+# KEYS[1]: 读者zset, KEYS[2]: 写锁, KEYS[3]: 等待中的写者
+# ARGV: token, now(ms), 租约(ms)
+RW_READ_ACQUIRE_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 1 or redis.call('EXISTS', KEYS[3]) == 1 then
+    return 0
+end
+local expire_at = tonumber(ARGV[2]) + tonumber(ARGV[3])
+redis.call('ZADD', KEYS[1], expire_at, ARGV[1])
+if redis.call('PTTL', KEYS[1]) < tonumber(ARGV[3]) then
+    redis.call('PEXPIRE', KEYS[1], ARGV[3])
+end
+return 1
+"""
+
+# KEYS[1]: 读者zset, KEYS[2]: 写锁, KEYS[3]: 等待中的写者
+# ARGV: token, now(ms), 租约(ms), 等待标记过期时间(ms)
+RW_WRITE_ACQUIRE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+local waiting = redis.call('GET', KEYS[3])
+if redis.call('EXISTS', KEYS[2]) == 0 and redis.call('ZCARD', KEYS[1]) == 0
+        and (not waiting or waiting == ARGV[1]) then
+    redis.call('SET', KEYS[2], ARGV[1], 'PX', ARGV[3])
+    if waiting then
+        redis.call('DEL', KEYS[3])
+    end
+    return 1
+end
+-- 有写者等待时不再接受新的读者，避免写者饿死
+if tonumber(ARGV[4]) > 0 and (not waiting or waiting == ARGV[1]) then
+    redis.call('SET', KEYS[3], ARGV[1], 'PX', ARGV[4])
+end
+return 0
+"""
+
+# KEYS[1]: 写锁, KEYS[2]: 等待中的写者
+# ARGV: token
+RW_WRITE_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[2]) == ARGV[1] then
+    redis.call('DEL', KEYS[2])
+end
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+return 1
+"""
+
+# 等待中写者标记的过期时间(ms)，写者每次重试时刷新
+WRITER_WAIT_MS = 1000
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+class BaseSemaphore(Cache):
+    """ 信号量: 同时最多`limit`个持有者
+
+    持有者保存在zset中(token -> 租约到期时间)，租约过期的持有者在下次
+    acquire时被清除，进程退出不会永久占用名额。
+    """
+    limit = 1
+
+    def __init__(self, limit=None):
+        """
+        :param limit: 最多持有者数量，默认为`self.limit`
+        """
+        super(BaseSemaphore, self).__init__()
+        if limit is not None:
+            self.limit = limit
+        self.ok = False
+        self.token = None
+        self._script = self.cache.register_script(SEMAPHORE_ACQUIRE_SCRIPT)
+
+    def acquire(self, expire, time_out=None, sleep=0.1):
+        """
+        请求信号量
+        :param expire: 租约时间(秒)
+        :param time_out: 超时时间. 如果为None，则超时时间等于expire时间.
+            如果为0，则不阻塞
+        :param sleep: 重试间隔(秒)
+        :return ok:
+        """
+        if self.token is not None and self.ok:
+            return self.ok
+        if time_out is None:
+            time_out = expire
+
+        key = self.key()
+        token = LockQueue.new_token()
+        start = time.time()
+        while True:
+            self.ok = bool(self._script(
+                keys=[key],
+                args=[token, _now_ms(), int(expire * 1000), self.limit]))
+            remaining = start + time_out - time.time()
+            if self.ok or remaining <= 0:
+                break
+            time.sleep(min(sleep, remaining))
+        record_wait(key, time.time() - start, self.ok)
+        self.token = token if self.ok else None
+        return self.ok
+
+    def release(self):
+        """释放信号量"""
+        if self.token is None or not self.ok:
+            return False
+        token, self.token = self.token, None
+        self.ok = False
+        return bool(self.cache.zrem(self.key(), token))
+
+
+class BaseRWLock(Cache):
+    """ 读写锁: 多个读者或者一个写者
+
+    * 读者保存在`<key>:readers` zset中(token -> 租约到期时间)
+    * 写锁为`<key>:writer`，值为写者的token
+    * 写者等待时设置`<key>:writer_wait`，之后的读者需要等待，避免写者饿死
+    """
+
+    def __init__(self):
+        super(BaseRWLock, self).__init__()
+        self.read_token = None
+        self.write_token = None
+        self._read_script = self.cache.register_script(
+            RW_READ_ACQUIRE_SCRIPT)
+        self._write_script = self.cache.register_script(
+            RW_WRITE_ACQUIRE_SCRIPT)
+        self._write_release_script = self.cache.register_script(
+            RW_WRITE_RELEASE_SCRIPT)
+
+    def _keys(self):
+        key = self.key()
+        return [key + ':readers', key + ':writer', key + ':writer_wait']
+
+    def _acquire(self, script, expire, time_out, sleep, wait_ms):
+        if time_out is None:
+            time_out = expire
+        keys = self._keys()
+        token = LockQueue.new_token()
+        start = time.time()
+        while True:
+            remaining = start + time_out - time.time()
+            args = [token, _now_ms(), int(expire * 1000)]
+            if wait_ms is not None:
+                args.append(wait_ms if remaining > 0 else 0)
+            ok = bool(script(keys=keys, args=args))
+            if ok or remaining <= 0:
+                break
+            time.sleep(min(sleep, remaining))
+        record_wait(self.key(), time.time() - start, ok)
+        if not ok and wait_ms is not None:
+            # 放弃等待，删除自己的等待标记
+            self._write_release_script(keys=keys[1:], args=[token])
+        return token if ok else None
+
+    def acquire_read(self, expire, time_out=None, sleep=0.1):
+        """
+        请求读锁
+        :param expire: 租约时间(秒)
+        :param time_out: 超时时间. 如果为None，则超时时间等于expire时间.
+            如果为0，则不阻塞
+        :param sleep: 重试间隔(秒)
+        :return ok:
+        """
+        if self.read_token is None:
+            self.read_token = self._acquire(
+                self._read_script, expire, time_out, sleep, None)
+        return self.read_token is not None
+
+    def release_read(self):
+        """释放读锁"""
+        if self.read_token is None:
+            return False
+        token, self.read_token = self.read_token, None
+        return bool(self.cache.zrem(self._keys()[0], token))
+
+    def acquire_write(self, expire, time_out=None, sleep=0.1):
+        """
+        请求写锁，参数同`acquire_read`
+        :return ok:
+        """
+        if self.write_token is None:
+            self.write_token = self._acquire(
+                self._write_script, expire, time_out, sleep,
+                max(WRITER_WAIT_MS, int(sleep * 3000)))
+        return self.write_token is not None
+
+    def release_write(self):
+        """释放写锁"""
+        if self.write_token is None:
+            return False
+        token, self.write_token = self.write_token, None
+        return bool(self._write_release_script(
+            keys=self._keys()[1:], args=[token]))
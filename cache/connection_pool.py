@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    connection_pool.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    有上限的redis连接池
+
+    在`BlockingConnectionPool`的基础上:
+    * 连接数达到上限后等待其他请求释放连接，超过`timeout`秒抛出ConnectionError
+    * 空闲超过`health_check_interval`秒的连接取出时先PING，失败则重新连接，
+      不把断开的连接交给调用方
+    * 统计连接数、等待数和取连接的耗时
+
+    gevent monkey patch之后连接池的队列和锁都是协程安全的。
+
+    按requirements.txt中的redis-py 2.10.x实现(celery 3.1使用的kombu 3.0
+    不支持redis-py 3)，2.10没有内置的连接健康检查，所以在这里自己PING。
+
+"""
+import socket
+import time
+
+from redis.connection import BlockingConnectionPool
+from redis.exceptions import ConnectionError, TimeoutError
+
+
+class MonitoredConnectionPool(BlockingConnectionPool):
+    """带健康检查和统计的阻塞连接池"""
+
+    def __init__(self, max_connections=50, timeout=5,
+                 health_check_interval=30, **connection_kwargs):
+        """
+        :param max_connections: 最大连接数
+        :param timeout: 等待空闲连接的最长时间(秒)，None为一直等待
+        :param health_check_interval: 连接空闲超过该秒数后，取出时先PING，
+            为None则不检查
+        :param connection_kwargs: 传给`Connection`的参数(socket_timeout等)
+        """
+        self.health_check_interval = health_check_interval
+        super(MonitoredConnectionPool, self).__init__(
+            max_connections=max_connections, timeout=timeout,
+            **connection_kwargs)
+
+    def reset(self):
+        super(MonitoredConnectionPool, self).reset()
+        self.in_use = 0
+        self.waiters = 0
+        self.checkouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.health_check_failures = 0
+
+    def get_connection(self, command_name, *keys, **options):
+        start = time.time()
+        self.waiters += 1
+        try:
+            connection = super(MonitoredConnectionPool, self).get_connection(
+                command_name, *keys, **options)
+        finally:
+            self.waiters -= 1
+        elapsed = time.time() - start
+        self.in_use += 1
+        self.checkouts += 1
+        self.wait_time += elapsed
+        if elapsed > self.max_wait_time:
+            self.max_wait_time = elapsed
+
+        try:
+            self._check_health(connection)
+        except BaseException:
+            self.release(connection)
+            raise
+        return connection
+
+    def _check_health(self, connection):
+        """空闲太久的连接先PING，失败时断开，由下一个命令重新连接"""
+        if self.health_check_interval is None or connection._sock is None:
+            return
+        last_used = getattr(connection, 'last_used', None)
+        if last_used is None or \
+                time.time() - last_used < self.health_check_interval:
+            return
+        try:
+            connection.send_command('PING')
+            if connection.read_response() not in (b'PONG', 'PONG'):
+                raise ConnectionError('Bad PING response')
+        except (ConnectionError, TimeoutError, socket.error):
+            self.health_check_failures += 1
+            connection.disconnect()
+
+    def release(self, connection):
+        connection.last_used = time.time()
+        if connection.pid == self.pid:
+            self.in_use -= 1
+        super(MonitoredConnectionPool, self).release(connection)
+
+    def stats(self):
+        """统计信息"""
+        created = len(self._connections)
+        return {
+            'max_connections': self.max_connections,
+            'created': created,
+            'in_use': self.in_use,
+            'idle': created - self.in_use,
+            'waiters': self.waiters,
+            'checkouts': self.checkouts,
+            'wait_time': self.wait_time,
+            'max_wait_time': self.max_wait_time,
+            'health_check_failures': self.health_check_failures,
+        }
+
+
+def render(pools):
+    """输出Prometheus文本格式
+    :param pools: 名称 -> `MonitoredConnectionPool`
+    """
+    stats = {name: pool.stats() for name, pool in pools.items()}
+    lines = []
+    for name, kind, help_text in (
+            ('max_connections', 'gauge', 'Redis pool size limit.'),
+            ('created', 'gauge', 'Redis connections created.'),
+            ('in_use', 'gauge', 'Redis connections in use.'),
+            ('waiters', 'gauge', 'Callers waiting for a redis connection.'),
+            ('checkouts', 'counter', 'Redis connection checkouts.'),
+            ('wait_time', 'counter', 'Redis checkout wait in seconds.'),
+            ('max_wait_time', 'gauge', 'Longest redis checkout wait.'),
+            ('health_check_failures', 'counter',
+             'Idle redis connections that failed PING.')):
+        metric = 'redis_pool_%s' % name
+        lines.append('# HELP %s %s' % (metric, help_text))
+        lines.append('# TYPE %s %s' % (metric, kind))
+        for pool_name in sorted(stats):
+            lines.append('%s{pool="%s"} %s'
+                         % (metric, pool_name, stats[pool_name][name]))
+    return '\n'.join(lines) + '\n'
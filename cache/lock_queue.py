@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    lock_queue.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    通知方式的redis锁(供`BaseLock`使用)
+
+    等待者按顺序排在`<key>:queue`列表中，只有队首可以获得锁(FIFO)。
+    `release()`删除锁后向队首的`<key>:wake:<token>`列表LPUSH，等待者通过
+    BLPOP阻塞在自己的列表上，锁释放后立即被唤醒，不再每100ms轮询一次。
+
+    * 每个等待者有一个`<key>:alive:<token>`标记，每次重试时刷新，进程退出后
+      标记过期，排在前面的失效等待者会被跳过
+    * BLPOP最多阻塞1秒，持有者没有释放(锁过期)时等待者也能在1秒内重新检查
+    * 锁的值与redis-py的Lock相同(随机token)，两种方式可以混用
+    * BLPOP在单独的连接池(`wait_redis`)上执行，等待者不占用业务连接池；
+      等待连接池没有空闲连接时，其余等待者改为短轮询
+
+"""
+import time
+import uuid
+
+from redis.exceptions import ConnectionError
+
+from utils.lru_cache import TTLLRUCache, MISSING
+
+# 队首之前失效的等待者出队，返回队首
+_POP_DEAD_HEAD = """
+local prefix = KEYS[1] .. ':'
+local function live_head(token)
+    local head = redis.call('LINDEX', KEYS[2], 0)
+    while head and head ~= token
+            and redis.call('EXISTS', prefix .. 'alive:' .. head) == 0 do
+        redis.call('LPOP', KEYS[2])
+        head = redis.call('LINDEX', KEYS[2], 0)
+    end
+    return head
+end
+local function wake_head()
+    local head = live_head(nil)
+    if head then
+        redis.call('LPUSH', prefix .. 'wake:' .. head, 1)
+        redis.call('PEXPIRE', prefix .. 'wake:' .. head, ARGV[#ARGV])
+    end
+end
+"""
+
+# KEYS: lock, queue
+# ARGV: token, 锁过期时间(ms), 是否排队(0/1), 等待者标记过期时间(ms)
+ACQUIRE_SCRIPT = _POP_DEAD_HEAD + """
+local token = ARGV[1]
+local head = live_head(token)
+if redis.call('EXISTS', KEYS[1]) == 0 and (not head or head == token) then
+    redis.call('SET', KEYS[1], token, 'PX', ARGV[2])
+    if head then
+        redis.call('LPOP', KEYS[2])
+    end
+    redis.call('DEL', prefix .. 'alive:' .. token, prefix .. 'wake:' .. token)
+    return 1
+end
+if ARGV[3] == '1' then
+    local alive = prefix .. 'alive:' .. token
+    if redis.call('SET', alive, 1, 'PX', ARGV[4], 'NX') then
+        redis.call('RPUSH', KEYS[2], token)
+    else
+        redis.call('PEXPIRE', alive, ARGV[4])
+    end
+    if redis.call('PTTL', KEYS[2]) < tonumber(ARGV[4]) then
+        redis.call('PEXPIRE', KEYS[2], ARGV[4])
+    end
+end
+return 0
+"""
+
+# KEYS: lock, queue
+# ARGV: token, 唤醒列表过期时间(ms)
+RELEASE_SCRIPT = _POP_DEAD_HEAD + """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+wake_head()
+return 1
+"""
+
+# 超时退出队列，锁空闲时唤醒下一个等待者
+# KEYS: lock, queue
+# ARGV: token, 唤醒列表过期时间(ms)
+LEAVE_SCRIPT = _POP_DEAD_HEAD + """
+redis.call('LREM', KEYS[2], 0, ARGV[1])
+redis.call('DEL', prefix .. 'alive:' .. ARGV[1], prefix .. 'wake:' .. ARGV[1])
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    wake_head()
+end
+return 1
+"""
+
+# 等待者标记的过期时间(ms)，需要大于BLPOP的阻塞时间
+ALIVE_MS = 3000
+# BLPOP的阻塞时间(秒)，redis 6以前只支持整数
+WAKE_TIMEOUT = 1
+
+# 统计最多保存的key数量和没有再加锁后保留的时间(秒)。读穿透缓存每个key都有
+# 一个重建锁，统计按LRU淘汰，不会无限增长
+STATS_MAXSIZE = 10000
+STATS_TTL = 3600
+
+# key -> 统计信息
+_stats = TTLLRUCache(maxsize=STATS_MAXSIZE, ttl=STATS_TTL)
+
+
+def record_wait(key, waited, ok):
+    """记录一次加锁的等待时间和结果"""
+    stats = _stats.get(key)
+    if stats is MISSING:
+        stats = {
+            'acquisitions': 0,
+            'timeouts': 0,
+            'wait_time': 0.0,
+            'max_wait_time': 0.0,
+        }
+    if ok:
+        stats['acquisitions'] += 1
+    else:
+        stats['timeouts'] += 1
+    stats['wait_time'] += waited
+    if waited > stats['max_wait_time']:
+        stats['max_wait_time'] = waited
+    # 每次加锁都刷新过期时间
+    _stats.set(key, stats)
+
+
+def lock_stats():
+    """
+    各个锁的竞争统计(本进程，最近`STATS_TTL`秒内加过锁的最多`STATS_MAXSIZE`
+    个key)
+    :return stats: key -> 获得次数、超时次数、等待总时间、最长等待时间
+    """
+    return {key: dict(stats) for key, stats in _stats.items()}
+
+
+class LockQueue(object):
+    """FIFO通知锁"""
+
+    def __init__(self, redis, wait_redis=None):
+        """
+        :param redis: Redis链接
+        :param wait_redis: 等待者BLPOP使用的Redis链接，连接池应当不等待
+            空闲连接(timeout=0)，默认与`redis`相同
+        """
+        self.redis = redis
+        self.wait_redis = wait_redis or redis
+        self._acquire = redis.register_script(ACQUIRE_SCRIPT)
+        self._release = redis.register_script(RELEASE_SCRIPT)
+        self._leave = redis.register_script(LEAVE_SCRIPT)
+
+    @staticmethod
+    def new_token():
+        return uuid.uuid1().hex
+
+    def acquire(self, key, token, expire, time_out):
+        """
+        :param key: 锁的key
+        :param token: 本次加锁的token
+        :param expire: 锁的过期时间(秒)
+        :param time_out: 等待时间(秒)，0为不等待
+        :return ok:
+        """
+        keys = [key, key + ':queue']
+        expire_ms = int(expire * 1000)
+        start = time.time()
+        deadline = start + time_out
+        ok = False
+        try:
+            while True:
+                remaining = deadline - time.time()
+                ok = bool(self._acquire(keys=keys, args=[
+                    token, expire_ms, 1 if remaining > 0 else 0, ALIVE_MS]))
+                if ok or remaining <= 0:
+                    break
+                # 最后不到1秒时BLPOP无法精确超时，改为短轮询
+                if remaining < WAKE_TIMEOUT or not self._wait(key, token):
+                    time.sleep(min(remaining, 0.1))
+        finally:
+            if not ok and time_out > 0:
+                self._leave(keys=keys, args=[token, ALIVE_MS])
+            record_wait(key, time.time() - start, ok)
+        return ok
+
+    def _wait(self, key, token):
+        """
+        阻塞等待唤醒
+        :return ok: 等待连接池没有空闲连接时返回False
+        """
+        try:
+            self.wait_redis.blpop(
+                '%s:wake:%s' % (key, token), timeout=WAKE_TIMEOUT)
+        except ConnectionError:
+            return False
+        return True
+
+    def release(self, key, token):
+        """
+        :return ok: 锁是否仍由token持有
+        """
+        return bool(self._release(
+            keys=[key, key + ':queue'], args=[token, ALIVE_MS]))
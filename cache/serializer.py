@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    serializer.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    读穿透缓存的序列化方式(`Cache.serializer`)
+
+    * `json` - 可读，兼容其他语言
+    * `msgpack` - 更短、更快，需要安装msgpack
+
+    不能直接序列化的值(ObjectId、datetime等)转换成字符串；`strict`为True时
+    抛出TypeError。
+
+"""
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class JsonSerializer(object):
+
+    def __init__(self, strict=False):
+        self.default = None if strict else str
+
+    def dumps(self, obj):
+        return json.dumps(obj, default=self.default, separators=(',', ':'))
+
+    @staticmethod
+    def loads(raw):
+        if isinstance(raw, bytes):
+            raw = raw.decode('utf-8')
+        return json.loads(raw)
+
+
+class MsgpackSerializer(object):
+
+    def __init__(self, strict=False):
+        if msgpack is None:
+            raise RuntimeError('msgpack is required for msgpack serializer')
+        self.default = None if strict else str
+
+    def dumps(self, obj):
+        return msgpack.packb(obj, use_bin_type=True, default=self.default)
+
+    @staticmethod
+    def loads(raw):
+        return msgpack.unpackb(raw, raw=False)
+
+
+_serializers = {}
+
+
+def get_serializer(name, strict=False):
+    """
+    :param name: 序列化方式名称(`json`, `msgpack`)
+    :param strict: 不能直接序列化的值抛出TypeError，而不是转换成字符串
+    :return serializer: 有`dumps`和`loads`方法的对象
+    """
+    serializer = _serializers.get((name, strict))
+    if serializer is None:
+        if name == 'json':
+            serializer = JsonSerializer(strict)
+        elif name == 'msgpack':
+            serializer = MsgpackSerializer(strict)
+        else:
+            raise ValueError('Unknown cache serializer: %s' % name)
+        _serializers[name, strict] = serializer
+    return serializer
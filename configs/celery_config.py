@@ -39,6 +39,10 @@ class DefaultCeleryConfig(BaseCeleryConfig):
             'queue': DEFAULT_QUEUE,
             'routing_key': DEFAULT_QUEUE
         },
+        'default_batch_task': {
+            'queue': DEFAULT_QUEUE,
+            'routing_key': DEFAULT_QUEUE
+        },
     }
     CELERY_QUEUES = {
         DEFAULT_QUEUE: {
@@ -69,6 +73,17 @@ class ScheduleCeleryConfig(BaseCeleryConfig):
                 'exchange_type': 'direct'
             }
         },
+        # 批量任务定时消费，回收worker崩溃后过期租约中的数据
+        'default_batch_task': {
+            'task': 'default_batch_task',
+            'schedule': crontab(minute='*'),
+            'options': {
+                'queue': DEFAULT_QUEUE,
+                'routing_key': DEFAULT_QUEUE,
+                'exchange': DEFAULT_QUEUE,
+                'exchange_type': 'direct'
+            }
+        },
     }
 
 
@@ -20,12 +20,38 @@ class AppConf(object):
     SECRET_KEY = ''
     SESSION_COOKIE_NAME = ''
     SESSION_COOKIE_DOMAIN = None
+    # permanent session距离过期小于该秒数时重新设置cookie，为None则只在修改时设置
+    SESSION_REFRESH_WINDOW = None
+    # session值的查找顺序(form只对`session_body_lookup`装饰的接口生效)
+    SESSION_LOOKUP = ('cookies', 'headers', 'form', 'args')
+    # session cookie格式: json / msgpack
+    SESSION_COOKIE_FORMAT = 'json'
+    # 服务端session存储: None(保存在cookie中) / redis / mongo
+    SESSION_STORE = None
+    # 服务端session的本地缓存数量和缓存时间(秒)
+    SESSION_CACHE_SIZE = 10000
+    SESSION_CACHE_TTL = 60
+    # 已有session的修改是否异步批量写入服务端存储
+    SESSION_WRITE_BEHIND = False
+    # 进程内用户信息缓存数量和缓存时间(秒)
+    USER_CACHE_SIZE = 10000
+    USER_CACHE_TTL = 60
     DEBUG = False  # Change to True if in dev environment
     PORT = 10004
     BIND_IP = '0.0.0.0'
     ALLOW_HOST_DOMAINS = []
     API_WHITE_LIST = []
     LOGIN_API_LIMITER_STR = '500/hour;60/minute'
+    # 限流策略: fixed-window(每个请求访问redis) / leased-fixed-window
+    # (本地预扣额度，见`logic.rate_limit`)
+    LIMITER_STRATEGY = 'fixed-window'
+    # leased-fixed-window每次最多预扣的额度
+    LIMITER_LEASE_SIZE = 50
+    # 共用redis限流计数的进程总数(所有主机)，限制小于100 * 进程数时不预扣
+    LIMITER_WORKERS = 1
+    # /api所有接口的限流策略: [(ip/user/endpoint, 限制)]，例如
+    # [('ip', '600/minute'), ('user', '3000/hour')]
+    API_DEFAULT_LIMITS = []
 
     # Domain
     HOST_DOMAIN = ''
@@ -34,6 +60,15 @@ class AppConf(object):
     # Blueprint switch
     OPEN_PRODUCT_API = True
 
+    # ApiMonitor请求登记是否异步批量写入redis
+    API_MONITOR_WRITE_BEHIND = False
+    API_MONITOR_BUFFER_SIZE = 10000
+
+    # /metrics只允许这些ip直接访问(不经过反向代理)，或者带
+    # `Authorization: Bearer <METRICS_TOKEN>`访问
+    METRICS_ALLOW_IPS = ['127.0.0.1']
+    METRICS_TOKEN = ''
+
     # api salt
     CUR_APP_API_SALT = ''  # 当前APP API salt
 
@@ -45,6 +80,19 @@ class RedisConf(object):
     DB = 0
     PASSWORD = ''
     URL = 'redis://localhost:6379/0'
+    # 连接池大小，连接用完后等待的最长时间(秒)
+    MAX_CONNECTIONS = 50
+    LIMITER_MAX_CONNECTIONS = 20
+    POOL_TIMEOUT = 5
+    # 读写和建立连接的超时时间(秒)
+    SOCKET_TIMEOUT = 5
+    SOCKET_CONNECT_TIMEOUT = 2
+    # 连接空闲超过该秒数后，使用前先PING检查
+    HEALTH_CHECK_INTERVAL = 30
+    # BaseLock释放时通知等待者(FIFO)，为False时每100ms轮询
+    LOCK_NOTIFY = True
+    # 锁等待者BLPOP的连接池大小，用完后其余等待者改为每100ms轮询
+    LOCK_WAIT_MAX_CONNECTIONS = 20
 
 
 class MongoConf(object):
@@ -56,6 +104,10 @@ class MongoConf(object):
     PWD = ''
     IS_REPLICA = False
     REPLICA = ''
+    # 各用途的连接数，共用一个连接池，连接池大小为总和
+    POOL_SIZES = {'model': 50, 'log': 10}
+    # 启动时主节点和从节点各预先建立的连接数
+    WARM_UP_CONNECTIONS = 0
 
 
 class CeleryConf(object):
@@ -63,6 +115,16 @@ class CeleryConf(object):
     DEFAULT_BROKER_URL = ''
     # default_celery并发
     DEFAULT_CELERY_CONCURRENCE = 1
+    # 批量任务每批最多处理的数量
+    BATCH_SIZE = 100
+    # 批量任务不足一批时最多等待的时间(毫秒)
+    BATCH_MAX_WAIT = 200
+    # 批量任务处理一批的租约时间(秒)，worker崩溃后超过该时间数据重新入队
+    BATCH_LEASE_TIMEOUT = 300
+    # 批量任务单个数据失败后的最多重试次数
+    BATCH_MAX_RETRIES = 3
+    # 批量任务最多同时执行的消费任务数(每batch_size个排队的数据一个)
+    BATCH_CONCURRENCY = 4
 
 
 class ProjectConf(object):
@@ -77,4 +139,17 @@ class LoggerConf(object):
     """Config of logger"""
     LOG_DIR = './logs'  # log文件都放在该目录下
     DEFAULT_PATH = '%s/default.log' % LOG_DIR
+    # 异步写log: 队列满时的策略为 block / drop_oldest / drop_debug
+    ASYNC_MODE = False
+    ASYNC_QUEUE_SIZE = 10000
+    ASYNC_OVERFLOW = 'block'
+    # 文件写入缓冲区大小(字节)，为0则每条log直接写入。ERROR以上级别总是立即写入
+    FILE_BUFFER_SIZE = 0
+    # 后台gzip压缩切分后的log文件
+    COMPRESS_ROTATED = False
+    # 切分后的log文件总大小上限(字节)，为0则不限制
+    MAX_TOTAL_BYTES = 0
+    # 高频log采样(SamplingFilter参数)，为None则不采样。例如:
+    # {'first_n': 10, 'window': 60, 'rates': {'INFO': 100, 'WARNING': 10}}
+    SAMPLING = None
 
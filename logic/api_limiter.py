@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    api_limiter.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    接口限流: 按接口、用户、IP声明限流策略，一次lua调用检查所有策略
+
+    每个策略使用滑动窗口计数(近似): 时间按窗口长度分段，计数为
+        上一段次数 * (1 - 当前段已过去的比例) + 当前段次数
+    每个key只需要两个计数器，与限制的大小无关(moving-window需要保存每次
+    请求的时间)。只有所有策略都没有超出时才计数，被拒绝的请求不占用额度。
+
+    使用::
+
+        api_limiter = ApiLimiter(_r, default_limits=[('ip', '600/minute')])
+        api_limiter.init_app(api)
+
+        @api.route('/login', methods=['POST'])
+        @api_limiter.limit('10/minute', per='ip')
+        @api_limiter.limit('1000/minute', per='endpoint')
+        def login():
+            ...
+
+    `default_limits`对整个blueprint计数(不区分接口)，装饰器声明的策略按接口
+    计数。响应带有剩余额度最少的策略的`X-RateLimit-Limit`,
+    `X-RateLimit-Remaining`, `X-RateLimit-Reset`头，超出限制时返回429
+    (`err`为`ERR_RATE_LIMITED`)。
+
+"""
+import time
+
+from flask import g, request, abort, current_app
+from flask_login import current_user
+from limits import parse
+
+# KEYS: 每个策略两个key(当前段, 上一段)
+# ARGV: now, 每个策略的(limit, window)
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local n = #KEYS / 2
+local counts = {}
+local allowed = 1
+for i = 1, n do
+    local limit = tonumber(ARGV[i * 2])
+    local window = tonumber(ARGV[i * 2 + 1])
+    local cur = tonumber(redis.call('GET', KEYS[i * 2 - 1]) or '0')
+    local prev = tonumber(redis.call('GET', KEYS[i * 2]) or '0')
+    local weight = 1 - (now % window) / window
+    counts[i] = prev * weight + cur
+    if counts[i] + 1 > limit then
+        allowed = 0
+    end
+end
+local result = {allowed}
+for i = 1, n do
+    local limit = tonumber(ARGV[i * 2])
+    local window = tonumber(ARGV[i * 2 + 1])
+    local count = counts[i]
+    if allowed == 1 then
+        redis.call('INCR', KEYS[i * 2 - 1])
+        redis.call('EXPIRE', KEYS[i * 2 - 1], window * 2)
+        count = count + 1
+    end
+    result[i + 1] = math.max(0, math.floor(limit - count))
+end
+return result
+"""
+
+# 策略的作用范围
+PER_IP = 'ip'
+PER_USER = 'user'
+PER_ENDPOINT = 'endpoint'
+
+# 超出限制时的错误码(Flask-Limiter为30)
+ERR_RATE_LIMITED = 60
+
+
+class RateLimitResult(object):
+    """一次检查的结果
+    * `allowed` (bool) - 是否放行
+    * `limit` (int) - 剩余额度最少的策略的限制
+    * `remaining` (int) - 剩余额度
+    * `reset` (int) - 该策略当前窗口结束的时间戳
+    """
+
+    def __init__(self, allowed, limit, remaining, reset):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+
+
+class SlidingWindowLimiter(object):
+    """滑动窗口限流引擎"""
+
+    def __init__(self, redis, key_prefix='api_limit:'):
+        """
+        :param redis: Redis链接
+        :param key_prefix: redis key前缀
+        """
+        self.redis = redis
+        self.key_prefix = key_prefix
+        self._script = redis.register_script(SLIDING_WINDOW_SCRIPT)
+
+    def hit(self, rules, now=None):
+        """
+        一次lua调用检查所有规则，全部没有超出时计数
+        :param rules: [(key, limit, window)]，window为秒
+        :param now: 当前时间，默认为time.time()
+        :return result: `RateLimitResult`
+        """
+        if now is None:
+            now = time.time()
+        keys = []
+        args = [now]
+        for key, limit, window in rules:
+            index = int(now // window)
+            keys.append('%s%s|%d' % (self.key_prefix, key, index))
+            keys.append('%s%s|%d' % (self.key_prefix, key, index - 1))
+            args.extend((limit, window))
+        result = self._script(keys=keys, args=args)
+
+        allowed = bool(result[0])
+        # 剩余额度最少的策略
+        i = min(range(len(rules)), key=lambda j: int(result[j + 1]))
+        key, limit, window = rules[i]
+        reset = (int(now // window) + 1) * window
+        return RateLimitResult(allowed, limit, int(result[i + 1]), int(reset))
+
+
+class Policy(object):
+    """限流策略"""
+
+    def __init__(self, limit, per=PER_IP):
+        """
+        :param limit: 限制，例如`60/minute`
+        :param per: 作用范围: `ip`, `user`, `endpoint`
+        """
+        if per not in (PER_IP, PER_USER, PER_ENDPOINT):
+            raise ValueError('Unknown rate limit scope: %s' % per)
+        item = parse(limit)
+        self.amount = item.amount
+        self.window = item.get_expiry()
+        self.per = per
+        self.name = '%s/%d' % (self.amount, self.window)
+
+
+class ApiLimiter(object):
+    """blueprint的接口限流"""
+
+    def __init__(self, redis, default_limits=(), ip_func=None,
+                 key_prefix='api_limit:', headers=True):
+        """
+        :param redis: Redis链接
+        :param default_limits: 所有接口的策略[(per, limit)]
+        :param ip_func: 获取客户端IP的方法，默认为`request.remote_addr`
+        :param key_prefix: redis key前缀
+        :param headers: 是否返回X-RateLimit-*头
+        """
+        self.engine = SlidingWindowLimiter(redis, key_prefix)
+        self.default_policies = [Policy(limit, per)
+                                 for per, limit in default_limits]
+        self.ip_func = ip_func or (lambda: request.remote_addr)
+        self.headers = headers
+
+    def init_app(self, app):
+        """初始化app
+        :param app: `Flask`实例或`Blueprint`实例
+        """
+        app.before_request(self.check_limit)
+        app.after_request(self.inject_headers)
+
+    def limit(self, limit, per=PER_IP):
+        """接口限流装饰器，可以叠加多个"""
+        policy = Policy(limit, per)
+
+        def decorator(f):
+            policies = getattr(f, 'api_limits', None)
+            if policies is None:
+                policies = f.api_limits = []
+            policies.append(policy)
+            return f
+
+        return decorator
+
+    def _identity(self, per):
+        if per == PER_IP:
+            return self.ip_func()
+        if per == PER_USER:
+            if not current_user or not current_user.is_authenticated:
+                return None
+            return current_user.get_id()
+        return ''
+
+    def check_limit(self):
+        """检查当前请求的所有策略"""
+        endpoint = request.endpoint
+        view = current_app.view_functions.get(endpoint)
+        policies = [('*', policy) for policy in self.default_policies]
+        policies.extend((endpoint, policy)
+                        for policy in getattr(view, 'api_limits', ()))
+        rules = []
+        for scope, policy in policies:
+            identity = self._identity(policy.per)
+            if identity is None:
+                # 未登录的请求不检查用户策略
+                continue
+            rules.append(('%s|%s|%s|%s' % (
+                scope, policy.per, identity, policy.name),
+                policy.amount, policy.window))
+        if not rules:
+            return None
+
+        result = self.engine.hit(rules)
+        g.rate_limit = result
+        if not result.allowed:
+            abort(429, ERR_RATE_LIMITED)
+        return None
+
+    def inject_headers(self, response):
+        """添加X-RateLimit-*头"""
+        result = getattr(g, 'rate_limit', None)
+        if not self.headers or result is None:
+            return response
+        response.headers['X-RateLimit-Limit'] = str(result.limit)
+        response.headers['X-RateLimit-Remaining'] = str(result.remaining)
+        response.headers['X-RateLimit-Reset'] = str(result.reset)
+        if not result.allowed:
+            response.headers['Retry-After'] = \
+                str(max(0, result.reset - int(time.time())))
+        return response
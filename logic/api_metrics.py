@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    api_metrics.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    接口耗时统计(供`ApiMonitor`使用)
+
+    每个进程在内存中按endpoint记录:
+    * 固定分桶的耗时直方图(对数分桶，每个数量级1/2/5三个桶)
+    * 耗时总和、请求数
+    * 各状态码的请求数
+
+    进程内的数据只是增量，由后台greenlet定期通过HINCRBY合并到redis的同一个
+    hash中，所有worker的数据在redis中自然累加。`render()`从redis读取汇总数据
+    输出Prometheus文本格式。
+
+    所有greenlet在同一个线程中运行，更新过程中不会切换，所以不需要加锁。
+
+"""
+import sys
+import traceback
+from bisect import bisect_left
+
+import gevent
+
+
+# 耗时分桶上限(秒): 1ms ~ 50s，最后隐含一个+Inf桶
+LATENCY_BUCKETS = tuple(
+    base * 10 ** exp / 1000.0
+    for exp in range(0, 5)
+    for base in (1, 2, 5)
+)
+
+
+def _escape_label(value):
+    """转义Prometheus label值"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_float(value):
+    return repr(float(value))
+
+
+class ApiMetrics(object):
+    """接口耗时统计"""
+
+    def __init__(self, redis, key='api_metrics', flush_interval=10,
+                 buckets=LATENCY_BUCKETS):
+        """
+        :param redis: Redis链接
+        :param key: 汇总数据的redis hash key
+        :param flush_interval: 合并到redis的间隔(秒)
+        :param buckets: 耗时分桶上限(秒)，需要升序
+        """
+        self.redis = redis
+        self.key = key
+        self.flush_interval = flush_interval
+        self.buckets = tuple(buckets)
+
+        # endpoint -> [bucket_counts..., +Inf_count]
+        self._histograms = {}
+        # endpoint -> 耗时总和
+        self._sums = {}
+        # (endpoint, status_code) -> count
+        self._statuses = {}
+        self._worker_started = False
+
+    def observe(self, endpoint, status_code, elapsed):
+        """记录一次请求
+        :param endpoint: flask endpoint
+        :param status_code: 响应状态码
+        :param elapsed: 耗时(秒)
+        """
+        endpoint = endpoint or 'unknown'
+        histogram = self._histograms.get(endpoint)
+        if histogram is None:
+            histogram = self._histograms[endpoint] = \
+                [0] * (len(self.buckets) + 1)
+            self._sums[endpoint] = 0.0
+        histogram[bisect_left(self.buckets, elapsed)] += 1
+        self._sums[endpoint] += elapsed
+        status_key = (endpoint, status_code)
+        self._statuses[status_key] = self._statuses.get(status_key, 0) + 1
+
+        if not self._worker_started:
+            self._worker_started = True
+            gevent.spawn(self._worker_loop)
+
+    def _worker_loop(self):
+        while True:
+            gevent.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                sys.stderr.write(traceback.format_exc())
+
+    def flush(self):
+        """把本进程的增量合并到redis"""
+        histograms, self._histograms = self._histograms, {}
+        sums, self._sums = self._sums, {}
+        statuses, self._statuses = self._statuses, {}
+        if not histograms and not statuses:
+            return
+
+        pipe = self.redis.pipeline(transaction=False)
+        for endpoint, histogram in histograms.items():
+            for i, count in enumerate(histogram):
+                if count:
+                    pipe.hincrby(self.key, 'b|%d|%s' % (i, endpoint), count)
+            pipe.hincrbyfloat(self.key, 'sum||%s' % endpoint, sums[endpoint])
+        for (endpoint, status_code), count in statuses.items():
+            pipe.hincrby(self.key, 's|%s|%s' % (status_code, endpoint), count)
+        try:
+            pipe.execute()
+        except Exception:
+            # 写入失败，把增量放回去等待下次合并
+            self._merge_back(histograms, sums, statuses)
+            raise
+
+    def _merge_back(self, histograms, sums, statuses):
+        for endpoint, histogram in histograms.items():
+            current = self._histograms.get(endpoint)
+            if current is None:
+                self._histograms[endpoint] = histogram
+                self._sums[endpoint] = sums[endpoint]
+                continue
+            for i, count in enumerate(histogram):
+                current[i] += count
+            self._sums[endpoint] += sums[endpoint]
+        for status_key, count in statuses.items():
+            self._statuses[status_key] = \
+                self._statuses.get(status_key, 0) + count
+
+    def collect(self):
+        """从redis读取汇总数据
+        :return (histograms, sums, statuses):
+        """
+        histograms = {}
+        sums = {}
+        statuses = {}
+        for field, value in self.redis.hgetall(self.key).items():
+            if isinstance(field, bytes):
+                field = field.decode('utf-8')
+            # field格式: `<类型>|<参数>|<endpoint>`
+            kind, arg, endpoint = field.split('|', 2)
+            if kind == 'sum':
+                sums[endpoint] = float(value)
+            elif kind == 'b':
+                histogram = histograms.setdefault(
+                    endpoint, [0] * (len(self.buckets) + 1))
+                index = int(arg)
+                if index < len(histogram):
+                    histogram[index] = int(value)
+            elif kind == 's':
+                statuses[(endpoint, arg)] = int(value)
+        return histograms, sums, statuses
+
+    def render(self):
+        """输出Prometheus文本格式"""
+        histograms, sums, statuses = self.collect()
+        lines = [
+            '# HELP api_request_duration_seconds Api request latency.',
+            '# TYPE api_request_duration_seconds histogram',
+        ]
+        for endpoint in sorted(histograms):
+            label = _escape_label(endpoint)
+            cumulative = 0
+            for bound, count in zip(self.buckets, histograms[endpoint]):
+                cumulative += count
+                lines.append(
+                    'api_request_duration_seconds_bucket'
+                    '{endpoint="%s",le="%s"} %d'
+                    % (label, _format_float(bound), cumulative))
+            cumulative += histograms[endpoint][-1]
+            lines.append(
+                'api_request_duration_seconds_bucket'
+                '{endpoint="%s",le="+Inf"} %d' % (label, cumulative))
+            lines.append(
+                'api_request_duration_seconds_sum{endpoint="%s"} %s'
+                % (label, _format_float(sums.get(endpoint, 0))))
+            lines.append(
+                'api_request_duration_seconds_count{endpoint="%s"} %d'
+                % (label, cumulative))
+
+        lines.append('# HELP api_requests_total Api requests by status code.')
+        lines.append('# TYPE api_requests_total counter')
+        for (endpoint, status_code) in sorted(statuses):
+            lines.append(
+                'api_requests_total{endpoint="%s",status="%s"} %d'
+                % (_escape_label(endpoint), status_code,
+                   statuses[(endpoint, status_code)]))
+        return '\n'.join(lines) + '\n'
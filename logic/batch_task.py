@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    batch_task.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    批量模式的celery任务
+
+    生产者把任务数据RPUSH到redis列表`batch_task:<name>`，只在待执行的消费
+    任务不够时才发送celery消息: 每`batch_size`个排队的数据对应一个消费任务，
+    最多同时`concurrency`个(计数为`batch_task:<name>:scheduled`)。worker
+    一次取出最多`batch_size`个数据，不足时最多再等待`max_wait`毫秒，然后
+    一次调用任务函数处理整批数据。大量小任务不再每个都经过一次broker，
+    积压时多个worker并行消费。
+
+    数据入队时严格序列化，不能序列化的值直接抛出TypeError，不会被转换成
+    字符串后交给任务函数。
+
+    * 取出的数据原子地移动到worker自己的处理列表，并在
+      `batch_task:<name>:leases`中登记租约(到期时间)；处理完成后删除处理
+      列表(确认)。worker崩溃后租约到期，下一次消费时数据放回队首重新处理
+      (至少处理一次，任务函数需要幂等)
+    * 整批调用抛出异常时逐个重新调用，失败的数据放回队列重试，超过
+      `max_retries`次后放入`batch_task:<name>:failed`
+    * 消费任务同时加入celery beat定时执行，没有新数据时也能回收过期的租约
+
+    使用::
+
+        @celery_batch_decorator(default_inst, name='default_batch_task')
+        def default_batch_task(items):
+            ...
+
+        default_batch_task.push({'user_id': 1}, {'user_id': 2})
+
+"""
+import time
+import traceback
+import uuid
+
+from cache import _r
+from cache.serializer import get_serializer
+from configs import CeleryConf
+from logic import celery_logging_decorator
+from utils.logger import logger
+
+# KEYS: 队列, 处理列表, 租约zset
+# ARGV: 数量, 租约到期时间
+CLAIM_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items == 0 then
+    return items
+end
+redis.call('LTRIM', KEYS[1], #items, -1)
+redis.call('RPUSH', KEYS[2], unpack(items))
+redis.call('ZADD', KEYS[3], ARGV[2], KEYS[2])
+return items
+"""
+
+# KEYS: 队列, 租约zset
+# ARGV: 当前时间
+RECOVER_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+local count = 0
+for _, key in ipairs(expired) do
+    local items = redis.call('LRANGE', key, 0, -1)
+    for i = #items, 1, -1 do
+        redis.call('LPUSH', KEYS[1], items[i])
+    end
+    count = count + #items
+    redis.call('DEL', key)
+    redis.call('ZREM', KEYS[2], key)
+end
+return count
+"""
+
+# 按排队的数据量补足消费任务
+# KEYS: 队列, 消费任务计数
+# ARGV: batch_size, concurrency, 计数过期时间(秒), 是否减去当前任务(0/1)
+# 返回需要新发送的消费任务数
+SCHEDULE_SCRIPT = """
+local scheduled = tonumber(redis.call('GET', KEYS[2]) or '0')
+if ARGV[4] == '1' and scheduled > 0 then
+    scheduled = scheduled - 1
+end
+local wanted = math.ceil(redis.call('LLEN', KEYS[1]) / tonumber(ARGV[1]))
+wanted = math.min(wanted, tonumber(ARGV[2]))
+local new = 0
+if scheduled < wanted then
+    new = wanted - scheduled
+    scheduled = wanted
+end
+if scheduled > 0 then
+    redis.call('SET', KEYS[2], scheduled, 'EX', ARGV[3])
+else
+    redis.call('DEL', KEYS[2])
+end
+return new
+"""
+
+# 没有取满一批时的轮询间隔(秒)
+POLL_INTERVAL = 0.02
+
+
+class BatchQueue(object):
+    """批量任务的redis队列"""
+
+    def __init__(self, redis, name, batch_size, max_wait, lease_timeout,
+                 max_retries, concurrency=1, serializer='json'):
+        """
+        :param redis: Redis链接
+        :param name: 队列名称
+        :param batch_size: 每批最多处理的数量(一次lua调用移动，不要超过几千)
+        :param max_wait: 不足一批时最多等待的时间(毫秒)
+        :param lease_timeout: 处理一批的租约时间(秒)，超时后数据重新入队
+        :param max_retries: 单个数据失败后的最多重试次数
+        :param concurrency: 最多同时执行的消费任务数
+        :param serializer: 序列化方式名称(`json`, `msgpack`)
+        """
+        self.redis = redis
+        self.name = name
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.lease_timeout = lease_timeout
+        self.max_retries = max_retries
+        self.concurrency = concurrency
+        self.serializer = get_serializer(serializer, strict=True)
+        self.key = 'batch_task:%s' % name
+        self.scheduled_key = '%s:scheduled' % self.key
+        self.leases_key = '%s:leases' % self.key
+        self.failed_key = '%s:failed' % self.key
+        self._claim = redis.register_script(CLAIM_SCRIPT)
+        self._recover = redis.register_script(RECOVER_SCRIPT)
+        self._schedule = redis.register_script(SCHEDULE_SCRIPT)
+
+    def _dumps(self, value, attempts=0):
+        return self.serializer.dumps([attempts, value])
+
+    def _schedule_args(self, release):
+        # 消费任务丢失时计数过期，之后的push重新发送
+        ttl = int(self.lease_timeout + self.max_wait / 1000.0) + 1
+        return [self.batch_size, self.concurrency, ttl, 1 if release else 0]
+
+    def push(self, *values):
+        """
+        数据入队
+        :return count: 需要新发送的消费任务数
+        :raise TypeError: 数据不能序列化
+        """
+        if not values:
+            return 0
+        raws = [self._dumps(value) for value in values]
+        pipe = self.redis.pipeline()
+        pipe.rpush(self.key, *raws)
+        self._schedule(keys=[self.key, self.scheduled_key],
+                       args=self._schedule_args(False), client=pipe)
+        return int(pipe.execute()[1])
+
+    def unschedule(self, scheduled=True):
+        """
+        消费完成后减少消费任务计数，并按剩余的数据量补足
+        :param scheduled: 当前任务是否计入了计数(beat定时执行的没有计入)
+        :return count: 需要新发送的消费任务数
+        """
+        return int(self._schedule(keys=[self.key, self.scheduled_key],
+                                  args=self._schedule_args(scheduled)))
+
+    def recover(self):
+        """
+        过期租约(worker崩溃)的数据放回队首
+        :return count: 放回的数量
+        """
+        count = int(self._recover(keys=[self.key, self.leases_key],
+                                  args=[time.time()]))
+        if count:
+            logger.warning('batch task %s recovered %d items from expired '
+                           'leases' % (self.name, count))
+        return count
+
+    def claim(self):
+        """
+        取出一批数据，不足`batch_size`时最多等待`max_wait`毫秒
+        :return (processing, entries): 处理列表key和[(重试次数, 数据)]
+        """
+        processing = '%s:processing:%s' % (self.key, uuid.uuid4().hex)
+        deadline = time.time() + self.max_wait / 1000.0
+        raws = []
+        while True:
+            raws.extend(self._claim(
+                keys=[self.key, processing, self.leases_key],
+                args=[self.batch_size - len(raws),
+                      time.time() + self.lease_timeout]))
+            if not raws or len(raws) >= self.batch_size:
+                break
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            time.sleep(min(POLL_INTERVAL, remaining))
+        return processing, [self.serializer.loads(raw) for raw in raws]
+
+    def ack(self, processing, failed=()):
+        """
+        确认一批数据，失败的数据重新入队或放入失败列表
+        :param processing: 处理列表key
+        :param failed: 失败的[(重试次数, 数据)]
+        """
+        pipe = self.redis.pipeline()
+        for attempts, value in failed:
+            attempts += 1
+            if attempts > self.max_retries:
+                pipe.rpush(self.failed_key, self._dumps(value, attempts))
+            else:
+                pipe.rpush(self.key, self._dumps(value, attempts))
+        pipe.delete(processing)
+        pipe.zrem(self.leases_key, processing)
+        pipe.execute()
+
+    def drain(self, func):
+        """
+        回收过期租约并处理一批数据
+        :param func: 批量处理函数，参数为数据列表
+        :return count: 处理的数量
+        """
+        self.recover()
+        processing, entries = self.claim()
+        if not entries:
+            return 0
+        failed = []
+        try:
+            func([value for _, value in entries])
+        except Exception:
+            logger.error(traceback.format_exc())
+            # 逐个重新处理，隔离失败的数据
+            for entry in entries:
+                try:
+                    func([entry[1]])
+                except Exception:
+                    logger.error(traceback.format_exc())
+                    failed.append(entry)
+        self.ack(processing, failed)
+        return len(entries)
+
+
+class BatchTask(object):
+    """批量任务，`push()`入队，celery任务`task`消费"""
+
+    def __init__(self, func, queue, task):
+        """
+        :param func: 批量处理函数
+        :param queue: `BatchQueue`
+        :param task: 消费队列的celery任务
+        """
+        self.func = func
+        self.queue = queue
+        self.task = task
+
+    def __call__(self, items):
+        return self.func(items)
+
+    def push(self, *values):
+        """数据入队，按需要发送消费任务"""
+        for _ in range(self.queue.push(*values)):
+            self.task.apply_async(args=(True,))
+
+
+def celery_batch_decorator(inst, name, batch_size=None, max_wait=None,
+                           lease_timeout=None, max_retries=None,
+                           concurrency=None, redis=None, serializer='json'):
+    """
+    批量任务装饰器，参数为None时使用`CeleryConf`中的配置
+    :param inst: celery实例
+    :param name: celery任务名(同时用作redis队列名)
+    :param batch_size: 每批最多处理的数量
+    :param max_wait: 不足一批时最多等待的时间(毫秒)
+    :param lease_timeout: 处理一批的租约时间(秒)
+    :param max_retries: 单个数据失败后的最多重试次数
+    :param concurrency: 最多同时执行的消费任务数
+    :param redis: Redis链接，默认为`cache._r`
+    :param serializer: 序列化方式名称(`json`, `msgpack`)
+    """
+    queue = BatchQueue(
+        redis or _r, name,
+        batch_size=batch_size or CeleryConf.BATCH_SIZE,
+        max_wait=CeleryConf.BATCH_MAX_WAIT if max_wait is None else max_wait,
+        lease_timeout=lease_timeout or CeleryConf.BATCH_LEASE_TIMEOUT,
+        max_retries=(CeleryConf.BATCH_MAX_RETRIES if max_retries is None
+                     else max_retries),
+        concurrency=concurrency or CeleryConf.BATCH_CONCURRENCY,
+        serializer=serializer)
+
+    def decorator(func):
+        @inst.task(name=name)
+        @celery_logging_decorator
+        def drain(scheduled=False):
+            """
+            :param scheduled: 是否由push/上一次消费发送(计入了消费任务计数)
+            """
+            try:
+                queue.drain(func)
+            finally:
+                for _ in range(queue.unschedule(scheduled)):
+                    drain.apply_async(args=(True,))
+
+        return BatchTask(func, queue, drain)
+
+    return decorator
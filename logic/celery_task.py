@@ -7,6 +7,7 @@
 """
 from configs.default_celery import default_inst
 from logic import celery_logging_decorator
+from logic.batch_task import celery_batch_decorator
 
 
 @default_inst.task(name='default_task')
@@ -14,3 +15,11 @@ from logic import celery_logging_decorator
 def default_task():
     pass
 
+
+@celery_batch_decorator(default_inst, name='default_batch_task')
+def default_batch_task(items):
+    """
+    批量任务，生产者调用`default_batch_task.push(item)`入队
+    :param items: 一批数据
+    """
+    pass
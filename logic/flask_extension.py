@@ -3,26 +3,51 @@
     flask_extension
     ~~~~~~~
 """
+import json
+import re
 import sys
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
 
 from bson import ObjectId
-from datetime import datetime
-from flask import g, request, jsonify, session as flask_session, abort
+from flask import g, request, session as flask_session, abort, \
+    current_app, Response
 from flask_login import UserMixin
 from flask.sessions import SecureCookieSessionInterface, SessionMixin
-from itsdangerous import URLSafeTimedSerializer, BadSignature
+from itsdangerous import URLSafeTimedSerializer, BadData
 from werkzeug.datastructures import CallbackDict
 
+from logic.api_metrics import ApiMetrics
+from logic.referrer_matcher import DomainMatcher
+from logic.request_registry import RequestRegistry
+from logic.session_serializer import CompactSessionSerializer, SESSION_SALT
+from logic.user_cache import UserCache
+
 
 class ApiMonitor(object):
     """Api monitor"""
-    def __init__(self, redis=None, logger=None):
+    def __init__(self, redis=None, logger=None, host_id='', write_behind=False,
+                 buffer_size=10000, flush_interval=0.05, metrics=True):
         """
         :param redis: Redis链接
         :param logger: logger输出实例
+        :param host_id: 主机id，请求登记表按主机区分
+        :param write_behind: 请求登记是否异步批量写入redis(见`RequestRegistry`)
+        :param buffer_size: write-behind缓冲区大小，超出后丢弃并计数
+        :param flush_interval: write-behind刷新间隔(秒)
+        :param metrics: 是否统计接口耗时(见`ApiMetrics`)
         """
         self.redis = redis
         self.logger = logger
+        self.registry = None
+        self.metrics = None
+        if redis:
+            self.registry = RequestRegistry(
+                redis, host_id=host_id, write_behind=write_behind,
+                buffer_size=buffer_size, flush_interval=flush_interval)
+            if metrics:
+                self.metrics = ApiMetrics(redis)
 
     def init_app(self, app):
         """初始化app
@@ -31,30 +56,16 @@ class ApiMonitor(object):
         app.before_request(self.before_logger)
         app.after_request(self.after_logger)
 
-    @staticmethod
-    def cache_key(request_id):
-        """生成redis key
-        :param request_id:
-        :return key:
-        """
-        key = 'request_id:%s' % request_id
-        return key
-
     def before_logger(self):
         """before request logger"""
         g.request_id = str(ObjectId())
+        g.request_start = time.perf_counter()
         endpoint = request.endpoint
         if self.logger:
             self.logger.info(
                 '%s | %s' % (g.request_id, endpoint))
-        if self.redis:
-            key = self.cache_key(g.request_id)
-            mapping = {
-                'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'endpoint': endpoint
-            }
-            self.redis.hmset(key, mapping)
-            self.redis.expire(key, 3600*24*7)
+        if self.registry:
+            self.registry.start(g.request_id, endpoint)
         return
 
     def after_logger(self, response):
@@ -66,14 +77,30 @@ class ApiMonitor(object):
             return response
         if self.logger:
             self.logger.info('%s | end' % request_id)
-        if self.redis:
-            key = self.cache_key(request_id)
-            self.redis.delete(key)
+        if self.registry:
+            self.registry.end(request_id)
+        if self.metrics:
+            self.metrics.observe(
+                request.endpoint, response.status_code,
+                time.perf_counter() - g.request_start)
         return response
 
+    def stuck_requests(self, older_than, host_id=None):
+        """查询处理时间超过older_than秒仍未结束的请求(按endpoint分组)
+        :param older_than: 秒
+        :param host_id: 主机id，默认为当前主机
+        """
+        if not self.registry:
+            return {}
+        return self.registry.stuck_requests(older_than, host_id=host_id)
+
 
 class ReferrerChecker(object):
-    """校验referrer"""
+    """校验referrer
+
+    `allow_domains`支持`*.example.com`通配符和端口(见`DomainMatcher`)，
+    每个referrer域名的匹配结果会被缓存。
+    """
 
     def __init__(self, allow_domains, white_list=None, err=412):
         """
@@ -81,9 +108,11 @@ class ReferrerChecker(object):
         :param white_list: flask endpoint白名单列表
         :param err: 校验失败返回的错误码
         """
-        self.allow_domains = allow_domains
-        self.white_list = white_list
+        self.allow_domains = DomainMatcher(allow_domains or ())
+        self.white_list = frozenset(white_list or ())
         self.err = err
+        self._reject_body = json.dumps(
+            {'stat': 0, 'err': err, 'msg': 'Forbidden'}, sort_keys=True)
 
     def init_app(self, app):
         """初始化app
@@ -91,6 +120,11 @@ class ReferrerChecker(object):
         """
         app.before_request(self.check_referrer)
 
+    def reject(self):
+        """校验失败的响应(body只生成一次)"""
+        return Response(self._reject_body, status=403,
+                        mimetype='application/json')
+
     def check_referrer(self):
         """校验referrer"""
         if not self.allow_domains:
@@ -98,35 +132,70 @@ class ReferrerChecker(object):
         if request.endpoint in self.white_list:
             # 不检查referrer
             return None
-        rsp = jsonify(stat=0, err=self.err, msg='Forbidden')
 
         referrer = request.referrer
         if referrer is None:
-            return rsp, 403
-        if referrer.startswith('http://'):
-            referrer = referrer[7:]
-        elif referrer.startswith('https://'):
-            referrer = referrer[8:]
-        else:
-            return rsp, 403
+            return self.reject()
+        netloc = referrer_netloc(referrer)
+        if netloc is None or not self.allow_domains.match(netloc):
+            return self.reject()
+
+        return None
 
-        referrer_domain = referrer.split('/')[0]
-        if referrer_domain not in self.allow_domains:
-            return rsp, 403
 
+# referrer中允许的主机名字符(IPv6地址去掉了方括号)
+_HOSTNAME_RE = re.compile(r'^[a-z0-9._:-]+$')
+
+
+def referrer_netloc(referrer):
+    """
+    解析referrer的主机名和端口，不包括userinfo、query和fragment
+    :param referrer: referrer url
+    :return netloc: `host[:port]`(小写)，不是合法的http(s) url时为None
+    """
+    try:
+        parts = urlsplit(referrer.strip())
+        host, port = parts.hostname, parts.port
+    except ValueError:
+        # 端口不是数字或超出范围
         return None
+    if parts.scheme not in ('http', 'https') or not host:
+        return None
+    if not _HOSTNAME_RE.match(host):
+        # 浏览器会把`\`等字符当作路径分隔符，不能按域名匹配
+        return None
+    if ':' in host:
+        host = '[%s]' % host
+    return host if port is None else '%s:%d' % (host, port)
 
 
 # ----------------------------------------------
 # 重载LoginManager相关的类型，自定义Session管理
 # ----------------------------------------------
+def session_body_lookup(f):
+    """允许该接口从请求body(form)中读取session值"""
+    f.session_body_lookup = True
+    return f
+
+
 class MongoSession(CallbackDict, SessionMixin):
-    """重载CallbackDict"""
-    def __init__(self, initial=None, sid=None, channel=None, status=20):
-        CallbackDict.__init__(self, initial)
+    """重载CallbackDict
+
+    * `modified` - 第一层数据被修改过(修改嵌套的数据需要手动设置)
+    * `loaded` - 请求中带有session值(无论是否校验通过)
+    * `issued_at` - session值的签名时间
+    """
+    def __init__(self, initial=None, sid=None, channel=None, status=20,
+                 loaded=False, issued_at=None):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
         self.sid = sid
         self.channel = channel
         self.status = status
+        self.modified = False
+        self.loaded = loaded
+        self.issued_at = issued_at
 
 
 class MongoSessionInterface(SecureCookieSessionInterface):
@@ -146,59 +215,169 @@ class MongoSessionInterface(SecureCookieSessionInterface):
         * `status`
         * `channel`
         * `indi_user_id` - 个人用户id
+
+    session没有修改时不重新签名，也不设置cookie。permanent session可以通过
+    `refresh_window`在快过期时重新签名
+
+    session值按`lookup`的顺序查找，默认不读取请求body(`form`)，避免没有
+    cookie的请求解析整个body。需要从body读取session的接口使用
+    `session_body_lookup`装饰。
+
+    `cookie_format`为`msgpack`时使用`CompactSessionSerializer`，json格式的
+    旧cookie仍然可以读取。
+
+    设置`store`(见`logic.session_store`)后session数据保存在服务端，cookie中
+    只保存签名后的sid，session修改时才写入存储，新建session时才设置cookie。
     """
     session_class = MongoSession
     canary_key = 'canary:'
 
-    @staticmethod
-    def get_session_val(session_cookie_name):
+    FORMAT_JSON = 'json'
+    FORMAT_MSGPACK = 'msgpack'
+
+    def __init__(self, refresh_window=None,
+                 lookup=('cookies', 'headers', 'form', 'args'),
+                 cookie_format=FORMAT_JSON, compress=True, store=None):
+        """
+        :param refresh_window: permanent session距离过期小于该秒数时，即使没有
+            修改也重新设置cookie。为None则只在修改时设置
+        :param lookup: session值的查找顺序，可选`cookies`, `headers`,
+            `args`, `form`。`form`只对`session_body_lookup`装饰的接口生效
+        :param cookie_format: cookie格式，`json`或`msgpack`
+        :param compress: msgpack格式是否尝试zlib压缩
+        :param store: 服务端session存储(`SessionStore`实例)，为None则session
+            数据保存在cookie中
+        """
+        if cookie_format not in (self.FORMAT_JSON, self.FORMAT_MSGPACK):
+            raise ValueError('Unknown cookie format: %s' % cookie_format)
+        self.refresh_window = refresh_window
+        self.lookup = tuple(lookup)
+        self.cookie_format = cookie_format
+        self.compress = compress
+        self.store = store
+        # (format, secret_key) -> serializer
+        self._serializers = {}
+
+    def get_serializer(self, app, cookie_format=None):
+        """获取签名serializer(按格式和secret_key缓存)"""
+        cookie_format = cookie_format or self.cookie_format
+        key = (cookie_format, app.secret_key)
+        s = self._serializers.get(key)
+        if s is None:
+            if cookie_format == self.FORMAT_MSGPACK:
+                s = CompactSessionSerializer(
+                    app.secret_key, SESSION_SALT, compress=self.compress)
+            else:
+                s = URLSafeTimedSerializer(app.secret_key, SESSION_SALT)
+            self._serializers[key] = s
+        return s
+
+    def get_session_val(self, session_cookie_name):
         """获取session值"""
-        val = request.cookies.get(session_cookie_name) \
-            or request.headers.get(session_cookie_name) \
-            or request.form.get(session_cookie_name) \
-            or request.args.get(session_cookie_name)
-        return val
+        for source in self.lookup:
+            if source == 'form':
+                # 只有声明过的接口才解析body
+                view = current_app.view_functions.get(request.endpoint)
+                if not getattr(view, 'session_body_lookup', False):
+                    continue
+            val = getattr(request, source).get(session_cookie_name)
+            if val:
+                return val
+        return None
+
+    def _loads(self, app, val):
+        """解析session值，返回(data, issued_at)"""
+        try:
+            return self.get_serializer(app).loads(val, return_timestamp=True)
+        except BadData:
+            # json cookie的签名与msgpack相同，签名通过后解析payload时抛出
+            # BadPayload(不是BadSignature)
+            if self.cookie_format == self.FORMAT_JSON:
+                raise
+        # 兼容切换格式之前的json cookie
+        return self.get_serializer(app, self.FORMAT_JSON).loads(
+            val, return_timestamp=True)
 
     def open_session(self, app, request):
         """打开session"""
-        s = URLSafeTimedSerializer(app.secret_key, 'cookie-session')
         # 获取session
         smart_voice_val = self.get_session_val(app.session_cookie_name)
+        if not smart_voice_val:
+            return self.session_class()
 
         try:
-            if smart_voice_val:
-                smart_voice_data = s.loads(smart_voice_val)
-            else:
-                smart_voice_data = {}
-            session_data = smart_voice_data
-            kwargs = {}
-            return self.session_class(session_data, **kwargs)
-        except BadSignature:
-            return self.session_class()
+            session_data, issued_at = self._loads(app, smart_voice_val)
+        except BadData:
+            return self.session_class(loaded=True)
+        if self.store is None:
+            return self.session_class(
+                session_data, loaded=True, issued_at=issued_at)
+
+        # 服务端存储: cookie中保存的是sid
+        sid = session_data
+        if not isinstance(sid, str):
+            return self.session_class(loaded=True)
+        session_data = self.store.get(sid)
+        if session_data is None:
+            return self.session_class(loaded=True)
+        return self.session_class(
+            session_data, sid=sid, loaded=True, issued_at=issued_at)
+
+    def revoke(self, sid):
+        """删除服务端session
+        :return ok: 没有设置`store`时session保存在cookie中，无法撤销，返回False
+        """
+        if self.store is None:
+            return False
+        self.store.delete(sid)
+        return True
+
+    def should_set_cookie(self, app, session):
+        """session修改过，或者快过期时才需要设置cookie"""
+        if session.modified:
+            return True
+        return self.near_expiry(app, session)
+
+    def near_expiry(self, app, session):
+        """permanent session是否在`refresh_window`内过期"""
+        if self.refresh_window is None or not session.permanent \
+                or session.issued_at is None:
+            return False
+        issued_at = session.issued_at
+        if issued_at.tzinfo is None:
+            now = datetime.utcnow()
+        else:
+            now = datetime.now(timezone.utc)
+        expires_at = issued_at + app.permanent_session_lifetime
+        return expires_at - now <= timedelta(seconds=self.refresh_window)
 
     def save_session(self, app, session, response):
         domain = self.get_cookie_domain(app)
         path = self.get_cookie_path(app)
         if not session:
-            response.delete_cookie(app.session_cookie_name,
-                                   domain=domain, path=path)
+            if self.store is not None and session.sid:
+                self.store.delete(session.sid)
+            # 请求中没有session值且没有修改时，不需要删除cookie
+            if session.modified or session.loaded:
+                response.delete_cookie(app.session_cookie_name,
+                                       domain=domain, path=path)
             return
 
+        if self.store is not None:
+            if not self._save_to_store(app, session):
+                return
+            val = self.get_serializer(app).dumps(session.sid)
+        else:
+            if not self.should_set_cookie(app, session):
+                return
+            val = self.get_serializer(app).dumps(self._dumps_data(session))
+
         httponly = self.get_cookie_httponly(app)
         secure = self.get_cookie_secure(app)
         expires = self.get_expiration_time(app, session)
 
         # Notice: session.channel 需要在登录的时候赋值
 
-        s = URLSafeTimedSerializer(app.secret_key, 'cookie-session')
-        # Notice: 把数据转换成基本类型数据
-        dumps_data = dict(session)
-        for key, value in dumps_data.items():
-            if not isinstance(value, (int, str, bytes, float)):
-                dumps_data[key] = str(value)
-
-        val = s.dumps(dumps_data)
-
         # set cookies
         response.set_cookie(app.session_cookie_name, val,
                             expires=expires,
@@ -207,14 +386,43 @@ class MongoSessionInterface(SecureCookieSessionInterface):
                             path=path,
                             secure=secure)
 
+    @staticmethod
+    def _dumps_data(session):
+        """Notice: 把数据转换成基本类型数据"""
+        dumps_data = dict(session)
+        for key, value in dumps_data.items():
+            if not isinstance(value, (int, str, bytes, float)):
+                dumps_data[key] = str(value)
+        return dumps_data
+
+    def _save_to_store(self, app, session):
+        """修改过或快过期时写入服务端存储
+        :return set_cookie: 是否需要设置cookie(新建session或快过期)
+        """
+        new_sid = not session.sid
+        near_expiry = self.near_expiry(app, session)
+        if session.modified or new_sid or near_expiry:
+            ttl = app.permanent_session_lifetime.total_seconds()
+            if new_sid:
+                # 新session的cookie马上会被使用，立即写入
+                session.sid = self.store.new_sid()
+                self.store.save(session.sid, self._dumps_data(session), ttl)
+            else:
+                self.store.save_later(
+                    session.sid, self._dumps_data(session), ttl)
+        return new_sid or near_expiry
+
 
 class LoginManagerLoader(object):
     """定义LoginManger的loader"""
 
+    # 用户信息缓存，可以在初始化时替换
+    user_cache = UserCache()
+
     @classmethod
     def load_user(cls, user_id):
         """加载user"""
-        return cls._load_user()
+        return cls._load_user(user_id)
 
     @classmethod
     def request_callback(cls, request):
@@ -232,12 +440,16 @@ class LoginManagerLoader(object):
         return cls._load_user()
 
     @classmethod
-    def _load_user(cls):
-        """统一加载user的入口"""
-        # 这里装载你的用户信息
-        pass
-
-        return cls.LoginUser()
+    def _load_user(cls, user_id=None):
+        """统一加载user的入口
+        :param user_id: 用户id，为None时返回空的LoginUser
+        """
+        if user_id is None:
+            return cls.LoginUser()
+        user = cls.user_cache.get(user_id)
+        if user is None:
+            return None
+        return cls.LoginUser(**user)
 
     @classmethod
     def unauthorized(cls):
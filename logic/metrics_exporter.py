@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    metrics_exporter.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Prometheus指标接口
+
+    各模块的指标通过`register()`登记输出函数(返回Prometheus文本格式)，
+    `/metrics`按登记顺序拼接输出，接口本身不需要知道有哪些模块。
+
+    接口不对外公开，满足任一条件才可以访问，否则返回404:
+    * 直接来自`allow_ips`中的地址(`remote_addr`)，且没有经过反向代理
+      (没有`X-Forward-For`头，公网请求都会经过代理)
+    * 设置了`token`，请求带有`Authorization: Bearer <token>`
+
+"""
+import hmac
+import sys
+import traceback
+
+from flask import Response, request
+
+
+class MetricsExporter(object):
+    """Prometheus指标接口"""
+
+    mimetype = 'text/plain; version=0.0.4'
+
+    def __init__(self, allow_ips=('127.0.0.1',), token=None):
+        """
+        :param allow_ips: 允许直接访问的ip列表
+        :param token: 访问令牌，为空则只按ip校验
+        """
+        self.allow_ips = frozenset(allow_ips or ())
+        self.token = token or None
+        # [(名称, 输出函数)]
+        self._collectors = []
+
+    def init_app(self, app, rule='/metrics'):
+        """初始化app
+        :param app: `Flask`实例
+        :param rule: 接口路径
+        """
+        app.add_url_rule(rule, 'metrics', self.view)
+
+    def register(self, name, collector):
+        """
+        登记指标
+        :param name: 名称(出错时记录日志使用)
+        :param collector: 无参数的函数，返回Prometheus文本格式
+        """
+        self._collectors.append((name, collector))
+
+    def allowed(self):
+        """当前请求是否可以访问"""
+        if self.token:
+            auth = request.headers.get('Authorization', '')
+            scheme, _, token = auth.partition(' ')
+            if scheme == 'Bearer' and hmac.compare_digest(
+                    token.encode('utf-8'), self.token.encode('utf-8')):
+                return True
+        return request.remote_addr in self.allow_ips \
+            and 'X-Forward-For' not in request.headers
+
+    def render(self):
+        """输出所有登记的指标，单个模块出错不影响其他模块"""
+        parts = []
+        for name, collector in self._collectors:
+            try:
+                parts.append(collector())
+            except Exception:
+                sys.stderr.write('metrics collector %s failed\n' % name)
+                sys.stderr.write(traceback.format_exc())
+        return ''.join(parts)
+
+    def view(self):
+        """/metrics"""
+        if not self.allowed():
+            return Response(status=404)
+        return Response(self.render(), mimetype=self.mimetype)
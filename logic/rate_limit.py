@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    rate_limit.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Flask-Limiter的本地预扣策略(`leased-fixed-window`)
+
+    与`fixed-window`使用相同的redis计数key，但每个进程不再每个请求INCR一次，
+    而是一次从redis预扣一批额度(INCRBY)放在本地令牌桶中，用完后再预扣:
+    * 每次预扣剩余额度的1/10，最多`lease_size`个；接近上限时每次只扣1个，
+      等同于精确检查
+    * 超出限制后在窗口结束前直接拒绝，不再访问redis
+    * 本地额度的有效期与redis窗口相同(使用预扣时的PTTL)，窗口结束后作废
+
+    额度在发放给本地之前已经计入redis，所以一个窗口内放行的请求数不会超过
+    限制(多放行的上限为0，只有窗口边界上的一次网络往返时间的误差)。代价是
+    少放行: 各进程未用完的额度在窗口结束时作废，最多为
+    `进程数 * (lease_size - 1)`，接近上限时预扣量降为1，实际远小于该值。
+    请求数远低于限制的客户端，每`lease_size`个请求才访问一次redis。
+
+    限制较小时作废的额度占比太大(例如10/minute，几个进程各预扣1个就会
+    让其他进程提前拒绝)，`amount`小于`lease_threshold * workers`的限制
+    直接使用`fixed-window`，每个请求访问redis。
+
+    `get_window_stats()`(X-RateLimit-Remaining)按本地记录估算，不访问redis:
+    最近一次预扣时redis中还没有被预扣的额度，加上本进程还没有用完的额度。
+
+    使用: `Limiter(..., strategy='leased-fixed-window')`
+
+    以及使用指定连接池的redis存储(`redis+pool://`): limits的`RedisStorage`
+    按url创建自己的连接池(没有上限)，这里改为使用传入的连接池::
+
+        Limiter(app, storage_uri='redis+pool://',
+                storage_options={'connection_pool': pool})
+
+"""
+import time
+from collections import OrderedDict
+
+import redis
+from limits.errors import ConfigurationError
+from limits.storage import RedisStorage
+from limits.strategies import FixedWindowRateLimiter, STRATEGIES
+
+# KEYS[1]: 计数key
+# ARGV: 预扣数量, 窗口长度(秒)
+LEASE_SCRIPT = """
+local current = redis.call('INCRBY', KEYS[1], ARGV[1])
+if current == tonumber(ARGV[1]) then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return {current, redis.call('PTTL', KEYS[1])}
+"""
+
+
+class PooledRedisStorage(RedisStorage):
+    """使用指定连接池的redis存储"""
+
+    STORAGE_SCHEME = ['redis+pool']
+
+    def __init__(self, uri, connection_pool=None, **options):
+        """
+        :param uri: `redis+pool://`(只用于选择存储类型)
+        :param connection_pool: redis连接池(如`MonitoredConnectionPool`)
+        """
+        if connection_pool is None:
+            raise ConfigurationError(
+                'redis+pool storage requires a connection_pool option')
+        self.storage = redis.StrictRedis(connection_pool=connection_pool)
+        self.initialize_storage(uri)
+        # 跳过`RedisStorage.__init__`(按url创建连接池)
+        super(RedisStorage, self).__init__()
+
+
+class LeasedFixedWindowRateLimiter(FixedWindowRateLimiter):
+    """本地预扣额度的固定窗口限流"""
+
+    # 每次最多预扣的数量
+    lease_size = 10
+    # 使用同一个redis计数的进程数(所有主机的worker数)
+    workers = 1
+    # 每个进程至少有这么多额度时才预扣，否则使用fixed-window
+    lease_threshold = 100
+    # 本地最多保存的key数量
+    max_keys = 10000
+
+    def __init__(self, storage):
+        super(LeasedFixedWindowRateLimiter, self).__init__(storage)
+        # key -> [剩余令牌, 窗口结束时间, 最近一次redis计数]
+        self._buckets = OrderedDict()
+        self._script = None
+        self._script_client = None
+        self.leases = 0
+        self.local_hits = 0
+
+    def hit(self, item, *identifiers):
+        if not isinstance(self.storage(), RedisStorage):
+            # 内存存储(例如fallback)本来就没有网络开销
+            return super(LeasedFixedWindowRateLimiter, self).hit(
+                item, *identifiers)
+        if not self._leasable(item):
+            return super(LeasedFixedWindowRateLimiter, self).hit(
+                item, *identifiers)
+        key = item.key_for(*identifiers)
+        now = time.time()
+        bucket = self._buckets.get(key)
+        if bucket is not None and bucket[1] > now:
+            if bucket[0] > 0:
+                bucket[0] -= 1
+                self.local_hits += 1
+                return True
+            if bucket[2] >= item.amount:
+                # 本窗口已经达到限制
+                self.local_hits += 1
+                return False
+            last_count = bucket[2]
+        else:
+            last_count = 0
+
+        chunk = max(1, min(self.lease_size, (item.amount - last_count) // 10))
+        current, pttl = self._lease(key, chunk, item.get_expiry())
+        self.leases += 1
+        # 本次预扣中没有超过限制的部分
+        granted = max(0, min(chunk, item.amount - (current - chunk)))
+        if pttl < 0:
+            pttl = item.get_expiry() * 1000
+        self._save(key, [max(0, granted - 1), now + pttl / 1000.0, current])
+        return granted > 0
+
+    def get_window_stats(self, item, *identifiers):
+        """
+        :return (reset, remaining): 窗口结束时间和剩余额度(包括本进程预扣
+            但还没有用完的额度)
+        """
+        bucket = None
+        if self._leasable(item) and isinstance(self.storage(), RedisStorage):
+            bucket = self._buckets.get(item.key_for(*identifiers))
+        if bucket is None or bucket[1] <= time.time():
+            return super(LeasedFixedWindowRateLimiter, self).get_window_stats(
+                item, *identifiers)
+        remaining = max(0, item.amount - bucket[2]) + bucket[0]
+        return int(bucket[1]), min(item.amount, remaining)
+
+    def _leasable(self, item):
+        """限制足够大时才预扣"""
+        return item.amount >= self.lease_threshold * self.workers
+
+    def _lease(self, key, chunk, expiry):
+        """
+        :return (current, pttl): 预扣后的redis计数和窗口剩余毫秒数
+        """
+        client = self.storage().storage
+        if self._script_client is not client:
+            self._script = client.register_script(LEASE_SCRIPT)
+            self._script_client = client
+        current, pttl = self._script(keys=[key], args=[chunk, expiry])
+        return int(current), int(pttl)
+
+    def _save(self, key, bucket):
+        self._buckets[key] = bucket
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self.max_keys:
+            now = time.time()
+            for k in [k for k, b in self._buckets.items() if b[1] <= now]:
+                del self._buckets[k]
+            # 淘汰的key未用完的额度作废，只会少放行
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+    def reset_local(self):
+        """清空本地额度"""
+        self._buckets.clear()
+
+
+STRATEGIES['leased-fixed-window'] = LeasedFixedWindowRateLimiter
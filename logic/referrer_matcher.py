@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    referrer_matcher.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    referrer域名匹配(供`ReferrerChecker`使用)
+
+    域名列表在初始化时编译:
+    * `example.com`, `example.com:8080` - 精确匹配，放在set中
+    * `*.example.com`, `*.example.com:8080` - 匹配任意层级的子域名(不包括
+      example.com本身)，按反转的域名标签放在后缀树中
+
+    域名不区分大小写；没有写端口的域名只匹配不带端口的referrer。
+
+"""
+from utils.lru_cache import TTLLRUCache, MISSING
+
+# 后缀树节点中保存通配符端口的key(不会与域名标签冲突)
+_WILDCARD = '*'
+
+
+def _split_port(netloc):
+    """
+    :return (host, port): port为None表示没有端口
+    """
+    host, sep, port = netloc.rpartition(':')
+    if not sep or ']' in port:
+        # 没有端口(或者是没有端口的IPv6地址)
+        return netloc, None
+    return host, port
+
+
+class DomainMatcher(object):
+    """编译后的域名列表"""
+
+    def __init__(self, domains, cache_size=10000):
+        """
+        :param domains: 域名列表
+        :param cache_size: 匹配结果的缓存数量
+        """
+        self._exact = set()
+        self._trie = {}
+        for domain in domains:
+            domain = domain.strip().lower()
+            if domain.startswith('*.'):
+                host, port = _split_port(domain[2:])
+                node = self._trie
+                for label in reversed(host.split('.')):
+                    node = node.setdefault(label, {})
+                node.setdefault(_WILDCARD, set()).add(port)
+            else:
+                self._exact.add(domain)
+        # 域名列表不会变化，结果只按数量淘汰
+        self._cache = TTLLRUCache(maxsize=cache_size, ttl=float('inf'))
+
+    def __bool__(self):
+        return bool(self._exact or self._trie)
+
+    def match(self, netloc):
+        """
+        :param netloc: referrer的`host[:port]`
+        :return ok: 是否在域名列表中
+        """
+        ok = self._cache.get(netloc)
+        if ok is MISSING:
+            ok = self._match(netloc.lower())
+            self._cache.set(netloc, ok)
+        return ok
+
+    def _match(self, netloc):
+        if netloc in self._exact:
+            return True
+        if not self._trie:
+            return False
+        host, port = _split_port(netloc)
+        labels = host.split('.')
+        node = self._trie
+        # 从顶级域名开始，至少还剩一个标签时通配符才能匹配
+        for i in range(len(labels) - 1, 0, -1):
+            node = node.get(labels[i])
+            if node is None:
+                return False
+            ports = node.get(_WILDCARD)
+            if ports is not None and port in ports:
+                return True
+        return False
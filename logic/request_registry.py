@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    request_registry.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    记录正在处理中的请求(供`ApiMonitor`使用)
+
+    每台主机使用两个key:
+    * `requests_inflight:<host_id>` (zset) - member为request_id，score为开始时间
+    * `requests_endpoint:<host_id>` (hash) - request_id -> endpoint
+
+    请求结束时从两个key中删除。`after_request`没有执行的请求会留在zset中，
+    可以通过`stuck_requests()`按开始时间查询，并由`cleanup()`定期清理。
+
+    支持两种写入模式:
+    * 同步模式 - 在请求greenlet中直接写入redis(每次调用一个pipeline)
+    * write-behind模式 - 写操作先放入进程内的有界缓冲区，由后台greenlet批量
+      通过pipeline写入redis。缓冲区满或redis出错时丢弃数据并计数，
+      不会阻塞请求
+
+"""
+import atexit
+import sys
+import time
+import traceback
+from collections import OrderedDict
+
+import gevent
+
+
+# 删除开始时间早于ARGV[1]的请求，每次最多ARGV[2]个
+CLEANUP_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1],
+                       'LIMIT', 0, tonumber(ARGV[2]))
+if #ids > 0 then
+    redis.call('ZREM', KEYS[1], unpack(ids))
+    redis.call('HDEL', KEYS[2], unpack(ids))
+end
+return #ids
+"""
+
+
+class RequestRegistry(object):
+    """请求登记表"""
+
+    # 超过该时间(秒)的请求会被cleanup清理
+    MAX_AGE = 3600 * 24 * 7
+    # 每次cleanup最多删除的请求数
+    CLEANUP_BATCH = 1000
+
+    def __init__(self, redis, host_id='', write_behind=False,
+                 buffer_size=10000, flush_interval=0.05, batch_size=500,
+                 cleanup_interval=600):
+        """
+        :param redis: Redis链接
+        :param host_id: 主机id，用于区分不同主机的登记表
+        :param write_behind: 是否使用write-behind模式
+        :param buffer_size: write-behind缓冲区的最大操作数
+        :param flush_interval: 后台greenlet的刷新间隔(秒)
+        :param batch_size: 每个pipeline最多包含的操作数
+        :param cleanup_interval: 自动cleanup的间隔(秒)，为0则不自动清理
+        """
+        self.redis = redis
+        self.host_id = host_id
+        self.write_behind = write_behind
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.cleanup_interval = cleanup_interval
+        self._cleanup_script = redis.register_script(CLEANUP_SCRIPT)
+        self._last_cleanup = 0
+
+        # request_id -> (op, args). 同一个请求的start和end在刷新前相遇时
+        # 会直接抵消，不再访问redis
+        self._buffer = OrderedDict()
+        self._worker_started = False
+
+        # 统计
+        self.dropped = 0
+        self.flushed = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def inflight_key(host_id):
+        """请求开始时间zset的key"""
+        return 'requests_inflight:%s' % host_id
+
+    @staticmethod
+    def endpoint_key(host_id):
+        """请求endpoint hash的key"""
+        return 'requests_endpoint:%s' % host_id
+
+    def start(self, request_id, endpoint):
+        """登记请求开始
+        :param request_id: 请求id
+        :param endpoint: flask endpoint
+        """
+        if not self._worker_started:
+            self._start_worker()
+        op = ('start', (time.time(), endpoint or ''))
+        if not self.write_behind:
+            self._execute([(request_id, op)])
+            return
+        self._enqueue(request_id, op)
+
+    def end(self, request_id):
+        """登记请求结束
+        :param request_id: 请求id
+        """
+        if not self.write_behind:
+            self._execute([(request_id, ('end', None))])
+            return
+        pending = self._buffer.get(request_id)
+        if pending is not None and pending[0] == 'start':
+            # start还没有写入redis，直接抵消
+            del self._buffer[request_id]
+            self.coalesced += 1
+            return
+        self._enqueue(request_id, ('end', None))
+
+    def _enqueue(self, request_id, op):
+        """放入write-behind缓冲区"""
+        if len(self._buffer) >= self.buffer_size:
+            self.dropped += 1
+            return
+        self._buffer[request_id] = op
+
+    def _start_worker(self):
+        """启动后台greenlet(首次写入时启动，确保在worker进程内)"""
+        self._worker_started = True
+        if not self.write_behind and not self.cleanup_interval:
+            return
+        gevent.spawn(self._worker_loop)
+        if self.write_behind:
+            atexit.register(self.flush)
+
+    def _worker_loop(self):
+        if self.write_behind:
+            interval = self.flush_interval
+        else:
+            interval = self.cleanup_interval
+        while True:
+            gevent.sleep(interval)
+            try:
+                if self.write_behind:
+                    self.flush()
+                now = time.time()
+                if self.cleanup_interval and \
+                        now - self._last_cleanup >= self.cleanup_interval:
+                    self._last_cleanup = now
+                    self.cleanup()
+            except Exception:
+                sys.stderr.write(traceback.format_exc())
+
+    def flush(self):
+        """把缓冲区中的操作批量写入redis
+        :return count: 写入的操作数
+        """
+        count = 0
+        while self._buffer:
+            batch = []
+            while self._buffer and len(batch) < self.batch_size:
+                batch.append(self._buffer.popitem(last=False))
+            try:
+                self._execute(batch)
+            except Exception:
+                self.dropped += len(batch)
+                raise
+            count += len(batch)
+        self.flushed += count
+        return count
+
+    def _execute(self, ops):
+        """用一个pipeline执行一批操作
+        :param ops: [(request_id, (op, args)), ...]
+        """
+        inflight_key = self.inflight_key(self.host_id)
+        endpoint_key = self.endpoint_key(self.host_id)
+        pipe = self.redis.pipeline(transaction=False)
+        for request_id, (op, args) in ops:
+            if op == 'start':
+                start_time, endpoint = args
+                # redis-py 2.10(requirements.txt): StrictRedis.zadd(name,
+                # score, member)
+                pipe.zadd(inflight_key, start_time, request_id)
+                pipe.hset(endpoint_key, request_id, endpoint)
+            else:
+                pipe.zrem(inflight_key, request_id)
+                pipe.hdel(endpoint_key, request_id)
+        pipe.execute()
+
+    def cleanup(self, max_age=None, host_id=None):
+        """删除开始时间超过max_age的请求
+        :param max_age: 最长存活时间(秒)，默认为MAX_AGE
+        :param host_id: 主机id，默认为当前主机
+        :return count: 删除的请求数
+        """
+        if max_age is None:
+            max_age = self.MAX_AGE
+        if host_id is None:
+            host_id = self.host_id
+        keys = [self.inflight_key(host_id), self.endpoint_key(host_id)]
+        before = time.time() - max_age
+        total = 0
+        while True:
+            count = self._cleanup_script(
+                keys=keys, args=[before, self.CLEANUP_BATCH])
+            total += count
+            if count < self.CLEANUP_BATCH:
+                break
+        return total
+
+    def stuck_requests(self, older_than, host_id=None, limit=1000):
+        """查询处理时间超过older_than秒仍未结束的请求
+        :param older_than: 秒
+        :param host_id: 主机id，默认为当前主机
+        :param limit: 最多返回的请求数
+        :return requests: 按endpoint分组
+            {endpoint: [{'request_id': str, 'start_time': float}, ...]}
+        """
+        if host_id is None:
+            host_id = self.host_id
+        before = time.time() - older_than
+        items = self.redis.zrangebyscore(
+            self.inflight_key(host_id), '-inf', before,
+            start=0, num=limit, withscores=True)
+        if not items:
+            return {}
+        request_ids = [request_id for request_id, _ in items]
+        endpoints = self.redis.hmget(self.endpoint_key(host_id), request_ids)
+
+        result = {}
+        for (request_id, start_time), endpoint in zip(items, endpoints):
+            if isinstance(request_id, bytes):
+                request_id = request_id.decode('utf-8')
+            if isinstance(endpoint, bytes):
+                endpoint = endpoint.decode('utf-8')
+            result.setdefault(endpoint, []).append({
+                'request_id': request_id,
+                'start_time': start_time
+            })
+        return result
+
+    def inflight_count(self, host_id=None):
+        """当前处理中的请求数"""
+        if host_id is None:
+            host_id = self.host_id
+        return self.redis.zcard(self.inflight_key(host_id))
+
+    def stats(self):
+        """统计信息"""
+        return {
+            'buffered': len(self._buffer),
+            'dropped': self.dropped,
+            'flushed': self.flushed,
+            'coalesced': self.coalesced,
+        }
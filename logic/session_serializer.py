@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    session_serializer.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    session cookie的紧凑格式(供`MongoSessionInterface`使用)
+
+    与`URLSafeTimedSerializer`相同的签名和时间戳，payload使用msgpack代替
+    json，可选zlib压缩(压缩后更短时才使用)，cookie更短、解码更快。
+
+"""
+import zlib
+
+from itsdangerous import TimedSerializer, BadPayload
+from itsdangerous.encoding import base64_decode, base64_encode
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+SESSION_SALT = 'cookie-session'
+
+# 压缩过的payload以`.`开头(与itsdangerous的URLSafe格式一致)
+_COMPRESSED_MARK = b'.'
+
+
+class CompactSessionSerializer(TimedSerializer):
+    """msgpack + zlib的session serializer"""
+
+    def __init__(self, secret_key, salt=SESSION_SALT, compress=True):
+        """
+        :param secret_key: 签名密钥
+        :param salt: 签名salt
+        :param compress: 是否尝试zlib压缩
+        """
+        if msgpack is None:
+            raise RuntimeError('msgpack is required for compact session')
+        super(CompactSessionSerializer, self).__init__(secret_key, salt)
+        self.compress = compress
+
+    def dump_payload(self, obj):
+        data = msgpack.packb(obj, use_bin_type=True)
+        mark = b''
+        if self.compress:
+            compressed = zlib.compress(data)
+            if len(compressed) < len(data) - 1:
+                data = compressed
+                mark = _COMPRESSED_MARK
+        return mark + base64_encode(data)
+
+    def load_payload(self, payload, *args, **kwargs):
+        decompress = payload.startswith(_COMPRESSED_MARK)
+        if decompress:
+            payload = payload[1:]
+        try:
+            data = base64_decode(payload)
+            if decompress:
+                data = zlib.decompress(data)
+            return msgpack.unpackb(data, raw=False)
+        except Exception as e:
+            raise BadPayload(
+                'Could not load the payload because an exception occurred '
+                'on unserializing the data.', original_error=e)
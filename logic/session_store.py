@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    session_store.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    服务端session存储(供`MongoSessionInterface`使用)
+
+    cookie中只保存签名后的sid，session数据按sid保存在mongo或redis中。
+    `CachedSessionStore`在存储前面加一层进程内的TTL LRU缓存，同一个session
+    的重复请求不再访问存储。session修改或删除时通过redis pub/sub通知所有
+    进程删除本地缓存。
+
+    session只在修改时写入(见`MongoSessionInterface`)。`write_behind`为True时，
+    已有session的修改先放在进程内，由后台greenlet每`flush_interval`秒合并
+    同一个sid的多次修改后批量写入(redis pipeline / mongo bulk_write)，然后
+    发送失效通知；其他进程最多在一个刷新间隔内读到旧数据，进程崩溃时丢失
+    未刷新的修改。新建和删除session仍然立即写入，撤销不会被延迟。
+
+"""
+import atexit
+import json
+import sys
+import traceback
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import gevent
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from utils.lru_cache import TTLLRUCache, MISSING
+
+
+class SessionStore(object):
+    """session存储基类"""
+
+    def get(self, sid):
+        """
+        :param sid: session id
+        :return data: session数据，不存在时返回None
+        """
+        raise (NotImplementedError())
+
+    def save(self, sid, data, ttl):
+        """
+        :param sid: session id
+        :param data: session数据
+        :param ttl: 过期时间(秒)
+        """
+        raise (NotImplementedError())
+
+    def delete(self, sid):
+        """
+        :param sid: session id
+        """
+        raise (NotImplementedError())
+
+    def save_later(self, sid, data, ttl):
+        """
+        修改已有的session，允许延迟批量写入(默认立即写入)
+        :param sid: session id
+        :param data: session数据
+        :param ttl: 过期时间(秒)
+        """
+        self.save(sid, data, ttl)
+
+    def save_many(self, items):
+        """
+        批量写入
+        :param items: [(sid, data, ttl), ...]
+        """
+        for sid, data, ttl in items:
+            self.save(sid, data, ttl)
+
+    @staticmethod
+    def new_sid():
+        """生成新的sid"""
+        return str(ObjectId())
+
+
+class RedisSessionStore(SessionStore):
+    """redis session存储"""
+
+    def __init__(self, redis, key_prefix='session:'):
+        """
+        :param redis: Redis链接
+        :param key_prefix: redis key前缀
+        """
+        self.redis = redis
+        self.key_prefix = key_prefix
+
+    def get(self, sid):
+        val = self.redis.get(self.key_prefix + sid)
+        if val is None:
+            return None
+        if isinstance(val, bytes):
+            val = val.decode('utf-8')
+        return json.loads(val)
+
+    def save(self, sid, data, ttl):
+        self.redis.setex(self.key_prefix + sid, int(ttl), json.dumps(data))
+
+    def delete(self, sid):
+        self.redis.delete(self.key_prefix + sid)
+
+    def save_many(self, items):
+        pipe = self.redis.pipeline(transaction=False)
+        for sid, data, ttl in items:
+            pipe.setex(self.key_prefix + sid, int(ttl), json.dumps(data))
+        pipe.execute()
+
+
+class MongoSessionStore(SessionStore):
+    """mongo session存储(`model.session.Session`)"""
+
+    def __init__(self, model=None):
+        """
+        :param model: session model，默认为`model.session.Session`
+        """
+        if model is None:
+            from model.session import Session as model
+        self.model = model
+
+    def get(self, sid):
+        doc = self.model.p_col.find_one(
+            {self.model.Field._id: sid},
+            {self.model.Field.data: 1, self.model.Field.expire_at: 1}
+        )
+        if doc is None:
+            return None
+        # TTL索引的清理有延迟
+        if doc[self.model.Field.expire_at] <= datetime.utcnow():
+            return None
+        return doc[self.model.Field.data]
+
+    def _update(self, sid, data, ttl):
+        """:return (filter, update): upsert的参数"""
+        return (
+            {self.model.Field._id: sid},
+            {'$set': {
+                self.model.Field.data: data,
+                self.model.Field.expire_at:
+                    datetime.utcnow() + timedelta(seconds=ttl)
+            }}
+        )
+
+    def save(self, sid, data, ttl):
+        self.model.p_col.update_one(*self._update(sid, data, ttl),
+                                    upsert=True)
+
+    def delete(self, sid):
+        self.model.p_col.delete_one({self.model.Field._id: sid})
+
+    def save_many(self, items):
+        if not items:
+            return
+        self.model.p_col.bulk_write(
+            [UpdateOne(*self._update(sid, data, ttl), upsert=True)
+             for sid, data, ttl in items],
+            ordered=False)
+
+
+class CachedSessionStore(SessionStore):
+    """带本地缓存的session存储"""
+
+    def __init__(self, store, redis, maxsize=10000, ttl=60,
+                 channel='session:invalidate', write_behind=False,
+                 flush_interval=0.05, batch_size=500):
+        """
+        :param store: 实际的session存储
+        :param redis: 用于pub/sub的Redis链接
+        :param maxsize: 本地缓存的最大session数
+        :param ttl: 本地缓存时间(秒)，pub/sub消息丢失时的最长不一致时间
+        :param channel: 失效通知的频道
+        :param write_behind: 是否批量写入已有session的修改
+        :param flush_interval: 后台greenlet的刷新间隔(秒)
+        :param batch_size: 每批最多写入的session数
+        """
+        self.store = store
+        self.redis = redis
+        self.channel = channel
+        self.cache = TTLLRUCache(maxsize=maxsize, ttl=ttl)
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        # 区分自己发出的通知
+        self._origin = str(ObjectId())
+        self._listener = None
+
+        # sid -> (data, ttl)，同一个sid在刷新前的多次修改只写入最后一次
+        self._pending = OrderedDict()
+        # 正在写入的sid，写入期间被删除的需要再删除一次
+        self._flushing = set()
+        self._deleted = set()
+        self._flusher = None
+
+        # 统计
+        self.flushed = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def get(self, sid):
+        if self._listener is None:
+            self._listener = gevent.spawn(self._listen)
+        pending = self._pending.get(sid)
+        if pending is not None:
+            # 本地缓存可能已经淘汰，以未写入的修改为准
+            return pending[0]
+        data = self.cache.get(sid)
+        if data is not MISSING:
+            return data
+        data = self.store.get(sid)
+        self.cache.set(sid, data)
+        return data
+
+    def save(self, sid, data, ttl):
+        self._pending.pop(sid, None)
+        self.store.save(sid, data, ttl)
+        self.cache.set(sid, data)
+        self._publish([sid])
+
+    def save_later(self, sid, data, ttl):
+        if not self.write_behind:
+            self.save(sid, data, ttl)
+            return
+        if self._flusher is None:
+            self._flusher = gevent.spawn(self._flush_loop)
+            atexit.register(self.flush)
+        if self._pending.pop(sid, None) is not None:
+            self.coalesced += 1
+        self._pending[sid] = (data, ttl)
+        self.cache.set(sid, data)
+
+    def delete(self, sid):
+        self._pending.pop(sid, None)
+        if sid in self._flushing:
+            self._deleted.add(sid)
+        self.store.delete(sid)
+        self.cache.delete(sid)
+        self._publish([sid])
+
+    def flush(self):
+        """
+        把未写入的修改批量写入存储，并发送失效通知
+        :return count: 写入的session数
+        """
+        count = 0
+        while self._pending:
+            batch = []
+            while self._pending and len(batch) < self.batch_size:
+                sid, (data, ttl) = self._pending.popitem(last=False)
+                batch.append((sid, data, ttl))
+            sids = [sid for sid, _, _ in batch]
+            self._flushing.update(sids)
+            try:
+                self.store.save_many(batch)
+            except Exception:
+                # 与请求登记一样丢弃并计数，本进程的缓存在ttl后过期
+                self.dropped += len(batch)
+                raise
+            finally:
+                self._flushing.difference_update(sids)
+                deleted, self._deleted = self._deleted, set()
+            # 写入期间被删除(撤销)的session，不能被这次写入恢复
+            for sid in deleted:
+                self.store.delete(sid)
+            self._publish(sids)
+            count += len(batch)
+        self.flushed += count
+        return count
+
+    def _flush_loop(self):
+        while True:
+            gevent.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                sys.stderr.write(traceback.format_exc())
+
+    def _publish(self, sids):
+        try:
+            if len(sids) == 1:
+                self.redis.publish(
+                    self.channel, '%s|%s' % (self._origin, sids[0]))
+                return
+            pipe = self.redis.pipeline(transaction=False)
+            for sid in sids:
+                pipe.publish(self.channel, '%s|%s' % (self._origin, sid))
+            pipe.execute()
+        except Exception:
+            # 通知失败时其他进程的缓存最多在ttl后过期
+            sys.stderr.write(traceback.format_exc())
+
+    def _listen(self):
+        """订阅失效通知，删除本地缓存"""
+        while True:
+            pubsub = None
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                while True:
+                    # 带超时等待，不受连接的socket_timeout影响
+                    message = pubsub.get_message(timeout=1)
+                    if message is None:
+                        continue
+                    data = message.get('data')
+                    if isinstance(data, bytes):
+                        data = data.decode('utf-8')
+                    origin, _, sid = data.partition('|')
+                    if origin != self._origin:
+                        self.cache.delete(sid)
+            except Exception:
+                sys.stderr.write(traceback.format_exc())
+                if pubsub is not None:
+                    # 把连接还给连接池
+                    pubsub.close()
+            # 重新订阅期间可能丢失通知
+            self.cache.clear()
+            gevent.sleep(1)
+
+
+def get_session_store(name, redis, cache_size=10000, cache_ttl=60,
+                      write_behind=False):
+    """
+    :param name: 存储名称(`redis`, `mongo`)，为None则不使用服务端存储
+    :param redis: Redis链接(redis存储和失效通知使用)
+    :param cache_size: 本地缓存的最大session数
+    :param cache_ttl: 本地缓存时间(秒)
+    :param write_behind: 是否批量写入已有session的修改
+    :return store: `CachedSessionStore`实例或None
+    """
+    if not name:
+        return None
+    if name == 'redis':
+        store = RedisSessionStore(redis)
+    elif name == 'mongo':
+        store = MongoSessionStore()
+    else:
+        raise ValueError('Unknown session store: %s' % name)
+    return CachedSessionStore(store, redis, maxsize=cache_size, ttl=cache_ttl,
+                              write_behind=write_behind)
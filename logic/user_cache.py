@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    user_cache.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    用户信息缓存(供`LoginManagerLoader`使用)
+
+    两级缓存:
+    * 请求内缓存 - 保存在`flask.g`中，同一个请求多次加载同一个用户只查一次
+    * 进程内缓存 - `TTLLRUCache`，有数量上限和过期时间
+
+    两级都没有命中时，同一个用户id的并发请求(greenlet)共用同一次mongo查询，
+    其他greenlet等待查询结果，避免缓存失效时大量请求同时查库。
+
+"""
+from flask import g, has_app_context
+from gevent.event import AsyncResult
+
+from utils.lru_cache import TTLLRUCache, MISSING
+
+
+def _find_user(user_id):
+    """默认的加载方法: 从`User.s_col`中查询"""
+    from model.user import User
+    return User.s_col.find_one({User.Field._id: user_id})
+
+
+class UserCache(object):
+    """用户信息缓存"""
+
+    def __init__(self, loader=None, maxsize=10000, ttl=60):
+        """
+        :param loader: 加载方法`loader(user_id) -> dict or None`，
+            默认从`User.s_col`中查询
+        :param maxsize: 进程内最多缓存的用户数
+        :param ttl: 进程内缓存时间(秒)
+        """
+        self.loader = loader or _find_user
+        self.cache = TTLLRUCache(maxsize=maxsize, ttl=ttl)
+        # user_id -> AsyncResult，正在查询的用户
+        self._inflight = {}
+        # 请求内缓存命中次数
+        self.request_hits = 0
+        # 等待其他greenlet查询结果的次数
+        self.coalesced = 0
+
+    def get(self, user_id):
+        """
+        :param user_id: 用户id
+        :return user: 用户文档，不存在时返回None
+        """
+        memo = self._request_memo()
+        if memo is not None and user_id in memo:
+            self.request_hits += 1
+            return memo[user_id]
+
+        user = self.cache.get(user_id)
+        if user is MISSING:
+            user = self._load(user_id)
+        if memo is not None:
+            memo[user_id] = user
+        return user
+
+    def _load(self, user_id):
+        """查询用户，同一个id同时只有一次查询"""
+        pending = self._inflight.get(user_id)
+        if pending is not None:
+            self.coalesced += 1
+            user = pending.get()
+            if user is MISSING:
+                # 查询的greenlet没有完成，重新查询
+                return self._load(user_id)
+            return user
+
+        pending = self._inflight[user_id] = AsyncResult()
+        try:
+            user = self.loader(user_id)
+        except Exception as e:
+            pending.set_exception(e)
+            raise
+        else:
+            self.cache.set(user_id, user)
+            pending.set(user)
+            return user
+        finally:
+            del self._inflight[user_id]
+            if not pending.ready():
+                # 被gevent.Timeout或GreenletExit中断(BaseException)，不能让
+                # 等待者一直阻塞
+                pending.set(MISSING)
+
+    @staticmethod
+    def _request_memo():
+        """当前请求的缓存，不在flask上下文中时返回None"""
+        if not has_app_context():
+            return None
+        memo = getattr(g, '_user_cache', None)
+        if memo is None:
+            memo = g._user_cache = {}
+        return memo
+
+    def invalidate(self, user_id):
+        """用户信息修改后删除缓存"""
+        self.cache.delete(user_id)
+        memo = self._request_memo()
+        if memo is not None:
+            memo.pop(user_id, None)
+
+    def stats(self):
+        """统计信息"""
+        stats = self.cache.stats()
+        stats['request_hits'] = self.request_hits
+        stats['coalesced'] = self.coalesced
+        stats['inflight'] = len(self._inflight)
+        return stats
+
+    def render(self):
+        """输出Prometheus文本格式"""
+        stats = self.stats()
+        lines = [
+            '# HELP user_cache_requests_total User cache lookups by result.',
+            '# TYPE user_cache_requests_total counter',
+        ]
+        for result, key in (('request_hit', 'request_hits'),
+                            ('hit', 'hits'),
+                            ('miss', 'misses'),
+                            ('coalesced', 'coalesced')):
+            lines.append('user_cache_requests_total{result="%s"} %d'
+                         % (result, stats[key]))
+        lines.append('# HELP user_cache_size Users cached in this process.')
+        lines.append('# TYPE user_cache_size gauge')
+        lines.append('user_cache_size %d' % stats['size'])
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    loader.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    按字段批量查询的loader(DataLoader)
+
+    同一个greenlet或者同一轮hub循环中各greenlet请求的key先收集起来，由一个
+    greenlet发出一次`{field: {'$in': keys}}`查询，再把结果分发给各个调用方。
+    查询结果缓存在loader中，loader按请求保存在`flask.g`里，所以同一个请求内
+    同一个key只查询一次::
+
+        loader = get_loader(User.s_col, User.Field.phone,
+                            projection=[User.Field.name])
+        users = loader.load_many(phones)
+
+    只有使用同一个loader的调用才会合并成一次查询。`flask.g`按greenlet区分，
+    请求中`gevent.spawn`出来的greenlet不在请求上下文中，`get_loader()`会
+    返回新的loader(不合并，也不共享缓存)。需要并发加载时，在请求greenlet中
+    取得loader后作为参数传给spawn出来的greenlet::
+
+        loader = get_loader(User.s_col)
+        jobs = [gevent.spawn(render_item, loader, item) for item in items]
+
+"""
+import gevent
+from flask import g, has_app_context
+from gevent.event import AsyncResult
+
+
+class BatchLoader(object):
+    """按字段批量查询`Collection`"""
+
+    def __init__(self, collection, field='_id', projection=None,
+                 max_batch_size=1000):
+        """
+        :param collection: pymongo Collection
+        :param field: 查询的字段，每个值对应一个文档(多个文档时取其中一个)
+        :param projection: 返回的字段(list或dict)，会自动包含`field`
+        :param max_batch_size: 一次`$in`查询最多的key数量
+        """
+        self.collection = collection
+        self.field = field
+        if projection is not None:
+            if isinstance(projection, dict):
+                projection = dict(projection)
+                if projection and all(projection.values()):
+                    projection[field] = 1
+            else:
+                projection = list(projection)
+                if field not in projection:
+                    projection.append(field)
+        self.projection = projection
+        self.max_batch_size = max_batch_size
+
+        # key -> 文档(不存在为None)
+        self._cache = {}
+        # key -> AsyncResult，等待查询的key
+        self._pending = {}
+        self._dispatcher = None
+        self.queries = 0
+
+    def load(self, key):
+        """
+        :param key: 字段值
+        :return doc: 文档，不存在时返回None
+        """
+        if key in self._cache:
+            return self._cache[key]
+        return self._enqueue(key).get()
+
+    def load_many(self, keys):
+        """
+        :param keys: 字段值列表
+        :return docs: 与keys顺序一致的文档列表，不存在的为None
+        """
+        results = [
+            None if key in self._cache else self._enqueue(key)
+            for key in keys
+        ]
+        return [
+            self._cache[key] if result is None else result.get()
+            for key, result in zip(keys, results)
+        ]
+
+    def prime(self, key, doc):
+        """把已经查到的文档放入缓存"""
+        self._cache[key] = doc
+
+    def clear(self, key=None):
+        """删除缓存，key为None时全部删除"""
+        if key is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(key, None)
+
+    def _enqueue(self, key):
+        result = self._pending.get(key)
+        if result is None:
+            result = self._pending[key] = AsyncResult()
+            if self._dispatcher is None:
+                # 在下一轮hub循环中查询，收集同一轮中其他greenlet的key
+                self._dispatcher = gevent.spawn(self._dispatch)
+        return result
+
+    def _dispatch(self):
+        pending, self._pending = self._pending, {}
+        self._dispatcher = None
+        keys = list(pending)
+        for i in range(0, len(keys), self.max_batch_size):
+            batch = keys[i:i + self.max_batch_size]
+            try:
+                docs = self._query(batch)
+            except Exception as e:
+                for key in batch:
+                    pending[key].set_exception(e)
+                continue
+            for key in batch:
+                doc = docs.get(key)
+                self._cache[key] = doc
+                pending[key].set(doc)
+
+    def _query(self, keys):
+        """
+        :return docs: key -> 文档
+        """
+        self.queries += 1
+        cursor = self.collection.find(
+            {self.field: {'$in': keys}}, self.projection)
+        return {doc[self.field]: doc for doc in cursor}
+
+
+def get_loader(collection, field='_id', projection=None):
+    """获取当前请求的loader，不在flask上下文中(包括请求中spawn的greenlet)时
+    返回新的loader
+    :param collection: pymongo Collection
+    :param field: 查询的字段
+    :param projection: 返回的字段
+    :return loader: `BatchLoader`实例
+    """
+    if not has_app_context():
+        return BatchLoader(collection, field, projection)
+
+    loaders = getattr(g, '_batch_loaders', None)
+    if loaders is None:
+        loaders = g._batch_loaders = {}
+    if isinstance(projection, dict):
+        projection_key = tuple(sorted(projection.items()))
+    elif projection is not None:
+        projection_key = tuple(sorted(projection))
+    else:
+        projection_key = None
+    key = (collection.full_name, field, projection_key)
+    loader = loaders.get(key)
+    if loader is None:
+        loader = loaders[key] = BatchLoader(collection, field, projection)
+    return loader
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    session.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+"""
+from pymongo.operations import IndexModel
+from pymongo.read_preferences import ReadPreference
+
+from . import db
+
+
+class Session(object):
+    """
+    服务端保存的session(见`logic.session_store.MongoSessionStore`)
+
+    * `_id` (str) - sid
+    * `data` (dict) - session数据
+    * `expire_at` (datetime) - 过期时间，过期后由TTL索引删除
+
+    ---
+    """
+    COL_NAME = 'session'
+    p_col = db.get_collection(
+        COL_NAME, read_preference=ReadPreference.PRIMARY_PREFERRED
+    )
+    s_col = db.get_collection(
+        COL_NAME, read_preference=ReadPreference.SECONDARY_PREFERRED
+    )
+
+    class Field(object):
+        _id = '_id'
+        data = 'data'
+        expire_at = 'expire_at'
+
+    try:
+        indexes = list()
+        indexes.append(
+            IndexModel(Field.expire_at, expireAfterSeconds=0)
+        )
+        p_col.create_indexes(indexes)
+    except Exception as e:
+        pass
@@ -6,7 +6,6 @@
 
 """
 from flask_login import UserMixin
-from pymongo.collection import Collection
 from pymongo.read_preferences import ReadPreference
 
 from . import db
@@ -25,11 +24,11 @@ class User(UserMixin):
     ---
     """
     COL_NAME = 'user'
-    p_col = Collection(
-        db, COL_NAME, read_preference=ReadPreference.PRIMARY_PREFERRED
+    p_col = db.get_collection(
+        COL_NAME, read_preference=ReadPreference.PRIMARY_PREFERRED
     )
-    s_col = Collection(
-        db, COL_NAME, read_preference=ReadPreference.SECONDARY_PREFERRED
+    s_col = db.get_collection(
+        COL_NAME, read_preference=ReadPreference.SECONDARY_PREFERRED
     )
 
     class Field(object):
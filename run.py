@@ -18,7 +18,12 @@ except Exception:
     from gevent.pywsgi import WSGIServer
 
 from app import app
-from configs import AppConf
+from configs import AppConf, MongoConf
+
+if MongoConf.WARM_UP_CONNECTIONS:
+    from model import db
+    from utils.mongo_client import warm_up
+    warm_up(db, MongoConf.WARM_UP_CONNECTIONS)
 
 
 if app.debug:
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    test_cache_rebuild.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    读穿透缓存未命中时的重建等待(需要fakeredis和lupa)
+
+"""
+import datetime
+import threading
+import time
+import unittest
+
+import fakeredis
+import redis
+
+try:
+    from fakeredis import FakeConnection
+except ImportError:
+    from fakeredis._server import FakeConnection
+
+import cache
+from cache import Cache, BaseLock
+
+MAX_CONNECTIONS = 5
+WAITERS = MAX_CONNECTIONS * 6
+LOAD_TIME = 1.5
+
+
+class SlowCache(Cache):
+    rebuild_timeout = 5
+
+    loads = 0
+
+    def key(self):
+        return 'test_cache_rebuild:hot'
+
+    def load(self):
+        SlowCache.loads += 1
+        time.sleep(LOAD_TIME)
+        return {'value': 1}
+
+
+class LocalCache(Cache):
+    local_size = 10
+
+    def key(self):
+        return 'test_cache_rebuild:local'
+
+    def load(self):
+        return {'when': datetime.datetime(2020, 1, 1), 'items': [1]}
+
+
+class CacheRebuildTest(unittest.TestCase):
+
+    def setUp(self):
+        server = fakeredis.FakeServer()
+        self.pool = redis.BlockingConnectionPool(
+            max_connections=MAX_CONNECTIONS, timeout=1,
+            connection_class=FakeConnection, server=server)
+        wait_pool = redis.BlockingConnectionPool(
+            max_connections=2, timeout=0,
+            connection_class=FakeConnection, server=server)
+        self.saved = cache._r, cache._lock_wait_r, BaseLock._queue
+        cache._r = redis.StrictRedis(connection_pool=self.pool)
+        cache._lock_wait_r = redis.StrictRedis(connection_pool=wait_pool)
+        BaseLock._queue = None
+        SlowCache.loads = 0
+
+    def tearDown(self):
+        cache._r, cache._lock_wait_r, BaseLock._queue = self.saved
+
+    def test_waiters_do_not_exhaust_pool(self):
+        results = []
+        errors = []
+
+        def get():
+            try:
+                results.append(SlowCache().get())
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=get) for _ in range(WAITERS)]
+        for t in threads:
+            t.start()
+        # 重建期间其他功能仍然可以拿到连接
+        time.sleep(LOAD_TIME / 2)
+        start = time.time()
+        self.assertTrue(cache._r.ping())
+        self.assertLess(time.time() - start, 0.5)
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(results, [{'value': 1}] * WAITERS)
+        self.assertEqual(SlowCache.loads, 1)
+
+    def test_lock_waiters_beyond_wait_pool(self):
+        class HotLock(BaseLock):
+            def key(self):
+                return 'test_cache_rebuild:lock'
+
+        holder = HotLock()
+        self.assertTrue(holder.acquire(10, 0))
+        acquired = []
+
+        def wait():
+            lock = HotLock()
+            if lock.acquire(10, 5):
+                acquired.append(lock)
+                lock.release()
+
+        threads = [threading.Thread(target=wait) for _ in range(WAITERS)]
+        for t in threads:
+            t.start()
+        time.sleep(1.5)
+        start = time.time()
+        self.assertTrue(cache._r.ping())
+        self.assertLess(time.time() - start, 0.5)
+        holder.release()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(acquired), WAITERS)
+
+    def test_tiers_return_same_independent_values(self):
+        LocalCache._local = None
+        loaded = LocalCache().get()
+        # 加载结果经过一次序列化，与之后从LRU/redis读到的一致
+        self.assertEqual(loaded, {'when': '2020-01-01 00:00:00',
+                                  'items': [1]})
+        loaded['items'].append(2)
+        local_hit = LocalCache().get()
+        self.assertEqual(local_hit['items'], [1])
+        local_hit['items'].append(3)
+        self.assertEqual(LocalCache().get()['items'], [1])
+        # 清空LRU后从redis读取
+        LocalCache._local = None
+        self.assertEqual(LocalCache().get(), {'when': '2020-01-01 00:00:00',
+                                              'items': [1]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    test_loader.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    `BatchLoader`的合并查询
+
+"""
+import os
+import unittest
+
+import gevent
+from flask import Flask
+
+from model.loader import BatchLoader, get_loader
+
+
+class FakeCollection(object):
+    """记录find查询的collection"""
+
+    full_name = 'test.user'
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.queries = []
+
+    def find(self, spec, projection=None):
+        (field, cond), = spec.items()
+        keys = cond['$in']
+        self.queries.append(list(keys))
+        return [doc for doc in self.docs if doc.get(field) in keys]
+
+
+DOCS = [{'_id': i, 'phone': '1380000%04d' % i, 'name': 'user%d' % i}
+        for i in range(10)]
+
+
+class BatchLoaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = FakeCollection(DOCS)
+
+    def test_dedup_across_greenlets(self):
+        loader = BatchLoader(self.collection)
+        jobs = [gevent.spawn(loader.load, i % 3) for i in range(9)]
+        gevent.joinall(jobs, raise_error=True)
+        self.assertEqual([job.value['_id'] for job in jobs], [0, 1, 2] * 3)
+        self.assertEqual(self.collection.queries, [[0, 1, 2]])
+        # 已经查询过的key不再查询
+        self.assertEqual(loader.load_many([2, 1])[0]['_id'], 2)
+        self.assertEqual(loader.queries, 1)
+
+    def test_batch_size(self):
+        loader = BatchLoader(self.collection, max_batch_size=4)
+        docs = loader.load_many(list(range(10)))
+        self.assertEqual([doc['_id'] for doc in docs], list(range(10)))
+        self.assertEqual([len(q) for q in self.collection.queries],
+                         [4, 4, 2])
+
+    def test_missing(self):
+        loader = BatchLoader(self.collection, field='phone',
+                             projection=['name'])
+        self.assertEqual(loader.projection, ['name', 'phone'])
+        docs = loader.load_many(['13800000001', 'none', '13800000001'])
+        self.assertEqual(docs[0]['name'], 'user1')
+        self.assertIsNone(docs[1])
+        self.assertIs(docs[2], docs[0])
+        # 不存在的结果也缓存
+        self.assertIsNone(loader.load('none'))
+        self.assertEqual(self.collection.queries,
+                         [['13800000001', 'none']])
+
+    def test_query_error(self):
+        loader = BatchLoader(self.collection)
+
+        def fail(keys):
+            raise ValueError('down')
+
+        loader._query = fail
+        with self.assertRaises(ValueError):
+            loader.load(1)
+
+    def test_get_loader_per_request(self):
+        root_path = os.path.dirname(os.path.abspath(__file__))
+        app = Flask(__name__, root_path=root_path, instance_path=root_path)
+        with app.test_request_context():
+            loader = get_loader(self.collection, 'phone', ['name'])
+            self.assertIs(get_loader(self.collection, 'phone', ['name']),
+                          loader)
+            self.assertIsNot(get_loader(self.collection, 'phone'), loader)
+            # spawn出来的greenlet不在请求上下文中，拿到的是新的loader
+            job = gevent.spawn(get_loader, self.collection, 'phone',
+                               ['name'])
+            job.join()
+            self.assertIsNot(job.value, loader)
+        with app.test_request_context():
+            self.assertIsNot(get_loader(self.collection, 'phone', ['name']),
+                             loader)
+
+
+if __name__ == '__main__':
+    unittest.main()
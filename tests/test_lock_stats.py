@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    test_lock_stats.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    按key统计的锁等待(有数量上限)
+
+"""
+import unittest
+
+from cache import lock_queue
+from utils.lru_cache import TTLLRUCache
+
+
+class LockStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = lock_queue._stats
+        lock_queue._stats = TTLLRUCache(maxsize=3, ttl=60)
+
+    def tearDown(self):
+        lock_queue._stats = self.saved
+
+    def test_per_key(self):
+        lock_queue.record_wait('a:rebuild', 0.5, True)
+        lock_queue.record_wait('a:rebuild', 1.5, False)
+        lock_queue.record_wait('b:rebuild', 0.1, True)
+        stats = lock_queue.lock_stats()
+        self.assertEqual(stats['a:rebuild'], {
+            'acquisitions': 1, 'timeouts': 1, 'wait_time': 2.0,
+            'max_wait_time': 1.5})
+        self.assertEqual(stats['b:rebuild']['acquisitions'], 1)
+
+    def test_bounded(self):
+        lock_queue.record_wait('hot', 0.1, True)
+        for i in range(10):
+            lock_queue.record_wait('cold:%d' % i, 0.1, True)
+            # 经常加锁的key不会被淘汰
+            lock_queue.record_wait('hot', 0.1, True)
+        stats = lock_queue.lock_stats()
+        self.assertEqual(len(stats), 3)
+        self.assertEqual(stats['hot']['acquisitions'], 11)
+        self.assertIn('cold:9', stats)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    test_logger.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    文件log handler
+
+"""
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from utils.logger import ConcurrentTimedRotatingFileHandler, AsyncLogHandler
+
+
+class ReopenTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'test.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_record(self, msg):
+        return logging.LogRecord('test', logging.INFO, __file__, 1, msg,
+                                 None, None)
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def check_reopen(self, buffer_size):
+        handler = ConcurrentTimedRotatingFileHandler(
+            self.path, buffer_size=buffer_size)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        try:
+            handler.handle(self.make_record('before'))
+            handler.flush()
+            # logrotate把文件移走
+            os.rename(self.path, self.path + '.1')
+            handler._last_check = 0
+            handler.handle(self.make_record('after'))
+            handler.flush()
+        finally:
+            handler.close()
+        self.assertEqual(self.read(self.path + '.1'), 'before\n')
+        self.assertEqual(self.read(self.path), 'after\n')
+
+    def test_reopen_unbuffered(self):
+        self.check_reopen(0)
+
+    def test_reopen_buffered(self):
+        self.check_reopen(1024)
+
+
+class SlowHandler(logging.Handler):
+    """每条record等待一段时间的目标handler"""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+        self.delay = threading.Event()
+
+    def emit(self, record):
+        self.delay.wait(0.002)
+        self.messages.append(record.getMessage())
+
+
+class AsyncBlockTest(unittest.TestCase):
+
+    def test_block_waits_without_polling(self):
+        target = SlowHandler()
+        handler = AsyncLogHandler([target], queue_size=5, batch_size=2,
+                                  overflow=AsyncLogHandler.OVERFLOW_BLOCK)
+        sleeps = []
+        sleep = time.sleep
+
+        def counting_sleep(seconds):
+            if threading.current_thread() is threading.main_thread():
+                sleeps.append(seconds)
+            sleep(seconds)
+
+        time.sleep = counting_sleep
+        try:
+            for i in range(100):
+                handler.handle(logging.LogRecord(
+                    'test', logging.INFO, __file__, 1, 'msg %d', (i,), None))
+        finally:
+            time.sleep = sleep
+        handler.close()
+        self.assertEqual(target.messages, ['msg %d' % i for i in range(100)])
+        # 队列满时等待写线程通知，而不是每1ms轮询一次
+        self.assertEqual(sleeps, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
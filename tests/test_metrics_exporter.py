@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    test_metrics_exporter.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    /metrics的访问控制和指标登记
+
+"""
+import os
+import unittest
+
+from flask import Flask
+
+from logic.metrics_exporter import MetricsExporter
+
+
+class MetricsExporterTest(unittest.TestCase):
+
+    def setUp(self):
+        root_path = os.path.dirname(os.path.abspath(__file__))
+        self.app = Flask(__name__, root_path=root_path,
+                         instance_path=root_path)
+        self.exporter = MetricsExporter(allow_ips=['10.0.0.5'],
+                                        token='secret')
+        self.exporter.register('a', lambda: 'a_total 1\n')
+        self.exporter.register('broken', lambda: 1 / 0)
+        self.exporter.register('b', lambda: 'b_total 2\n')
+        self.exporter.init_app(self.app)
+        self.client = self.app.test_client()
+
+    def get(self, remote_addr, headers=None):
+        return self.client.get('/metrics', headers=headers or {},
+                               environ_base={'REMOTE_ADDR': remote_addr})
+
+    def test_allowed_ip(self):
+        rsp = self.get('10.0.0.5')
+        self.assertEqual(rsp.status_code, 200)
+        # 出错的模块被跳过
+        self.assertEqual(rsp.get_data(as_text=True),
+                         'a_total 1\nb_total 2\n')
+
+    def test_rejected(self):
+        self.assertEqual(self.get('1.2.3.4').status_code, 404)
+        # 经过反向代理的请求(伪造X-Forward-For也一样)
+        self.assertEqual(self.get('10.0.0.5', {
+            'X-Forward-For': '10.0.0.5'}).status_code, 404)
+        self.assertEqual(self.get('1.2.3.4', {
+            'Authorization': 'Bearer wrong'}).status_code, 404)
+
+    def test_token(self):
+        rsp = self.get('1.2.3.4', {'Authorization': 'Bearer secret',
+                                   'X-Forward-For': '1.2.3.4'})
+        self.assertEqual(rsp.status_code, 200)
+
+    def test_no_token(self):
+        exporter = MetricsExporter(allow_ips=[])
+        with self.app.test_request_context(
+                headers={'Authorization': 'Bearer '}):
+            self.assertFalse(exporter.allowed())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    test_mongo_client.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    各用途的连接名额(不需要mongo)
+
+"""
+import threading
+import time
+import unittest
+
+from pymongo import MongoClient
+
+from utils.mongo_client import PurposeLimiter, PurposeDatabase, \
+    PurposeCollection, PurposeCursor
+
+
+class PurposeLimiterTest(unittest.TestCase):
+
+    def test_limit_and_wait_time(self):
+        limiter = PurposeLimiter('test', 2)
+        lock = threading.Lock()
+        state = {'current': 0, 'peak': 0}
+
+        def work():
+            with limiter.checkout():
+                # 嵌套的操作不占用第二个名额
+                with limiter.checkout():
+                    with lock:
+                        state['current'] += 1
+                        state['peak'] = max(state['peak'], state['current'])
+                    time.sleep(0.05)
+                    with lock:
+                        state['current'] -= 1
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        stats = limiter.stats()
+        self.assertEqual(state['peak'], 2)
+        self.assertEqual(stats['max_in_use'], 2)
+        self.assertEqual(stats['in_use'], 0)
+        self.assertEqual(stats['checkouts'], 8)
+        self.assertGreater(stats['wait_time'], 0.1)
+
+    def test_database_returns_limited_collections(self):
+        client = MongoClient('localhost:27017', connect=False)
+        db = PurposeDatabase(client, 'test', PurposeLimiter('test', 1))
+        self.assertIsInstance(db['user'], PurposeCollection)
+        self.assertIsInstance(db.user, PurposeCollection)
+        col = db.get_collection('user')
+        self.assertIsInstance(col, PurposeCollection)
+        self.assertIsInstance(col.find(), PurposeCursor)
+
+
+if __name__ == '__main__':
+    unittest.main()
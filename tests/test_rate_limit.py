@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    test_rate_limit.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Flask-Limiter的redis存储和预扣策略(需要fakeredis和lupa)
+
+"""
+import os
+import unittest
+
+import fakeredis
+import redis
+from flask import Flask
+from flask_limiter import Limiter
+from limits import parse
+from limits.errors import ConfigurationError
+from limits.storage import storage_from_string
+
+try:
+    from fakeredis import FakeConnection
+except ImportError:
+    from fakeredis._server import FakeConnection
+
+from logic.rate_limit import PooledRedisStorage, \
+    LeasedFixedWindowRateLimiter
+
+
+def make_pool():
+    return redis.BlockingConnectionPool(
+        max_connections=2, timeout=1, connection_class=FakeConnection,
+        server=fakeredis.FakeServer())
+
+
+class PooledRedisStorageTest(unittest.TestCase):
+
+    def test_requires_pool(self):
+        with self.assertRaises(ConfigurationError):
+            storage_from_string('redis+pool://')
+
+    def test_limiter_uses_given_pool(self):
+        pool = make_pool()
+        root_path = os.path.dirname(os.path.abspath(__file__))
+        app = Flask(__name__, root_path=root_path, instance_path=root_path)
+        limiter = Limiter(app, key_func=lambda: 'test',
+                          storage_uri='redis+pool://',
+                          storage_options={'connection_pool': pool})
+
+        @app.route('/')
+        @limiter.limit('2/minute')
+        def index():
+            return 'ok'
+
+        storage = limiter._storage
+        self.assertIsInstance(storage, PooledRedisStorage)
+        self.assertIs(storage.storage.connection_pool, pool)
+        client = app.test_client()
+        self.assertEqual([client.get('/').status_code for _ in range(3)],
+                         [200, 200, 429])
+        # 计数写入了传入的连接池所连接的redis
+        keys = redis.StrictRedis(connection_pool=pool).keys('LIMITER*')
+        self.assertEqual(len(keys), 1)
+
+
+class LeasedFixedWindowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = storage_from_string(
+            'redis+pool://', connection_pool=make_pool())
+
+    def make_limiter(self, workers=1):
+        limiter = LeasedFixedWindowRateLimiter(self.storage)
+        limiter.lease_size = 50
+        limiter.workers = workers
+        return limiter
+
+    def test_small_limit_falls_back(self):
+        # 10/minute: 两个进程各预扣一批会让对方提前拒绝
+        item = parse('10/minute')
+        a, b = self.make_limiter(), self.make_limiter()
+        results = [(a if i % 2 else b).hit(item, 'ip') for i in range(12)]
+        self.assertEqual(results, [True] * 10 + [False] * 2)
+        self.assertEqual(a.leases + b.leases, 0)
+        self.assertEqual(self.storage.get(item.key_for('ip')), 12)
+
+    def test_threshold_scales_with_workers(self):
+        item = parse('1000/minute')
+        self.assertTrue(self.make_limiter(workers=10)._leasable(item))
+        self.assertFalse(self.make_limiter(workers=11)._leasable(item))
+
+    def test_leases_large_limit(self):
+        item = parse('1000/minute')
+        limiter = self.make_limiter()
+        for _ in range(30):
+            self.assertTrue(limiter.hit(item, 'ip'))
+        self.assertEqual(limiter.leases, 1)
+        self.assertEqual(self.storage.get(item.key_for('ip')), 50)
+
+    def test_window_stats_include_unused_lease(self):
+        item = parse('1000/minute')
+        limiter = self.make_limiter()
+        for _ in range(30):
+            limiter.hit(item, 'ip')
+        # redis计数为50，其中20个是本进程还没有用的额度
+        reset, remaining = limiter.get_window_stats(item, 'ip')
+        self.assertEqual(remaining, 970)
+        self.assertGreater(reset, 0)
+        other = self.make_limiter()
+        self.assertEqual(other.get_window_stats(item, 'ip')[1], 950)
+
+
+if __name__ == '__main__':
+    unittest.main()
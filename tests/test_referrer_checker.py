@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    test_referrer_checker.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    `ReferrerChecker`的域名校验
+
+"""
+import os
+import unittest
+
+from flask import Flask
+
+from logic.flask_extension import ReferrerChecker, referrer_netloc
+
+ALLOW_DOMAINS = ['example.com', '*.example.com', 'local.test:8080']
+
+
+class ReferrerNetlocTest(unittest.TestCase):
+
+    def test_netloc(self):
+        self.assertEqual(referrer_netloc('https://Example.COM/a?b=1'),
+                         'example.com')
+        self.assertEqual(referrer_netloc('http://u:p@a.example.com:8080/'),
+                         'a.example.com:8080')
+        self.assertEqual(referrer_netloc('http://[::1]:8080/'), '[::1]:8080')
+        self.assertIsNone(referrer_netloc('ftp://example.com/'))
+        self.assertIsNone(referrer_netloc('example.com/a'))
+        self.assertIsNone(referrer_netloc('http://example.com:99999/'))
+
+
+class ReferrerCheckerTest(unittest.TestCase):
+
+    def setUp(self):
+        root_path = os.path.dirname(os.path.abspath(__file__))
+        self.app = Flask(__name__, root_path=root_path,
+                         instance_path=root_path)
+        self.checker = ReferrerChecker(ALLOW_DOMAINS)
+
+    def check(self, referrer):
+        headers = {} if referrer is None else {'Referer': referrer}
+        with self.app.test_request_context(headers=headers):
+            return self.checker.check_referrer() is None
+
+    def test_allowed(self):
+        self.assertTrue(self.check('https://example.com/page'))
+        self.assertTrue(self.check('https://www.Example.com/page?x=1'))
+        self.assertTrue(self.check('http://a.b.example.com#top'))
+        self.assertTrue(self.check('http://local.test:8080/'))
+        self.assertTrue(self.check('http://user@example.com/'))
+
+    def test_rejected(self):
+        self.assertFalse(self.check(None))
+        self.assertFalse(self.check('https://evil.com/'))
+        self.assertFalse(self.check('http://local.test/'))
+        self.assertFalse(self.check('javascript://example.com/'))
+
+    def test_bypass(self):
+        self.assertFalse(self.check('http://evil.com?x.example.com'))
+        self.assertFalse(self.check('http://evil.com#.example.com'))
+        self.assertFalse(self.check('http://example.com@evil.com'))
+        self.assertFalse(self.check('http://example.com:x@evil.com/'))
+        self.assertFalse(self.check('http://evil.com\\.example.com/'))
+        self.assertFalse(self.check('http://evilexample.com/'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    test_session_cookie.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    `MongoSessionInterface`的cookie格式
+
+"""
+import os
+import unittest
+
+from flask import Flask
+from itsdangerous import URLSafeTimedSerializer
+
+from logic.flask_extension import MongoSessionInterface, \
+    session_body_lookup
+from logic.session_serializer import SESSION_SALT
+
+SESSION_DATA = {'sid': '5f1a2b3c4d5e6f7a8b9c0d1e', 'status': 20,
+                'channel': 'app'}
+
+
+class SessionCookieTest(unittest.TestCase):
+
+    def setUp(self):
+        root_path = os.path.dirname(os.path.abspath(__file__))
+        self.app = Flask(__name__, root_path=root_path,
+                         instance_path=root_path)
+        self.app.secret_key = 'test-secret-key'
+
+    def open_session(self, interface, val):
+        cookie = '%s=%s' % (self.app.session_cookie_name, val)
+        with self.app.test_request_context(
+                headers={'Cookie': cookie}) as ctx:
+            return interface.open_session(self.app, ctx.request)
+
+    def test_msgpack_roundtrip(self):
+        interface = MongoSessionInterface(cookie_format='msgpack')
+        val = interface.get_serializer(self.app).dumps(SESSION_DATA)
+        session = self.open_session(interface, val)
+        self.assertEqual(dict(session), SESSION_DATA)
+        self.assertIsNotNone(session.issued_at)
+
+    def test_msgpack_loads_legacy_json_cookie(self):
+        # 切换格式之前URLSafeTimedSerializer签发的cookie
+        val = URLSafeTimedSerializer(
+            self.app.secret_key, SESSION_SALT).dumps(SESSION_DATA)
+        interface = MongoSessionInterface(cookie_format='msgpack')
+        session = self.open_session(interface, val)
+        self.assertEqual(dict(session), SESSION_DATA)
+        self.assertTrue(session.loaded)
+
+    def test_bad_cookie_is_empty_session(self):
+        interface = MongoSessionInterface(cookie_format='msgpack')
+        val = URLSafeTimedSerializer(
+            'other-secret-key', SESSION_SALT).dumps(SESSION_DATA)
+        session = self.open_session(interface, val)
+        self.assertEqual(dict(session), {})
+        self.assertTrue(session.loaded)
+
+    def test_json_rejects_msgpack_cookie(self):
+        val = MongoSessionInterface(cookie_format='msgpack').get_serializer(
+            self.app).dumps(SESSION_DATA)
+        session = self.open_session(MongoSessionInterface(), val)
+        self.assertEqual(dict(session), {})
+        self.assertTrue(session.loaded)
+
+    def test_form_lookup_only_for_declared_endpoints(self):
+        @self.app.route('/login', methods=['POST'])
+        @session_body_lookup
+        def login():
+            return ''
+
+        @self.app.route('/upload', methods=['POST'])
+        def upload():
+            return ''
+
+        interface = MongoSessionInterface()
+        name = self.app.session_cookie_name
+        for path, expected in [('/login', 'val'), ('/upload', None)]:
+            with self.app.test_request_context(
+                    path, method='POST', data={name: 'val'}):
+                self.assertEqual(interface.get_session_val(name), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    test_session_store.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    `CachedSessionStore`的批量写入(需要fakeredis)
+
+"""
+import unittest
+
+import fakeredis
+
+from logic import session_store
+from logic.session_store import CachedSessionStore, RedisSessionStore, \
+    SessionStore
+
+
+class CountingStore(RedisSessionStore):
+    """记录写入次数"""
+
+    def __init__(self, redis):
+        super(CountingStore, self).__init__(redis)
+        self.saves = 0
+        self.batches = 0
+        self.on_save_many = None
+
+    def save(self, sid, data, ttl):
+        self.saves += 1
+        super(CountingStore, self).save(sid, data, ttl)
+
+    def save_many(self, items):
+        self.batches += 1
+        if self.on_save_many is not None:
+            self.on_save_many()
+        super(CountingStore, self).save_many(items)
+
+
+class CachedSessionStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.redis = fakeredis.FakeStrictRedis()
+        self.backend = CountingStore(self.redis)
+
+    def make_store(self, write_behind):
+        store = CachedSessionStore(self.backend, self.redis,
+                                   write_behind=write_behind)
+        # 不启动后台greenlet，由测试调用flush
+        store._listener = store._flusher = object()
+        return store
+
+    def test_write_through(self):
+        store = self.make_store(False)
+        store.save_later('a', {'n': 1}, 60)
+        self.assertEqual(self.backend.saves, 1)
+        self.assertEqual(self.backend.get('a'), {'n': 1})
+
+    def test_write_behind_coalesces(self):
+        store = self.make_store(True)
+        for i in range(5):
+            store.save_later('a', {'n': i}, 60)
+        store.save_later('b', {'n': 0}, 60)
+        self.assertIsNone(self.backend.get('a'))
+        # 本进程读到未写入的修改(即使本地缓存已经淘汰)
+        store.cache.clear()
+        self.assertEqual(store.get('a'), {'n': 4})
+
+        self.assertEqual(store.flush(), 2)
+        self.assertEqual(self.backend.batches, 1)
+        self.assertEqual(self.backend.saves, 0)
+        self.assertEqual(store.coalesced, 4)
+        self.assertEqual(self.backend.get('a'), {'n': 4})
+        self.assertEqual(self.backend.get('b'), {'n': 0})
+        self.assertEqual(self.redis.ttl('session:a'), 60)
+
+    def test_delete_drops_pending_write(self):
+        store = self.make_store(True)
+        store.save_later('a', {'n': 1}, 60)
+        store.delete('a')
+        self.assertEqual(store.flush(), 0)
+        self.assertIsNone(store.get('a'))
+        self.assertIsNone(self.backend.get('a'))
+
+    def test_delete_during_flush_wins(self):
+        store = self.make_store(True)
+        store.save_later('a', {'n': 1}, 60)
+        # 写入过程中(greenlet切换)session被撤销
+        self.backend.on_save_many = lambda: store.delete('a')
+        store.flush()
+        self.assertIsNone(self.backend.get('a'))
+
+    def test_base_store_save_later(self):
+        calls = []
+
+        class Store(SessionStore):
+            def save(self, sid, data, ttl):
+                calls.append((sid, data, ttl))
+
+        Store().save_later('a', {}, 60)
+        Store().save_many([('b', {}, 1), ('c', {}, 2)])
+        self.assertEqual([sid for sid, _, _ in calls], ['a', 'b', 'c'])
+
+    def test_listen_without_pubsub(self):
+        store = self.make_store(False)
+
+        def broken_pubsub(**kwargs):
+            raise ConnectionError('down')
+
+        store.redis = type('Redis', (object,), {})()
+        store.redis.pubsub = broken_pubsub
+
+        class Stop(BaseException):
+            pass
+
+        def stop(seconds):
+            raise Stop()
+
+        sleep = session_store.gevent.sleep
+        session_store.gevent.sleep = stop
+        try:
+            # pubsub创建失败时不会因为关闭未定义的pubsub而抛出NameError
+            with self.assertRaises(Stop):
+                store._listen()
+        finally:
+            session_store.gevent.sleep = sleep
+
+
+if __name__ == '__main__':
+    unittest.main()
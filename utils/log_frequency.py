@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    log_frequency.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    `FrequencyFilter`的计数后端
+
+    所有后端实现同一个接口`allow(key, limit, window)`: 在任意`window`秒内，
+    同一个key最多放行`limit`次(只统计放行的次数)。
+
+    * `MemoryFrequencyBackend` - 进程内滑动窗口，精确但不跨进程
+    * `RedisFrequencyBackend` - redis zset + lua脚本，一次调用完成判断，精确且跨进程
+    * `MongoFrequencyBackend` - 按窗口分段的计数文档 + 本地计数表，
+      定期批量合并到mongo，跨进程近似准确
+
+"""
+import atexit
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from .model.frequency_cache import FrequencyCache
+
+
+class FrequencyBackend(object):
+    """计数后端基类"""
+
+    def allow(self, key, limit, window):
+        """
+        :param key: log指纹
+        :param limit: window内最多放行的次数
+        :param window: 窗口长度(秒)
+        :return ok: 是否放行
+        """
+        raise (NotImplementedError())
+
+
+class MemoryFrequencyBackend(FrequencyBackend):
+    """进程内滑动窗口(记录每次放行的时间)"""
+
+    def __init__(self, max_keys=10000):
+        """
+        :param max_keys: 超过该数量时清理已经过期的key
+        """
+        self._max_keys = max_keys
+        self._hits = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key, limit, window):
+        now = time.time()
+        with self._lock:
+            hits = self._hits.get(key)
+            if hits is None:
+                if len(self._hits) >= self._max_keys:
+                    self._prune(now, window)
+                hits = self._hits[key] = deque()
+            while hits and hits[0] <= now - window:
+                hits.popleft()
+            if len(hits) >= limit:
+                return False
+            hits.append(now)
+            return True
+
+    def _prune(self, now, window):
+        for key in [k for k, hits in self._hits.items()
+                    if not hits or hits[-1] <= now - window]:
+            del self._hits[key]
+
+
+# KEYS[1]: zset key
+# ARGV: now, window, limit, member
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now, ARGV[4])
+redis.call('PEXPIRE', KEYS[1], math.ceil(window * 1000))
+return 1
+"""
+
+
+class RedisFrequencyBackend(FrequencyBackend):
+    """redis滑动窗口"""
+
+    def __init__(self, redis=None, key_prefix='log_frequency:'):
+        """
+        :param redis: Redis链接，默认为`cache._r`
+        :param key_prefix: redis key前缀
+        """
+        if redis is None:
+            from cache import _r as redis
+        self._redis = redis
+        self._key_prefix = key_prefix
+        self._script = redis.register_script(SLIDING_WINDOW_SCRIPT)
+
+    def allow(self, key, limit, window):
+        member = uuid.uuid4().hex
+        ok = self._script(
+            keys=[self._key_prefix + key],
+            args=[time.time(), window, limit, member])
+        return bool(ok)
+
+
+class MongoFrequencyBackend(FrequencyBackend):
+    """mongo滑动窗口(近似)
+
+    时间按window分段，每段一个计数文档(`<key>|<window>|<段序号>`)。
+    放行判断使用上一段和当前段的加权和:
+        上一段次数 * (1 - 当前段已过去的比例) + 当前段次数
+    每个进程在本地维护计数表，直接在本地判断是否放行，不在`logger.error`中
+    访问mongo。本地新增的次数由后台线程每隔`flush_interval`秒通过一次
+    `bulk_write`($inc)合并到mongo，同时读回各文档的总数，因此多进程之间的
+    频率限制是近似准确的(误差不超过一个刷新周期内其他进程的新增次数)。
+    文档在两个窗口后由TTL索引删除，TTL的清理延迟不影响判断。
+    """
+
+    def __init__(self, flush_interval=5):
+        """
+        :param flush_interval: 本地计数合并到mongo的间隔(秒)
+        """
+        self._flush_interval = flush_interval
+
+        # 文档id -> [本地未合并的次数, 上次合并时mongo中的总数, 过期时间]
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def allow(self, key, limit, window):
+        now = time.time()
+        index = int(now // window)
+        cur_id = '%s|%s|%d' % (key, window, index)
+        prev_id = '%s|%s|%d' % (key, window, index - 1)
+        weight = 1 - (now - index * window) / float(window)
+
+        with self._lock:
+            cur = self._counts.get(cur_id)
+            if cur is None:
+                cur = self._counts[cur_id] = [0, 0, (index + 2) * window]
+            prev = self._counts.get(prev_id)
+            v = cur[0] + cur[1]
+            if prev is not None:
+                v += (prev[0] + prev[1]) * weight
+            ok = v < limit
+            if ok:
+                cur[0] += 1
+
+        if self._flusher is None:
+            self._start_flusher()
+        return ok
+
+    def _start_flusher(self):
+        """启动后台合并线程(gevent monkey patch后为greenlet)"""
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop)
+            self._flusher.daemon = True
+        self._flusher.start()
+        atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self._flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                # 不能使用logger，避免递归
+                sys.stderr.write(traceback.format_exc())
+
+    def flush(self):
+        """ 把本地计数合并到mongo，并读回各文档的总数
+        """
+        now = time.time()
+        with self._lock:
+            pending = {}
+            for doc_id, counter in list(self._counts.items()):
+                if counter[0]:
+                    pending[doc_id] = (counter[0], counter[2])
+                    counter[0] = 0
+                elif counter[2] <= now:
+                    del self._counts[doc_id]
+            doc_ids = list(self._counts)
+        if not doc_ids:
+            return
+
+        try:
+            if pending:
+                FrequencyCache.p_col.bulk_write([
+                    UpdateOne(
+                        {'_id': doc_id},
+                        {
+                            '$inc': {FrequencyCache.Field.data: count},
+                            '$setOnInsert': {
+                                FrequencyCache.Field.expire_at:
+                                    datetime.utcfromtimestamp(expire_at)
+                            }
+                        },
+                        upsert=True
+                    ) for doc_id, (count, expire_at) in pending.items()
+                ], ordered=False)
+            totals = {
+                doc['_id']: doc[FrequencyCache.Field.data]
+                for doc in FrequencyCache.p_col.find(
+                    {'_id': {'$in': doc_ids}},
+                    {FrequencyCache.Field.data: 1}
+                )
+            }
+        except Exception:
+            # 合并失败，把次数放回本地等待下次合并
+            with self._lock:
+                for doc_id, (count, expire_at) in pending.items():
+                    self._counts.setdefault(
+                        doc_id, [0, 0, expire_at])[0] += count
+            raise
+
+        with self._lock:
+            for doc_id in doc_ids:
+                counter = self._counts.get(doc_id)
+                if counter is not None:
+                    counter[1] = totals.get(doc_id, 0)
+
+
+def get_frequency_backend(backend):
+    """
+    :param backend: 后端实例，或者名称('memory', 'redis', 'mongo')
+    :return backend: `FrequencyBackend`实例
+    """
+    if isinstance(backend, FrequencyBackend):
+        return backend
+    backends = {
+        'memory': MemoryFrequencyBackend,
+        'redis': RedisFrequencyBackend,
+        'mongo': MongoFrequencyBackend,
+    }
+    if backend not in backends:
+        raise ValueError('Unknown frequency backend: %s' % backend)
+    return backends[backend]()
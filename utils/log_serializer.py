@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    log_serializer.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    有长度限制的log序列化(供`FileFormatter`使用)
+
+    log超过长度限制时只保留开头和结尾，中间用`......`代替。对于dict消息，
+    不再完整`json.dumps`之后再截取，而是:
+    * 从头遍历数据结构生成json片段，超过开头的长度后立即停止
+    * 从尾部倒序遍历数据结构生成json片段，得到结尾部分
+    超长的字符串只编码需要的部分。输出结果与`json.dumps(ensure_ascii=False)`
+    截取后的结果完全一致。
+
+"""
+import json
+from json.encoder import encode_basestring, INFINITY
+
+TRUNCATE_MARK = '......'
+# 无法估算长度时使用的上限
+_UNBOUNDED = float('inf')
+
+
+def _float_str(o):
+    if o != o:
+        return 'NaN'
+    if o == INFINITY:
+        return 'Infinity'
+    if o == -INFINITY:
+        return '-Infinity'
+    return float.__repr__(o)
+
+
+def _scalar_str(o):
+    """编码非字符串的标量，容器类型返回None"""
+    if o is None:
+        return 'null'
+    if o is True:
+        return 'true'
+    if o is False:
+        return 'false'
+    if isinstance(o, int):
+        return int.__repr__(o)
+    if isinstance(o, float):
+        return _float_str(o)
+    return None
+
+
+def _key_str(k):
+    """dict的key转换成字符串(与json模块规则一致)"""
+    if isinstance(k, str):
+        return k
+    s = _scalar_str(k)
+    if s is None:
+        raise TypeError('keys must be str, int, float, bool or None, '
+                        'not %s' % k.__class__.__name__)
+    return s
+
+
+def _not_serializable(o):
+    return TypeError('Object of type %s is not JSON serializable'
+                     % o.__class__.__name__)
+
+
+def _enter(o, markers):
+    marker = id(o)
+    if marker in markers:
+        raise ValueError('Circular reference detected')
+    markers.add(marker)
+
+
+def _iter_head(o, limit, markers):
+    """从头生成json片段，超过limit的字符串只编码前limit个字符"""
+    if isinstance(o, str):
+        if len(o) > limit:
+            yield encode_basestring(o[:limit])[:-1]
+        else:
+            yield encode_basestring(o)
+        return
+    s = _scalar_str(o)
+    if s is not None:
+        yield s
+        return
+
+    if isinstance(o, dict):
+        if not o:
+            yield '{}'
+            return
+        _enter(o, markers)
+        yield '{'
+        first = True
+        for k, v in o.items():
+            if not first:
+                yield ', '
+            first = False
+            k = _key_str(k)
+            if len(k) <= limit:
+                yield encode_basestring(k)
+            else:
+                yield from _iter_head(k, limit, markers)
+            yield ': '
+            if isinstance(v, str) and len(v) <= limit:
+                # 短字符串直接编码，减少生成器嵌套
+                yield encode_basestring(v)
+            else:
+                yield from _iter_head(v, limit, markers)
+        yield '}'
+        markers.discard(id(o))
+    elif isinstance(o, (list, tuple)):
+        if not o:
+            yield '[]'
+            return
+        _enter(o, markers)
+        yield '['
+        first = True
+        for v in o:
+            if not first:
+                yield ', '
+            first = False
+            if isinstance(v, str) and len(v) <= limit:
+                yield encode_basestring(v)
+            else:
+                yield from _iter_head(v, limit, markers)
+        yield ']'
+        markers.discard(id(o))
+    else:
+        raise _not_serializable(o)
+
+
+def _iter_tail(o, limit, markers):
+    """从尾部倒序生成json片段，超过limit的字符串只编码后limit个字符"""
+    if isinstance(o, str):
+        if len(o) > limit:
+            yield encode_basestring(o[-limit:])[1:]
+        else:
+            yield encode_basestring(o)
+        return
+    s = _scalar_str(o)
+    if s is not None:
+        yield s
+        return
+
+    if isinstance(o, dict):
+        if not o:
+            yield '{}'
+            return
+        _enter(o, markers)
+        yield '}'
+        items = list(o.items())
+        for i in range(len(items) - 1, -1, -1):
+            k, v = items[i]
+            yield from _iter_tail(v, limit, markers)
+            yield ': '
+            yield from _iter_tail(_key_str(k), limit, markers)
+            if i:
+                yield ', '
+        yield '{'
+        markers.discard(id(o))
+    elif isinstance(o, (list, tuple)):
+        if not o:
+            yield '[]'
+            return
+        _enter(o, markers)
+        yield ']'
+        for i in range(len(o) - 1, -1, -1):
+            yield from _iter_tail(o[i], limit, markers)
+            if i:
+                yield ', '
+        yield '['
+        markers.discard(id(o))
+    else:
+        raise _not_serializable(o)
+
+
+def _size_bound(o, budget):
+    """估算json长度的上限，超过budget后立即返回
+    只处理内置类型，其他类型返回无穷大
+    """
+    t = type(o)
+    if t is str:
+        # 最坏情况下每个字符都转义成\u00XX
+        return len(o) * 6 + 2
+    if t is dict:
+        size = 2
+        for k, v in o.items():
+            if type(k) is not str:
+                return _UNBOUNDED
+            size += len(k) * 6 + 6 + _size_bound(v, budget)
+            if size > budget:
+                return size
+        return size
+    if t is list or t is tuple:
+        size = 2
+        for v in o:
+            size += 2 + _size_bound(v, budget)
+            if size > budget:
+                return size
+        return size
+    if t is bool or o is None:
+        return 5
+    if t is int:
+        return o.bit_length() // 3 + 2
+    if t is float:
+        return 24
+    return _UNBOUNDED
+
+
+def _collect(chunks, limit):
+    """收集片段直到长度超过limit
+    :return (parts, complete): complete表示已经遍历完整个结构
+    """
+    parts = []
+    size = 0
+    for chunk in chunks:
+        parts.append(chunk)
+        size += len(chunk)
+        if size > limit:
+            chunks.close()
+            return parts, False
+    return parts, True
+
+
+def bounded_json(prefix, obj, limit=1000, head=500, tail=500):
+    """
+    等价于:
+        s = prefix + json.dumps(obj, ensure_ascii=False)
+        if len(s) > limit:
+            s = s[:head] + '......' + s[-tail:]
+    但不会序列化整个obj
+    :param prefix: 前缀
+    :param obj: 需要序列化的数据
+    :param limit: 最大长度
+    :param head: 超长时保留开头的长度
+    :param tail: 超长时保留结尾的长度
+    """
+    budget = max(limit - len(prefix), 0)
+    if _size_bound(obj, budget) <= budget:
+        # 小数据直接使用json模块(C实现)
+        return prefix + json.dumps(obj, ensure_ascii=False)
+
+    parts, complete = _collect(_iter_head(obj, budget, set()), budget)
+    body = ''.join(parts)
+    if complete:
+        return bounded_text(prefix, body, limit, head, tail)
+
+    head_text = (prefix + body[:head])[:head]
+    parts, complete = _collect(_iter_tail(obj, tail, set()), tail)
+    body = ''.join(reversed(parts))
+    if complete:
+        tail_text = (prefix[-tail:] + body)[-tail:]
+    else:
+        tail_text = body[-tail:]
+    return head_text + TRUNCATE_MARK + tail_text
+
+
+def bounded_text(prefix, text, limit=1000, head=500, tail=250):
+    """
+    等价于:
+        s = prefix + text
+        if len(s) > limit:
+            s = s[:head] + '......' + s[-tail:]
+    但不会拼接完整的超长字符串
+    """
+    if len(prefix) + len(text) <= limit:
+        return prefix + text
+    head_text = (prefix + text[:head])[:head]
+    if tail <= 0:
+        tail_text = ''
+    elif len(text) >= tail:
+        tail_text = text[-tail:]
+    else:
+        tail_text = (prefix[-tail:] + text)[-tail:]
+    return head_text + TRUNCATE_MARK + tail_text
@@ -10,37 +10,55 @@
     get_logger()初始化
     
 """
-import json
+import _thread
+import copy
+import gzip
 import os
+import shutil
+import sys
+import threading
 import time
-from datetime import datetime
+import traceback
+from collections import deque
+from contextlib import contextmanager
 from logging import (
-    Filter, INFO, DEBUG,
-    Formatter, getLogger, StreamHandler
+    Filter, INFO, DEBUG, ERROR,
+    Formatter, Handler, getLevelName, getLogger, StreamHandler
 )
-from logging.handlers import TimedRotatingFileHandler
-from pymongo import ReturnDocument
+from logging.handlers import BaseRotatingHandler, TimedRotatingFileHandler
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 from configs import ProjectConf, LoggerConf
-from .model.frequency_cache import FrequencyCache
+from .log_frequency import get_frequency_backend
+from .log_serializer import bounded_json, bounded_text
 
 
 class FrequencyFilter(Filter):
     """ Filter for log frequency
+
+    同一个log指纹在任意`interval_time`秒内最多输出`repeat_count + 1`次，
+    计数由可替换的后端完成(见`utils.log_frequency`)
     """
 
     def __init__(self, name='', prefix=None,
-                 repeat_count=3, interval_time=3600):
+                 repeat_count=3, interval_time=3600, backend='mongo'):
         """
         :param name: filter名称，默认不填
         :param prefix: 用于区分不同的handler，避免同一个filter被多个handler调用而影响频率
         :param repeat_count: 报错重复的次数
         :param interval_time: 报错间隔时间
+        :param backend: 计数后端，`FrequencyBackend`实例或者名称
+            ('memory', 'redis', 'mongo')
         """
         Filter.__init__(self, name=name)
         self._repeat_count = repeat_count
         self._interval_time = interval_time
         self._prefix = prefix
+        self._backend = get_frequency_backend(backend)
 
     def filter(self, record):
         """ Filter if the custom log
@@ -60,22 +78,15 @@ class FrequencyFilter(Filter):
             params.append(self._prefix)
         key = ','.join(params)
 
-        # get redis value of this key
-        cache = FrequencyCache.p_col.find_one_and_update(
-            {'_id': key},
-            {
-                '$inc': {FrequencyCache.Field.data: 1},
-                '$setOnInsert': {
-                    '_id': key,
-                    FrequencyCache.Field.time: datetime.utcnow()
-                }
-            },
-            return_document=ReturnDocument.AFTER,
-            upsert=True
-        )
-        v = cache[FrequencyCache.Field.data]
-
-        if v <= self._repeat_count + 1:
+        try:
+            ok = self._backend.allow(
+                key, self._repeat_count + 1, self._interval_time)
+        except Exception:
+            # 后端异常时直接输出，不能使用logger，避免递归
+            sys.stderr.write(traceback.format_exc())
+            ok = True
+
+        if ok:
             # will be handled
             return 1
         else:
@@ -217,37 +228,128 @@ class CustomLogFilter(Filter):
 #     return messager
 
 
+class SamplingFilter(Filter):
+    """ 高频log自适应采样
+
+    同一个log指纹(位置+级别)在每个`window`秒内前`first_n`条全部输出，之后每
+    `M`条输出1条。`M`按logger名称或级别配置，`keep_level`及以上级别全部输出。
+    输出的record带有`sample_rate`属性(每条代表的原始条数)，用于还原数量。
+    """
+
+    def __init__(self, name='', rates=None, first_n=10, window=60,
+                 keep_level=ERROR, max_keys=10000):
+        """
+        :param name: filter名称，默认不填
+        :param rates: 采样间隔M的配置，key为logger名称或级别(如`INFO`,
+            `'WARNING'`)，logger名称优先。未配置的全部输出
+        :param first_n: 每个窗口内全部输出的条数
+        :param window: 窗口长度(秒)
+        :param keep_level: 该级别及以上全部输出
+        :param max_keys: 超过该数量时清理过期的指纹
+        """
+        Filter.__init__(self, name=name)
+        self._level_rates = {}
+        self._logger_rates = {}
+        for key, rate in (rates or {}).items():
+            level = key if isinstance(key, int) else getLevelName(key)
+            if isinstance(level, int):
+                self._level_rates[level] = rate
+            else:
+                self._logger_rates[key] = rate
+        self._first_n = first_n
+        self._window = window
+        self._keep_level = keep_level
+        self._max_keys = max_keys
+        # 指纹 -> [窗口开始时间, 窗口内条数]
+        self._counters = {}
+
+    def _rate(self, record):
+        rate = self._logger_rates.get(record.name)
+        if rate is None:
+            rate = self._level_rates.get(record.levelno, 1)
+        return rate
+
+    def filter(self, record):
+        """ Sample the record
+        """
+        if super(SamplingFilter, self).filter(record) == 0:
+            return 0
+        record.sample_rate = 1
+        if record.levelno >= self._keep_level:
+            return 1
+        rate = self._rate(record)
+        if rate <= 1:
+            return 1
+
+        key = (record.name, record.pathname, record.lineno, record.levelno)
+        now = record.created
+        counter = self._counters.get(key)
+        if counter is None:
+            if len(self._counters) >= self._max_keys:
+                self._prune(now)
+            counter = self._counters[key] = [now, 0]
+        elif now - counter[0] >= self._window:
+            counter[0] = now
+            counter[1] = 0
+        counter[1] += 1
+
+        extra = counter[1] - self._first_n
+        if extra <= 0:
+            return 1
+        if extra % rate == 0:
+            record.sample_rate = rate
+            return 1
+        return 0
+
+    def _prune(self, now):
+        for key in [k for k, counter in self._counters.items()
+                    if now - counter[0] >= self._window]:
+            del self._counters[key]
+        if len(self._counters) >= self._max_keys:
+            self._counters.clear()
+
+
 class FileFormatter(Formatter):
     """ For recording json format data log
     """
+    # 缓存的前缀模板数量上限
+    MAX_CACHED_PREFIXES = 4096
 
     def __init__(self):
         super(FileFormatter, self).__init__()
+        # (level_name, pathname, line_no, function_name) -> 前缀中时间之后的部分
+        self._prefixes = {}
+
+    def _prefix(self, record):
+        """生成log前缀，除时间以外的部分按record位置缓存"""
+        layout = (record.levelname, record.pathname, record.lineno,
+                  record.funcName)
+        static = self._prefixes.get(layout)
+        if static is None:
+            if len(self._prefixes) >= self.MAX_CACHED_PREFIXES:
+                self._prefixes.clear()
+            static = self._prefixes[layout] = (
+                ']|{level_name}|{pathname}|line:{line_no}|{function_name}|'
+            ).format(
+                level_name=record.levelname,
+                pathname=record.pathname,
+                line_no=record.lineno,
+                function_name=record.funcName
+            )
+        prefix = '[' + self.formatTime(record, self.datefmt) + static
+        sample_rate = getattr(record, 'sample_rate', 1)
+        if sample_rate > 1:
+            prefix += 'sample_rate:%s|' % sample_rate
+        return prefix
 
     def format(self, record):
         """ Override format function"""
-        line = (
-            '[{time}]|{level_name}|{pathname}|line:{line_no}|'
-            '{function_name}|%s'
-        ).format(
-            time=self.formatTime(record, self.datefmt),
-            level_name=record.levelname,
-            pathname=record.pathname,
-            line_no=record.lineno,
-            function_name=record.funcName
-        )
+        prefix = self._prefix(record)
+        # 防止log太大
         if isinstance(record.msg, dict):
-            s = line % json.dumps(record.msg, ensure_ascii=False)
-            # 防止log太大
-            if len(s) > 1000:
-                s = s[:500] + '......' + s[-500:]
-            return s
+            return bounded_json(prefix, record.msg, 1000, 500, 500)
         else:
-            s = line % str(record.msg)
-            # 防止log太大
-            if len(s) > 1000:
-                s = s[:500] + '......' + s[-250:]
-            return s
+            return bounded_text(prefix, str(record.msg), 1000, 500, 250)
 
 
 class SpecifyLevelFilter(Filter):
@@ -268,24 +370,190 @@ class SpecifyLevelFilter(Filter):
         return 0
 
 
+GZIP_SUFFIX = '.gz'
+
+
+def _gzip_file(path):
+    """gzip压缩文件，完成后删除原文件
+    :return path: 压缩后的文件路径
+    """
+    gz_path = path + GZIP_SUFFIX
+    tmp_path = gz_path + '.tmp'
+    with open(path, 'rb') as src, gzip.open(tmp_path, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.rename(tmp_path, gz_path)
+    os.remove(path)
+    return gz_path
+
 
 class ConcurrentTimedRotatingFileHandler(TimedRotatingFileHandler):
     """
     ConcurrentTimedRotatingFileHandler: A smart replacement for the standard
     TimedRotatingFileHandler, the primary difference being that this handler
     support multiprocessing
+
+    多进程写同一个文件时，切分文件由`<filename>.lock`文件锁(fcntl)协调:
+    只有第一个进程重命名文件，其他进程在锁内发现已经切分后直接重新打开。
+    写入前定期比较文件的inode，文件被其他进程(或logrotate)替换后重新打开。
+
+    `buffer_size`大于0时启用缓冲模式: record先缓存在内存中，缓存超过
+    `buffer_size`字节、距离上次写入超过`flush_interval`秒或者遇到
+    `flush_level`及以上级别的record时一次性写入。
+
+    切分后的文件由后台原生线程维护，不占用写log的请求:
+    * `compress`为True时用gzip压缩切分后的文件
+    * 按`backupCount`(文件数)和`max_total_bytes`(总字节数)删除最早的文件
     """
+    # 检查文件inode的间隔(秒)
+    REOPEN_CHECK_INTERVAL = 1
+    # 切分后等待该时间(秒)再维护，等其他进程切换到新文件
+    MAINTAIN_DELAY = 10
 
     def __init__(self, filename, when='h', interval=1, backupCount=0,
-                 encoding=None, delay=False, utc=False):
+                 encoding=None, delay=False, utc=False, buffer_size=0,
+                 flush_interval=1, flush_level=ERROR, compress=False,
+                 max_total_bytes=0):
+        """
+        :param buffer_size: 缓冲区大小(字节)，为0时每条record直接写入
+        :param flush_interval: 缓冲模式下最长的写入间隔(秒)
+        :param flush_level: 缓冲模式下立即写入的最低级别
+        :param compress: 是否gzip压缩切分后的文件
+        :param max_total_bytes: 切分后的文件总大小上限(字节)，为0则不限制
+        """
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.flush_level = flush_level
+        self.compress = compress
+        self.max_total_bytes = max_total_bytes
+        self._maintain_lock = _native_primitives()[1]()
+        self._maintaining = False
+        self._buffer = []
+        self._buffered = 0
+        self._inode = None
+        self._last_check = 0
+        self._lock_fd = None
+        self._flusher_pid = None
         super(ConcurrentTimedRotatingFileHandler, self).__init__(
             filename, when=when, interval=interval,
             backupCount=backupCount, encoding=encoding, delay=delay, utc=utc)
 
+    def _open(self):
+        stream = super(ConcurrentTimedRotatingFileHandler, self)._open()
+        self._inode = os.fstat(stream.fileno()).st_ino
+        self._last_check = time.time()
+        return stream
+
+    def _reopen_if_replaced(self):
+        """文件被其他进程切分或删除后重新打开"""
+        now = time.time()
+        if now - self._last_check < self.REOPEN_CHECK_INTERVAL:
+            return
+        self._last_check = now
+        try:
+            inode = os.stat(self.baseFilename).st_ino
+        except OSError:
+            inode = None
+        if inode != self._inode:
+            self.stream.close()
+            self.stream = self._open()
+
+    @contextmanager
+    def _rotation_lock(self):
+        """跨进程的切分锁"""
+        if fcntl is None:
+            yield
+            return
+        if self._lock_fd is None:
+            self._lock_fd = os.open(self.baseFilename + '.lock',
+                                    os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def emit(self, record):
+        if not self.buffer_size:
+            if self.stream is not None:
+                try:
+                    # 文件被其他进程或logrotate切分后重新打开(按间隔检查)
+                    self._reopen_if_replaced()
+                except Exception:
+                    self.handleError(record)
+                    return
+            super(ConcurrentTimedRotatingFileHandler, self).emit(record)
+            return
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            line = self.format(record) + self.terminator
+            self._buffer.append(line)
+            self._buffered += len(line)
+            if record.levelno >= self.flush_level \
+                    or self._buffered >= self.buffer_size:
+                self._flush_buffer()
+            elif self._flusher_pid != os.getpid():
+                self._start_flusher()
+        except Exception:
+            self.handleError(record)
+
+    def _start_flusher(self):
+        """启动按时间写入的后台线程(gevent monkey patch后为greenlet)"""
+        self._flusher_pid = os.getpid()
+        flusher = threading.Thread(target=self._flush_loop)
+        flusher.daemon = True
+        flusher.start()
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._flusher_pid == pid:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _flush_buffer(self):
+        """把缓冲区一次性写入文件(调用者持有handler锁)"""
+        if not self._buffer:
+            return
+        data = ''.join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        if self.stream is None:
+            self.stream = self._open()
+        else:
+            self._reopen_if_replaced()
+        self.stream.write(data)
+        self.stream.flush()
+
+    def flush(self):
+        self.acquire()
+        try:
+            try:
+                self._flush_buffer()
+            except Exception:
+                # 缓冲区的数据已经无法写入
+                sys.stderr.write(traceback.format_exc())
+            super(ConcurrentTimedRotatingFileHandler, self).flush()
+        finally:
+            self.release()
+
+    def close(self):
+        self.acquire()
+        try:
+            self.flush()
+            self._flusher_pid = None
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+            super(ConcurrentTimedRotatingFileHandler, self).close()
+        finally:
+            self.release()
+
     def doRollover(self):
         """
         Overwrite doRollover()
         """
+        # 缓冲区中的record属于切分前的文件
+        self._flush_buffer()
         if self.stream:
             self.stream.close()
             self.stream = None
@@ -319,23 +587,411 @@ class ConcurrentTimedRotatingFileHandler(TimedRotatingFileHandler):
                     addend = 3600
                 newRolloverAt += addend
 
-        if os.path.exists(dfn):
-            pass
-        else:
-            if os.path.exists(self.baseFilename):
+        with self._rotation_lock():
+            # 已经存在说明其他进程已经切分过，直接打开新文件即可
+            if not os.path.exists(dfn) \
+                    and not os.path.exists(dfn + GZIP_SUFFIX) \
+                    and os.path.exists(self.baseFilename):
                 os.rename(self.baseFilename, dfn)
-
-        if self.backupCount > 0:
-            for s in self.getFilesToDelete():
-                os.remove(s)
         if not self.delay:
             self.stream = self._open()
 
         self.rolloverAt = newRolloverAt
+        if self.backupCount > 0 or self.compress or self.max_total_bytes:
+            self._schedule_maintain()
+
+    def _schedule_maintain(self):
+        """在后台原生线程中维护切分后的文件"""
+        with self._maintain_lock:
+            if self._maintaining:
+                return
+            self._maintaining = True
+        start_new_thread = _native_primitives()[0]
+        start_new_thread(self._maintain_loop, ())
+
+    def _maintain_loop(self):
+        sleep = _native_primitives()[3]
+        try:
+            sleep(self.MAINTAIN_DELAY)
+            self.maintain()
+        except Exception:
+            sys.stderr.write(traceback.format_exc())
+        finally:
+            with self._maintain_lock:
+                self._maintaining = False
+
+    def _rotated_files(self):
+        """切分后的文件(包括已压缩的)，按时间从早到晚排序"""
+        dir_name, base_name = os.path.split(self.baseFilename)
+        prefix = base_name + '.'
+        result = []
+        for file_name in os.listdir(dir_name):
+            if not file_name.startswith(prefix):
+                continue
+            suffix = file_name[len(prefix):]
+            if suffix.endswith(GZIP_SUFFIX):
+                suffix = suffix[:-len(GZIP_SUFFIX)]
+            if self.extMatch.match(suffix):
+                result.append(os.path.join(dir_name, file_name))
+        result.sort()
+        return result
+
+    def maintain(self):
+        """压缩切分后的文件并按数量和总大小删除最早的文件
+        多个进程同时维护时，只有拿到锁的进程执行。使用单独的锁文件，
+        压缩时不会阻塞其他进程切分文件
+        """
+        lock_fd = None
+        if fcntl is not None:
+            lock_fd = os.open(self.baseFilename + '.maintain.lock',
+                              os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # 其他进程正在维护
+                os.close(lock_fd)
+                return
+        try:
+            files = self._rotated_files()
+            if self.compress:
+                settled = time.time() - self.MAINTAIN_DELAY
+                for i, path in enumerate(files):
+                    if path.endswith(GZIP_SUFFIX) \
+                            or os.path.getmtime(path) > settled:
+                        continue
+                    files[i] = _gzip_file(path)
+
+            sizes = []
+            for path in files:
+                try:
+                    sizes.append((path, os.path.getsize(path)))
+                except OSError:
+                    pass
+            count = len(sizes)
+            total = sum(size for _, size in sizes)
+            for path, size in sizes:
+                too_many = 0 < self.backupCount < count
+                too_large = 0 < self.max_total_bytes < total
+                if not too_many and not too_large:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                count -= 1
+                total -= size
+        finally:
+            if lock_fd is not None:
+                fcntl.flock(lock_fd, fcntl.LOCK_UN)
+                os.close(lock_fd)
+
+
+def _native_primitives():
+    """获取原生的线程原语
+
+    gevent monkey patch之后`threading`会变成greenlet，文件写入仍然会阻塞
+    整个hub，所以异步写log需要使用原生线程
+    :return (start_new_thread, allocate_lock, rlock, sleep):
+    """
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            return (
+                monkey.get_original('_thread', 'start_new_thread'),
+                monkey.get_original('_thread', 'allocate_lock'),
+                monkey.get_original('_thread', 'RLock'),
+                monkey.get_original('time', 'sleep'),
+            )
+    except ImportError:
+        pass
+    return (_thread.start_new_thread, _thread.allocate_lock, _thread.RLock,
+            time.sleep)
+
+
+class _NativeCondition(object):
+    """
+    原生锁实现的条件变量: gevent monkey patch之后`threading.Condition`的
+    等待锁是greenlet锁，不能由原生写线程通知
+    """
+
+    def __init__(self, lock, allocate_lock):
+        """
+        :param lock: 原生锁(调用`wait`/`notify_all`时需要持有)
+        :param allocate_lock: 原生锁的构造函数
+        """
+        self._lock = lock
+        self._allocate_lock = allocate_lock
+        self._waiters = deque()
+
+    def wait(self, timeout):
+        """释放锁等待通知或超时，返回前重新获得锁"""
+        waiter = self._allocate_lock()
+        waiter.acquire()
+        self._waiters.append(waiter)
+        self._lock.release()
+        try:
+            waiter.acquire(True, timeout)
+        finally:
+            self._lock.acquire()
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                # 已经被通知
+                pass
+
+    def notify_all(self):
+        while self._waiters:
+            self._waiters.popleft().release()
+
+
+def _snapshot(obj, markers=None):
+    """复制dict/list/tuple结构(其他对象不复制)，循环引用保持原样"""
+    if not isinstance(obj, (dict, list, tuple)):
+        return obj
+    if markers is None:
+        markers = set()
+    if id(obj) in markers:
+        return obj
+    markers.add(id(obj))
+    try:
+        if isinstance(obj, dict):
+            return {k: _snapshot(v, markers) for k, v in obj.items()}
+        items = [_snapshot(v, markers) for v in obj]
+        return items if isinstance(obj, list) else tuple(items)
+    finally:
+        markers.discard(id(obj))
+
+
+_exc_formatter = Formatter()
+
+
+class AsyncLogHandler(Handler):
+    """
+    异步log handler: `emit`只把record放入有界队列，由独立的原生线程批量
+    格式化并写入目标handler，请求的耗时不再受磁盘延迟影响。
+
+    record入队前在调用线程中固定内容(见`prepare`)，调用者之后修改msg中的
+    可变对象不会影响写入的内容。
+
+    队列满时的处理策略:
+    * `block` - 等待写线程取走一批record后通知(原生锁，gevent下会阻塞整个
+      hub，直到写线程腾出空位)
+    * `drop_oldest` - 丢弃队列中最早的record
+    * `drop_debug` - 优先丢弃DEBUG及以下级别的record，没有时丢弃最早的record
+    """
+    OVERFLOW_BLOCK = 'block'
+    OVERFLOW_DROP_OLDEST = 'drop_oldest'
+    OVERFLOW_DROP_DEBUG = 'drop_debug'
+
+    def __init__(self, handlers, queue_size=10000, overflow=OVERFLOW_BLOCK,
+                 batch_size=500, flush_interval=0.05):
+        """
+        :param handlers: 实际输出的handler列表
+        :param queue_size: 队列最大长度
+        :param overflow: 队列满时的处理策略
+        :param batch_size: 每批最多写入的record数
+        :param flush_interval: 队列为空时写线程的等待间隔(秒)
+        """
+        if overflow not in (self.OVERFLOW_BLOCK, self.OVERFLOW_DROP_OLDEST,
+                            self.OVERFLOW_DROP_DEBUG):
+            raise ValueError('Unknown overflow policy: %s' % overflow)
+        Handler.__init__(self)
+        self.handlers = list(handlers)
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+
+        self._start_new_thread, allocate_lock, rlock, self._native_sleep = \
+            _native_primitives()
+        self._queue_lock = allocate_lock()
+        # 写线程取走record后通知block策略的等待者
+        self._not_full = _NativeCondition(self._queue_lock, allocate_lock)
+        self._queue = deque()
+        self._debug_count = 0
+        self._writing = False
+        self._closed = False
+        self._writer_pid = None
+
+        # 目标handler只在写线程中使用，替换成原生锁
+        for handler in self.handlers:
+            handler.lock = rlock()
+
+    def prepare(self, record):
+        """
+        复制record并固定内容(同`QueueHandler.prepare`):
+        * dict消息(`FileFormatter`按json输出)复制一份数据结构
+        * 其他消息与args合并成字符串
+        * 异常信息格式化到`exc_text`
+        """
+        record = copy.copy(record)
+        if isinstance(record.msg, dict) and not record.args:
+            record.msg = _snapshot(record.msg)
+        else:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _exc_formatter.formatException(
+                    record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            record = self.prepare(record)
+        except Exception:
+            self.handleError(record)
+            return
+        if self._writer_pid != os.getpid():
+            self._start_writer()
+        with self._queue_lock:
+            while True:
+                if len(self._queue) < self.queue_size:
+                    self._append(record)
+                    return
+                if self.overflow == self.OVERFLOW_DROP_OLDEST:
+                    self._drop_oldest()
+                    self._append(record)
+                    return
+                if self.overflow == self.OVERFLOW_DROP_DEBUG:
+                    if record.levelno <= DEBUG:
+                        self.dropped += 1
+                        return
+                    self._drop_debug()
+                    self._append(record)
+                    return
+                # block: 等待写线程通知，超时后重新检查(写线程退出时不会
+                # 一直等待)
+                self._not_full.wait(1)
+
+    def _append(self, record):
+        self._queue.append(record)
+        if record.levelno <= DEBUG:
+            self._debug_count += 1
+
+    def _drop_oldest(self):
+        record = self._queue.popleft()
+        if record.levelno <= DEBUG:
+            self._debug_count -= 1
+        self.dropped += 1
+
+    def _drop_debug(self):
+        if self._debug_count:
+            for i, record in enumerate(self._queue):
+                if record.levelno <= DEBUG:
+                    del self._queue[i]
+                    self._debug_count -= 1
+                    self.dropped += 1
+                    return
+        self._drop_oldest()
+
+    def _start_writer(self):
+        """启动写线程(fork之后在子进程中重新启动)"""
+        with self._queue_lock:
+            if self._writer_pid == os.getpid():
+                return
+            self._writer_pid = os.getpid()
+        self._start_new_thread(self._writer_loop, ())
+
+    def _take_batch(self):
+        with self._queue_lock:
+            batch = []
+            while self._queue and len(batch) < self.batch_size:
+                record = self._queue.popleft()
+                if record.levelno <= DEBUG:
+                    self._debug_count -= 1
+                batch.append(record)
+            self._writing = bool(batch)
+            if batch:
+                self._not_full.notify_all()
+            return batch
+
+    def _writer_loop(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                if self._closed:
+                    return
+                self._native_sleep(self.flush_interval)
+                continue
+            for handler in self.handlers:
+                self._write_batch(handler, batch)
+            with self._queue_lock:
+                self._writing = False
+
+    @staticmethod
+    def _write_batch(handler, records):
+        """把一批record写入handler，文件类handler合并成一次写入"""
+        if not isinstance(handler, StreamHandler):
+            for record in records:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+            return
+
+        lines = []
+        last = None
+        for record in records:
+            if record.levelno < handler.level or not handler.filter(record):
+                continue
+            try:
+                if isinstance(handler, BaseRotatingHandler) and \
+                        handler.shouldRollover(record):
+                    AsyncLogHandler._write_lines(handler, lines)
+                    lines = []
+                    handler.doRollover()
+                lines.append(handler.format(record))
+                last = record
+            except Exception:
+                handler.handleError(record)
+        try:
+            AsyncLogHandler._write_lines(handler, lines)
+        except Exception:
+            handler.handleError(last)
+
+    @staticmethod
+    def _write_lines(handler, lines):
+        if not lines:
+            return
+        handler.acquire()
+        try:
+            if handler.stream is None:
+                handler.stream = handler._open()
+            elif isinstance(handler, ConcurrentTimedRotatingFileHandler):
+                # 文件被其他进程或logrotate切分后重新打开
+                handler._reopen_if_replaced()
+            handler.stream.write(
+                handler.terminator.join(lines) + handler.terminator)
+            handler.stream.flush()
+        finally:
+            handler.release()
+
+    def flush(self, timeout=5):
+        """等待队列中的record全部写入"""
+        if self._writer_pid != os.getpid():
+            return
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self._queue_lock:
+                if not self._queue and not self._writing:
+                    return
+            self._native_sleep(0.01)
+
+    def close(self):
+        """写完队列中的record后关闭目标handler"""
+        self.flush()
+        self._closed = True
+        for handler in self.handlers:
+            handler.close()
+        Handler.close(self)
 
 
 def get_logger(name=None, filename=None, when='D', interval=1, backup_count=60,
-               notify=True, formatter_args=None):
+               notify=True, formatter_args=None, async_mode=False,
+               queue_size=10000, overflow=AsyncLogHandler.OVERFLOW_BLOCK,
+               buffer_size=0, compress=False, max_total_bytes=0,
+               sampling=None):
     """ Get traceback logger
     :param name: logger名称
     :param filename: logger输出文件名（只需要文件名，放在log目录下）
@@ -344,6 +1000,13 @@ def get_logger(name=None, filename=None, when='D', interval=1, backup_count=60,
     :param backup_count: 保存logger文件数量
     :param notify: 是否发送通知(级别为ERROR以上的需要发送短信和邮件通知)
     :param formatter_args: Formatter类参数
+    :param async_mode: 是否异步写log(见`AsyncLogHandler`)
+    :param queue_size: 异步模式的队列长度
+    :param overflow: 异步模式队列满时的处理策略
+    :param buffer_size: 文件写入缓冲区大小(字节)，为0则每条log直接写入
+    :param compress: 是否在后台gzip压缩切分后的log文件
+    :param max_total_bytes: 切分后的log文件总大小上限(字节)，为0则不限制
+    :param sampling: 高频log采样配置(`SamplingFilter`的参数dict)，为None则不采样
     """
     if name:
         log = getLogger(name)
@@ -364,24 +1027,45 @@ def get_logger(name=None, filename=None, when='D', interval=1, backup_count=60,
         filename,
         when=when,
         interval=interval,
-        backupCount=backup_count
+        backupCount=backup_count,
+        buffer_size=buffer_size,
+        compress=compress,
+        max_total_bytes=max_total_bytes
     )
     file_handler.setFormatter(formatter)
     file_handler.setLevel(INFO)
-    log.addHandler(file_handler)
+    handlers = [file_handler]
 
     if ProjectConf.DEBUG:
         formatter = FileFormatter()
         stream_handler = StreamHandler()
         stream_handler.setFormatter(formatter)
         stream_handler.setLevel(DEBUG)
-        log.addHandler(stream_handler)
+        handlers.append(stream_handler)
         log.setLevel(DEBUG)
 
     else:
         log.setLevel(INFO)
 
+    if sampling:
+        log.addFilter(SamplingFilter(**sampling))
+
+    if async_mode:
+        log.addHandler(AsyncLogHandler(
+            handlers, queue_size=queue_size, overflow=overflow))
+    else:
+        for handler in handlers:
+            log.addHandler(handler)
+
     return log
 
 
-logger = get_logger()
+logger = get_logger(
+    async_mode=LoggerConf.ASYNC_MODE,
+    queue_size=LoggerConf.ASYNC_QUEUE_SIZE,
+    overflow=LoggerConf.ASYNC_OVERFLOW,
+    buffer_size=LoggerConf.FILE_BUFFER_SIZE,
+    compress=LoggerConf.COMPRESS_ROTATED,
+    max_total_bytes=LoggerConf.MAX_TOTAL_BYTES,
+    sampling=LoggerConf.SAMPLING
+)
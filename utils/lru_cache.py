@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    lru_cache.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    进程内带过期时间的LRU缓存
+
+"""
+import time
+from collections import OrderedDict
+
+# 用于区分"没有缓存"和"缓存了None"
+MISSING = object()
+
+
+class TTLLRUCache(object):
+    """带过期时间的LRU缓存
+
+    所有greenlet在同一个线程中运行，各操作中不会切换，所以不需要加锁
+    """
+
+    def __init__(self, maxsize=10000, ttl=60):
+        """
+        :param maxsize: 最多缓存的数量，超过后淘汰最久没有使用的
+        :param ttl: 默认过期时间(秒)
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (value, 过期时间)
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=MISSING):
+        """获取缓存，没有或者已过期时返回default"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        if entry[1] <= time.time():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """设置缓存
+        :param ttl: 过期时间(秒)，默认使用`self.ttl`
+        """
+        if ttl is None:
+            ttl = self.ttl
+        self._data[key] = (value, time.time() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key):
+        """删除缓存"""
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def items(self):
+        """没有过期的(key, value)列表，不影响LRU顺序和命中统计"""
+        now = time.time()
+        return [(key, entry[0]) for key, entry in self._data.items()
+                if entry[1] > now]
+
+    def stats(self):
+        """统计信息"""
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
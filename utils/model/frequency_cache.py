@@ -5,7 +5,6 @@
     ~~~~~~~~~~~~~~~~~~~~~~~
     
 """
-from pymongo.collection import Collection
 from pymongo.operations import IndexModel
 from pymongo.read_preferences import ReadPreference
 
@@ -18,12 +17,12 @@ class FrequencyCache(object):
     """
     COL_NAME = 'frequency_cache'
 
-    p_col = Collection(
-        _db, COL_NAME,
+    p_col = _db.get_collection(
+        COL_NAME,
         read_preference=ReadPreference.PRIMARY_PREFERRED
     )
-    s_col = Collection(
-        _db, COL_NAME,
+    s_col = _db.get_collection(
+        COL_NAME,
         read_preference=ReadPreference.SECONDARY_PREFERRED
     )
 
@@ -31,12 +30,17 @@ class FrequencyCache(object):
         _id = '_id'
         data = 'data'
         time = 'time'
+        expire_at = 'expire_at'
 
     try:
         indexes = list()
         indexes.append(
             IndexModel(Field.time, expireAfterSeconds=3600)
         )
+        # 按窗口分段的计数文档，到expire_at时删除
+        indexes.append(
+            IndexModel(Field.expire_at, expireAfterSeconds=0)
+        )
         p_col.create_indexes(indexes)
     except Exception as e:
         pass
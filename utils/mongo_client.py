@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    mongo_client.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    共享的MongoClient
+
+    同一个连接地址只创建一个`MongoClient`(一套连接池和监控线程)，
+    `model`和`utils.model`的db都从这里获取。连接池大小为各用途
+    (`MongoConf.POOL_SIZES`)的连接数之和。
+
+    每个用途的连接数由`PurposeLimiter`(BoundedSemaphore)限制: `get_db`返回
+    的`PurposeDatabase`创建的collection和cursor在每次操作(cursor每次取数据)
+    时占用一个名额，某个用途用完自己的名额后只会等待自己的请求，不会占用
+    其他用途的连接。等待名额的时间即为取连接的等待时间。
+
+    * collection需要通过`db.get_collection()`/`db[name]`获取，直接
+      `Collection(db, name)`创建的不受限制
+    * `aggregate`等返回CommandCursor的操作只限制第一次请求
+    * 同一个greenlet中嵌套的操作(例如`find_one`内部的cursor)只占用一个名额
+
+    pymongo 3.2没有连接池事件，另外通过`CommandListener`统计各client正在
+    执行的命令数、峰值、命令数和耗时。
+
+"""
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from pymongo import MongoClient, ReadPreference
+from pymongo.collection import Collection
+from pymongo.cursor import Cursor
+from pymongo.database import Database
+from pymongo.monitoring import CommandListener
+
+# url -> MongoClient
+_clients = {}
+# url -> PoolMetrics
+_metrics = {}
+# 用途 -> PurposeLimiter
+_limiters = {}
+_lock = threading.Lock()
+
+
+class PoolMetrics(CommandListener):
+    """client的命令统计"""
+
+    def __init__(self):
+        self.in_use = 0
+        self.max_in_use = 0
+        self.commands = 0
+        self.failures = 0
+        self.duration = 0.0
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        with self._lock:
+            self.in_use += 1
+            self.commands += 1
+            if self.in_use > self.max_in_use:
+                self.max_in_use = self.in_use
+
+    def succeeded(self, event):
+        with self._lock:
+            self.in_use -= 1
+            self.duration += event.duration_micros / 1e6
+
+    def failed(self, event):
+        with self._lock:
+            self.in_use -= 1
+            self.failures += 1
+            self.duration += event.duration_micros / 1e6
+
+
+class PurposeLimiter(object):
+    """一个用途的连接名额"""
+
+    def __init__(self, purpose, limit):
+        """
+        :param purpose: 用途名称
+        :param limit: 最多同时使用的连接数
+        """
+        self.purpose = purpose
+        self.limit = limit
+        self._semaphore = threading.BoundedSemaphore(limit)
+        # gevent monkey patch之后为greenlet本地变量
+        self._local = threading.local()
+        self.in_use = 0
+        self.max_in_use = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    @contextmanager
+    def checkout(self):
+        """占用一个名额，嵌套调用时不重复占用"""
+        depth = getattr(self._local, 'depth', 0)
+        if depth:
+            self._local.depth = depth + 1
+            try:
+                yield
+            finally:
+                self._local.depth = depth
+            return
+
+        start = time.time()
+        self.waiting += 1
+        try:
+            self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        waited = time.time() - start
+        self.in_use += 1
+        self.checkouts += 1
+        self.wait_time += waited
+        if waited > self.max_wait_time:
+            self.max_wait_time = waited
+        if self.in_use > self.max_in_use:
+            self.max_in_use = self.in_use
+        self._local.depth = 1
+        try:
+            yield
+        finally:
+            self._local.depth = 0
+            self.in_use -= 1
+            self._semaphore.release()
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'in_use': self.in_use,
+            'max_in_use': self.max_in_use,
+            'waiting': self.waiting,
+            'checkouts': self.checkouts,
+            'wait_time': self.wait_time,
+            'max_wait_time': self.max_wait_time,
+        }
+
+
+def get_limiter(purpose, limit):
+    """
+    获取用途的连接名额，不存在时创建
+    :param purpose: 用途名称
+    :param limit: 创建时的名额数
+    """
+    limiter = _limiters.get(purpose)
+    if limiter is None:
+        with _lock:
+            limiter = _limiters.get(purpose)
+            if limiter is None:
+                limiter = _limiters[purpose] = PurposeLimiter(purpose, limit)
+    return limiter
+
+
+def _limited(method):
+    """操作期间占用所属用途的连接名额"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.limiter.checkout():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class PurposeCursor(Cursor):
+    """每次取数据时占用连接名额的cursor"""
+
+    @property
+    def limiter(self):
+        return self.collection.database.limiter
+
+    next = _limited(Cursor.next)
+    __next__ = next
+
+
+class PurposeCollection(Collection):
+    """操作时占用连接名额的collection"""
+
+    @property
+    def limiter(self):
+        return self.database.limiter
+
+    def find(self, *args, **kwargs):
+        return PurposeCursor(self, *args, **kwargs)
+
+
+# 占用连接的collection操作(只包装当前pymongo版本中存在的)
+_COLLECTION_OPERATIONS = (
+    'find_one', 'insert_one', 'insert_many', 'replace_one', 'update_one',
+    'update_many', 'delete_one', 'delete_many', 'find_one_and_delete',
+    'find_one_and_replace', 'find_one_and_update', 'bulk_write', 'count',
+    'count_documents', 'estimated_document_count', 'distinct', 'aggregate',
+    'create_index', 'create_indexes', 'ensure_index', 'drop_index',
+    'drop_indexes', 'index_information', 'list_indexes', 'drop', 'rename',
+    'insert', 'update', 'remove', 'save', 'find_and_modify', 'map_reduce',
+    'inline_map_reduce', 'group',
+)
+for _name in _COLLECTION_OPERATIONS:
+    if hasattr(Collection, _name):
+        setattr(PurposeCollection, _name,
+                _limited(getattr(Collection, _name)))
+
+
+class PurposeDatabase(Database):
+    """创建`PurposeCollection`的database"""
+
+    def __init__(self, client, name, limiter, **kwargs):
+        """
+        :param client: MongoClient
+        :param name: 数据库名
+        :param limiter: 所属用途的`PurposeLimiter`
+        """
+        super(PurposeDatabase, self).__init__(client, name, **kwargs)
+        self.limiter = limiter
+
+    def __getitem__(self, name):
+        return self.get_collection(name)
+
+    def get_collection(self, name, **kwargs):
+        return PurposeCollection(self, name, **kwargs)
+
+    command = _limited(Database.command)
+
+
+def get_client(url, max_pool_size):
+    """
+    获取url对应的client，不存在时创建
+    :param url: 连接地址
+    :param max_pool_size: 创建client时的连接池大小
+    :return client:
+    """
+    client = _clients.get(url)
+    if client is not None:
+        return client
+    with _lock:
+        client = _clients.get(url)
+        if client is None:
+            metrics = PoolMetrics()
+            client = MongoClient(url, connect=False,
+                                 maxPoolSize=max_pool_size,
+                                 event_listeners=[metrics])
+            _metrics[url] = metrics
+            _clients[url] = client
+    return client
+
+
+def get_db(database, host='localhost:27017', is_auth=False,
+           user='', pwd='', is_replica=False, replica='',
+           max_pool_size=100, purpose='default', purpose_limit=None):
+    """
+    获取db实例
+    :param database: 数据库
+    :param host: 服务器地址
+    :param is_auth: 是否验证用户
+    :param user: 用户名
+    :param pwd: 密码
+    :param is_replica:  是否是集群
+    :param replica: 集群名称
+    :param max_pool_size: 连接池大小(只在第一次创建client时生效)
+    :param purpose: 用途名称，同一用途共享连接名额
+    :param purpose_limit: 该用途最多同时使用的连接数，默认为`max_pool_size`
+        (只在第一次获取该用途时生效)
+    :return db: `PurposeDatabase`
+    """
+    if is_replica:
+        url = 'mongodb://%s/?replicaSet=%s' % (host, replica)
+    else:
+        url = host
+
+    limiter = get_limiter(purpose, purpose_limit or max_pool_size)
+    db = PurposeDatabase(get_client(url, max_pool_size), database, limiter)
+
+    if is_auth:
+        db.authenticate(user, pwd)
+
+    return db
+
+
+def warm_up(db, count):
+    """
+    预先建立连接(并完成认证)，避免启动后的第一批请求等待建立连接
+    :param db: 数据库
+    :param count: 主节点和从节点各建立的连接数
+    """
+    def ping(read_preference):
+        db.command('ping', read_preference=read_preference)
+
+    # 同时执行ping，每个ping各占用一个连接
+    threads = [
+        threading.Thread(target=ping, args=(read_preference,))
+        for read_preference in (ReadPreference.PRIMARY,
+                                ReadPreference.SECONDARY_PREFERRED)
+        for _ in range(count)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def pool_stats():
+    """
+    各client的命令统计
+    :return stats: url -> 统计信息
+    """
+    return {url: {
+        'in_use': metrics.in_use,
+        'max_in_use': metrics.max_in_use,
+        'commands': metrics.commands,
+        'failures': metrics.failures,
+        'duration': metrics.duration,
+    } for url, metrics in list(_metrics.items())}
+
+
+def purpose_stats():
+    """
+    各用途的连接名额统计
+    :return stats: 用途 -> 统计信息
+    """
+    return {purpose: limiter.stats()
+            for purpose, limiter in list(_limiters.items())}
+
+
+def render():
+    """输出Prometheus文本格式"""
+    lines = []
+    stats = pool_stats()
+    for name, kind, help_text in (
+            ('in_use', 'gauge', 'Mongo commands in progress.'),
+            ('max_in_use', 'gauge', 'Peak Mongo commands in progress.'),
+            ('commands', 'counter', 'Mongo commands started.'),
+            ('failures', 'counter', 'Mongo commands failed.'),
+            ('duration', 'counter', 'Mongo command time in seconds.')):
+        metric = 'mongo_pool_%s' % name
+        lines.append('# HELP %s %s' % (metric, help_text))
+        lines.append('# TYPE %s %s' % (metric, kind))
+        for index, url in enumerate(sorted(stats)):
+            # url可能包含用户名密码，使用序号区分client
+            lines.append('%s{client="%d"} %s'
+                         % (metric, index, stats[url][name]))
+
+    stats = purpose_stats()
+    for name, kind, help_text in (
+            ('limit', 'gauge', 'Mongo connections allowed for a purpose.'),
+            ('in_use', 'gauge', 'Mongo connections in use by a purpose.'),
+            ('max_in_use', 'gauge', 'Peak Mongo connections in use.'),
+            ('waiting', 'gauge', 'Callers waiting for a Mongo connection.'),
+            ('checkouts', 'counter', 'Mongo connection checkouts.'),
+            ('wait_time', 'counter',
+             'Time spent waiting for a Mongo connection in seconds.'),
+            ('max_wait_time', 'gauge',
+             'Longest wait for a Mongo connection in seconds.')):
+        metric = 'mongo_purpose_%s' % name
+        lines.append('# HELP %s %s' % (metric, help_text))
+        lines.append('# TYPE %s %s' % (metric, kind))
+        for purpose in sorted(stats):
+            lines.append('%s{purpose="%s"} %s'
+                         % (metric, purpose, stats[purpose][name]))
+    return '\n'.join(lines) + '\n'